@@ -0,0 +1,180 @@
+import os
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import BinaryIO, Tuple
+
+from sqlalchemy import and_, bindparam, delete, func, select, union, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models, storage, utils
+from .config import settings
+
+"""
+##### Content Addressed Blob Store #####
+
+Uploads are stored once per content under sha256 of their bytes, as
+object of storage backend (storage.py):
+
+    ab/cd/abcd...ef.jpeg   (key "abcd...ef.jpeg" is file name in url)
+
+: same file uploaded again reuse stored blob (no new file, same url)
+: blob never change, getfile serve it with immutable cache headers
+: blob table keep size, upload times and refcount
+: completed_at is set once object is stored, direct uploads (upload-url)
+  are pending until upload-complete, variants jobs start on first completion
+
+Refcount is number of User.photo and Book.cover_image urls pointing at
+blob. It is counted by gc from those columns instead of being adjusted in
+every write path (bulk and single statement updates never load old urls).
+gc delete blobs with no references whose last upload is older than
+BLOB_GC_GRACE, so fresh uploads survive until client save their url.
+Candidates are deleted in batches, each delete statement check references
+with one scan of photo and cover_image urls (keys taken after last '/').
+
+    python -m app.blobs
+
+"""
+
+KEY_PATTERN = re.compile(r'^[0-9a-f]{64}\.[0-9a-z]+$')
+
+
+def is_blob_key(name: str) -> bool:
+    return bool(KEY_PATTERN.match(name))
+
+def object_name(key: str) -> str:
+    # Two levels of 256 prefixes keep directory listings small
+    return f'{key[:2]}/{key[2:4]}/{key}'
+
+def key_of_url(url: str) -> str:
+    return url.rsplit('/', 1)[-1]
+
+def touch(db: Session, key: str, size: int):
+    """
+    Create blob row or move its uploaded_at, later uploaded_at keep blob away from running gc
+    """
+    now = datetime.now()
+    blob = db.get(models.Blob, key)
+    if blob is None:
+        db.add(models.Blob(key=key, size=size, created_at=now, uploaded_at=now))
+    else:
+        blob.uploaded_at = now
+    try:
+        db.commit()
+    except IntegrityError:
+        # Same content uploaded at same time
+        db.rollback()
+        db.execute(update(models.Blob).where(models.Blob.key == key).values(uploaded_at=now))
+        db.commit()
+
+def complete(db: Session, key: str) -> bool:
+    """
+    Mark blob stored, True only for first completion (its variants jobs are enqueued once)
+    """
+    result = db.execute(update(models.Blob).where(models.Blob.key == key, models.Blob.completed_at.is_(None))
+        .values(completed_at=datetime.now()).execution_options(synchronize_session=False))
+    db.commit()
+    return result.rowcount == 1
+
+def store(db: Session, source: BinaryIO, extension: str) -> Tuple[str, bool]:
+    """
+    Store upload as blob, return key and True when content was not stored before
+    """
+    temp_path, size, sha256 = utils.copy_to_temp(storage.backend.temp_directory(), source,
+        settings.FILE_MAX_SIZE, settings.FILE_CHUNK_SIZE)
+    key = f'{sha256}.{extension}'
+
+    try:
+        touch(db, key, size)
+
+        name = object_name(key)
+        new = not storage.backend.exists(name)
+        if new:
+            storage.backend.put_file(name, temp_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+    # Object put by direct upload which was never completed is new too
+    return key, complete(db, key) or new
+
+
+def count_references(db: Session) -> Counter:
+    references = Counter()
+    for column in (models.User.photo, models.Book.cover_image):
+        result = db.execute(select(column).where(column.isnot(None)).execution_options(yield_per=settings.STREAM_BATCH_SIZE))
+        for url in result.scalars():
+            key = key_of_url(url)
+            if is_blob_key(key):
+                references[key] += 1
+    return references
+
+def url_key(column):
+    # Text after last '/' of url (rtrim strip every char but '/' from end), same on postgres and sqlite
+    return func.substr(column, func.length(func.rtrim(column, func.replace(column, '/', ''))) + 1)
+
+def referenced_keys():
+    """
+    Keys of every photo and cover_image url, subquery run once per statement (no scan per blob)
+    """
+    return union(
+        select(url_key(models.Book.cover_image)).where(models.Book.cover_image.isnot(None)),
+        select(url_key(models.User.photo)).where(models.User.photo.isnot(None)),
+    )
+
+def collect(db: Session, grace: int = None) -> Tuple[int, int]:
+    """
+    Update refcounts and delete unreferenced blobs older than grace seconds,
+    return number of deleted blobs and freed bytes
+    """
+    grace = settings.BLOB_GC_GRACE if grace is None else grace
+    references = count_references(db)
+
+    changed = [
+        {'b_key': key, 'b_refcount': references.get(key, 0)}
+        for key, refcount in db.execute(select(models.Blob.key, models.Blob.refcount))
+        if references.get(key, 0) != refcount
+    ]
+    if changed:
+        db.execute(
+            update(models.Blob).where(models.Blob.key == bindparam('b_key')).values(refcount=bindparam('b_refcount')),
+            changed,
+        )
+        db.commit()
+
+    cutoff = datetime.now() - timedelta(seconds=grace)
+    candidates = db.execute(
+        select(models.Blob.key, models.Blob.size).where(models.Blob.refcount == 0, models.Blob.uploaded_at < cutoff)
+    ).all()
+
+    deleted, freed = 0, 0
+    batch_size = settings.STREAM_BATCH_SIZE
+    for start in range(0, len(candidates), batch_size):
+        sizes = dict(candidates[start:start + batch_size])
+
+        # Reference check inside delete statement, urls saved after counting still protect blob
+        db.execute(delete(models.Blob).where(and_(
+            models.Blob.key.in_(sizes), models.Blob.refcount == 0, models.Blob.uploaded_at < cutoff,
+            models.Blob.key.not_in(referenced_keys()),
+        )).execution_options(synchronize_session=False))
+        db.commit()
+
+        # Rows still there were kept (or uploaded again meanwhile)
+        kept = set(db.execute(select(models.Blob.key).where(models.Blob.key.in_(sizes))).scalars())
+        for key, size in sizes.items():
+            if key in kept:
+                continue
+
+            # Blob and its variants (precompressed, resized)
+            storage.backend.delete_prefix(object_name(key))
+            deleted, freed = deleted + 1, freed + size
+    return deleted, freed
+
+
+if __name__ == '__main__':
+    from .database import Session as SessionLocal
+
+    with SessionLocal() as db:
+        deleted, freed = collect(db)
+    print(f'deleted {deleted} blobs, freed {freed} bytes')
@@ -0,0 +1,112 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from sqlalchemy import and_, bindparam, delete, insert, select, update
+
+from . import models
+from .config import settings
+
+"""
+##### Bulk Book Operations #####
+
+Every item is validated on its own and reported in per item results, valid
+items are written in a single transaction with few statements:
+
+: create (INSERT ... RETURNING in batches, bulk_insert_mappings without RETURNING)
+: update (one executemany UPDATE per set of updated fields)
+: delete (DELETE ... RETURNING, select then delete without RETURNING)
+
+RETURNING is used when dialect support it for every statement, SQLite on
+SQLAlchemy 1.4 does not.
+
+"""
+
+INSERT_BATCH = 1000 # rows per INSERT statement, keep bound parameters under driver limits
+
+
+def check_size(items: list):
+    if len(items) > settings.BOOK_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"too many books, send at most {settings.BOOK_BULK_MAX_ITEMS} per request")
+
+def validate_items(items: list, schema) -> Tuple[List[Tuple[int, object]], Dict[int, dict]]:
+    """
+    Validate items with schema, return [(index, model)] of valid items and results of invalid ones by index
+    """
+    valid, results = [], {}
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, schema.parse_obj(item)))
+        except ValidationError as e:
+            errors = [dict(field='.'.join(map(str, error['loc'])), message=error['msg']) for error in e.errors()]
+            results[index] = dict(index=index, status='invalid', errors=errors)
+    return valid, results
+
+def summary(results: List[dict], action: str):
+    succeeded = sum(result['status'] == action for result in results)
+    return dict(total=len(results), **{action: succeeded}, failed=len(results) - succeeded)
+
+
+async def insert_books(db, rows: List[dict]) -> List[int]:
+    """
+    Insert book mappings and return their ids in same order
+    """
+    if db.get_bind().dialect.full_returning:
+        ids = []
+        for start in range(0, len(rows), INSERT_BATCH):
+            result = await db.execute(insert(models.Book).values(rows[start:start + INSERT_BATCH]).returning(models.Book.id))
+            # Sequence values are drawn in VALUES order
+            ids.extend(sorted(result.scalars().all()))
+        return ids
+
+    # Without RETURNING ids are filled in mappings
+    def bulk_insert(session):
+        session.bulk_insert_mappings(models.Book, rows, return_defaults=True)
+        return [row['id'] for row in rows]
+
+    return await db.run_sync(bulk_insert)
+
+async def owned_ids(db, user_id: int, ids: List[int]) -> set:
+    query = select(models.Book.id).where(and_(models.Book.id.in_(ids), models.Book.user_id == user_id))
+    return set((await db.execute(query)).scalars().all())
+
+async def update_books(db, user_id: int, items: List[Tuple[int, dict]]) -> set:
+    """
+    Update (id, values) items of user books, return ids of updated books
+    """
+    found = await owned_ids(db, user_id, [id for id, _ in items])
+    now = datetime.now()
+
+    # Same set of fields share one executemany statement
+    groups = defaultdict(list)
+    for id, values in items:
+        if id in found:
+            params = {f'new_{field}': value for field, value in values.items()}
+            groups[tuple(sorted(values))].append(dict(params, book_id=id, new_updated_at=now))
+
+    # Bind names differ from column names which are reserved for SET clause
+    for fields, params in groups.items():
+        statement = update(models.Book).where(and_(models.Book.id == bindparam('book_id'),
+            models.Book.user_id == user_id)).values({**{field: bindparam(f'new_{field}') for field in fields + ('updated_at',)},
+            'version': models.Book.version + 1})
+        await db.execute(statement.execution_options(synchronize_session=False), params)
+
+    return found
+
+async def delete_books(db, user_id: int, ids: List[int]) -> set:
+    """
+    Delete user books by ids, return ids of deleted books
+    """
+    condition = and_(models.Book.id.in_(ids), models.Book.user_id == user_id)
+
+    if db.get_bind().dialect.full_returning:
+        statement = delete(models.Book).where(condition).returning(models.Book.id)
+        result = await db.execute(statement.execution_options(synchronize_session=False))
+        return set(result.scalars().all())
+
+    found = await owned_ids(db, user_id, ids)
+    await db.execute(delete(models.Book).where(models.Book.id.in_(found)).execution_options(synchronize_session=False))
+    return found
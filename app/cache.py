@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from .config import settings
+
+"""
+##### Cache Backends #####
+
+: MemoryCache (in process, bounded LRU eviction with time to live, thread safe)
+: RedisCache (shared between workers and containers, needs redis package)
+
+get_cache pick backend from CACHE_URL setting, shared backends store str/bytes
+values so callers serialize what they cache
+
+"""
+
+class MemoryCache:
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+
+            # Evict least recently used
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:
+    def __init__(self, url: str, namespace: str, ttl: Optional[float] = None):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def key(self, key: Hashable):
+        return f"{self.namespace}:{key}"
+
+    def get(self, key: Hashable, default: Any = None):
+        value = self.client.get(self.key(key))
+        return default if value is None else value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.key(key), value, px=int(ttl * 1000) if ttl is not None else None)
+
+    def delete(self, key: Hashable):
+        self.client.delete(self.key(key))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=f"{self.namespace}:*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+def is_shared() -> bool:
+    return settings.CACHE_URL.startswith(('redis://', 'rediss://', 'unix://'))
+
+def get_cache(namespace: str, maxsize: int = 1024, ttl: Optional[float] = None):
+    if is_shared():
+        return RedisCache(settings.CACHE_URL, namespace, ttl=ttl)
+    return MemoryCache(maxsize=maxsize, ttl=ttl)
@@ -0,0 +1,120 @@
+import hashlib
+import secrets
+from typing import List, Optional
+from urllib.parse import urlencode
+
+from fastapi import Request, Response, status
+
+from . import cache, compression, counting, metrics
+from .config import settings
+from .custom import CustomResponse
+
+"""
+##### Catalog Version and Listing Cache #####
+
+Catalog version is a random token replaced on every book write, it is kept
+in cache backend (CACHE_URL) so every worker agree on it. Public listings get:
+
+: strong ETag from catalog version, path, query params and media type
+: 304 Not Modified when If-None-Match match current ETag (no query, no render)
+: rendered body cached server side under same key (LRU, shared backend)
+
+Single books have ETag "<id>-<version>" from version column of book,
+If-None-Match give 304 on GET and If-Match make PUT/DELETE conditional
+(optimistic concurrency, 412 when book changed since client read it).
+
+Keys change with version so writes never need to clear cached listings.
+With in process cache each worker has own version, it expire after
+BOOK_LISTING_CACHE_TTL so other workers serve listings (and 304) up to
+that old, use redis with many workers
+
+"""
+
+def version_cache():
+    # Shared version change for every worker at once, in process one must expire
+    return cache.get_cache('catalog', ttl=None if cache.is_shared() else settings.BOOK_LISTING_CACHE_TTL)
+
+versions = version_cache()
+listings = cache.get_cache('listing', maxsize=settings.BOOK_LISTING_CACHE_SIZE, ttl=settings.BOOK_LISTING_CACHE_TTL)
+
+listing_requests = metrics.counter('book_listing_cache_requests_total',
+    'Public listing requests by cache result (hit, miss, not_modified)')
+listing_bytes_saved = metrics.counter('book_listing_cache_bytes_saved_total',
+    'Listing body bytes not rendered (hit) or not sent (not_modified)')
+
+
+def version() -> str:
+    value = versions.get('version')
+    if value is None:
+        value = secrets.token_hex(8)
+        versions.set('version', value)
+    return value.decode() if isinstance(value, bytes) else value
+
+def changed(user_id):
+    # Every book write, new version invalidate all ETags and cached listings
+    counting.invalidate(user_id)
+    versions.set('version', secrets.token_hex(8))
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match comparison, weak comparison as allowed for GET/HEAD, ETag
+    of compressed body ("<etag>-gzip") match too
+    """
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return any(compression.decoded_etag(tag.strip().removeprefix('W/')) == etag for tag in header.split(','))
+
+def book_etag(id: int, version: int) -> str:
+    return f'"{id}-{version}"'
+
+def match_versions(header: Optional[str], id: int) -> Optional[List[int]]:
+    """
+    Versions of book listed in If-Match (strong comparison, weak tags never
+    match), None when header is absent or '*'
+    """
+    if not header or header.strip() == '*':
+        return None
+
+    versions = []
+    for tag in header.split(','):
+        book_id, _, version = compression.decoded_etag(tag.strip()).strip('"').partition('-')
+        if not tag.strip().startswith('W/') and book_id == str(id) and version.isdigit():
+            versions.append(int(version))
+    return versions
+
+def cache_headers(etag: str) -> dict:
+    return {'ETag': etag, 'Cache-Control': f'public, max-age={settings.BOOK_LISTING_MAX_AGE}'}
+
+def listing_key(request: Request, media_type: Optional[str]) -> str:
+    params = urlencode(sorted(request.query_params.multi_items()))
+    key = f"{version()}|{media_type}|{request.url.path}|{params}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def cached_listing(request: Request, key: str, media_type: Optional[str], stream: bool = False) -> Optional[Response]:
+    """
+    Return 304 or cached listing response, None when listing must be rendered
+    """
+    etag = f'"{key}"'
+    body = None if stream else listings.get(key)
+
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        listing_requests.inc(result='not_modified')
+        listing_bytes_saved.inc(len(body or b''), result='not_modified')
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag))
+
+    if body is not None:
+        listing_requests.inc(result='hit')
+        listing_bytes_saved.inc(len(body), result='hit')
+        return Response(content=body, media_type=media_type or CustomResponse.media_type, headers=cache_headers(etag))
+
+    listing_requests.inc(result='miss')
+    return None
+
+def store_listing(key: str, response: Response) -> Response:
+    # Streamed bodies are not kept, they only get ETag
+    if getattr(response, 'body', None) is not None:
+        listings.set(key, response.body)
+    response.headers.update(cache_headers(f'"{key}"'))
+    return response
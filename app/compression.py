@@ -0,0 +1,267 @@
+import mimetypes
+import os
+import zlib
+from functools import lru_cache
+from typing import Callable, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import metrics, storage
+from .config import settings
+
+try:
+    import brotli
+except ImportError: # optional, br not offered without it
+    brotli = None
+
+try:
+    import zstandard
+except ImportError: # optional, zstd not offered without it
+    zstandard = None
+
+"""
+##### Response Compression #####
+
+CompressionMiddleware negotiate Accept-Encoding (zstd, br, gzip in server
+preference order, br and zstd only when brotli/zstandard are installed) and
+compress responses:
+
+: skip bodies smaller than COMPRESSION_MINIMUM_SIZE
+: skip already encoded (export gzip, precompressed files) and not compressible types (images)
+: whole bodies get Content-Length of compressed body
+: streamed bodies are compressed chunk by chunk and flushed, so clients get rows as they come
+: ETag get -<encoding> suffix ("key" -> "key-gzip"), strong validator differ
+  between content codings, catalog accept both forms in conditional headers
+
+Precompressed variants of uploaded files are stored next to the object
+(<name>.zst, <name>.br, <name>.gz) when they are at least
+COMPRESSION_MIN_SAVING smaller, getfile serve best variant client accept.
+
+"""
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/xml', 'application/x-ndjson', 'application/msgpack',
+    'application/javascript', 'image/svg+xml',
+}
+
+# Server preference when client give same q
+ENCODINGS = [encoding for encoding, available in [('zstd', zstandard), ('br', brotli), ('gzip', zlib)] if available]
+
+EXTENSIONS = {'zstd': 'zst', 'br': 'br', 'gzip': 'gz'}
+
+# Files are compressed once, so spend max levels on them
+PRECOMPRESS_LEVELS = {'zstd': 19, 'br': 11, 'gzip': 9}
+
+# Entropy coded already, never get smaller
+PRECOMPRESS_SKIP_TYPES = {'image/jpeg', 'image/webp', 'image/gif'}
+
+compressed_bytes = metrics.counter('http_response_compression_bytes_total',
+    'Response body bytes before (stage=in) and after (stage=out) compression by encoding')
+
+
+class Compressor:
+    """
+    Same interface for every encoding: compress(chunk), flush() for
+    streamed chunks and finish() at end of body
+    """
+    def __init__(self, encoding: str, level: Optional[int] = None):
+        self.encoding = encoding
+        if encoding == 'zstd':
+            self.obj = zstandard.ZstdCompressor(level=level or settings.COMPRESSION_ZSTD_LEVEL).compressobj()
+        elif encoding == 'br':
+            self.obj = brotli.Compressor(quality=level or settings.COMPRESSION_BROTLI_QUALITY)
+        else:
+            self.obj = zlib.compressobj(level or settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31) # 31 gzip container
+
+    def compress(self, data: bytes) -> bytes:
+        return self.obj.process(data) if self.encoding == 'br' else self.obj.compress(data)
+
+    def flush(self) -> bytes:
+        if self.encoding == 'zstd':
+            return self.obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        if self.encoding == 'br':
+            return self.obj.flush()
+        return self.obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.obj.finish() if self.encoding == 'br' else self.obj.flush()
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    compressor = Compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def parse_encodings(header: str) -> dict:
+    codings = {}
+    for part in header.split(','):
+        coding, *params = part.split(';')
+        q = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'q':
+                try:
+                    q = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    q = 0.0
+        codings[coding.strip().lower()] = q
+    return codings
+
+@lru_cache(maxsize=256)
+def negotiate_encoding(accept_encoding: Optional[str], available: tuple = None) -> Optional[str]:
+    """
+    Content coding for Accept-Encoding header, None for identity
+    """
+    if not accept_encoding:
+        return None
+
+    codings = parse_encodings(accept_encoding)
+    best, best_q = None, 0.0
+    for encoding in available or ENCODINGS:
+        q = codings.get(encoding, codings.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    # Strong validator of encoded body must differ from identity one
+    return f'{etag[:-1]}-{encoding}"' if etag.endswith('"') else etag
+
+def decoded_etag(tag: str) -> str:
+    """
+    ETag of identity body for ETag of encoded body, other tags as they are
+    """
+    for encoding in EXTENSIONS:
+        suffix = f'-{encoding}"'
+        if tag.endswith(suffix):
+            return f'{tag[:-len(suffix)]}"'
+    return tag
+
+def compressible(content_type: Optional[str]) -> bool:
+    media_type = (content_type or '').split(';', 1)[0].strip().lower()
+    return media_type.startswith('text/') or media_type in COMPRESSIBLE_TYPES or media_type.endswith(('+json', '+xml'))
+
+def add_vary(headers: MutableHeaders, value: str):
+    vary = headers.get('Vary')
+    if not vary:
+        headers['Vary'] = value
+    elif value.lower() not in [item.strip().lower() for item in vary.split(',')]:
+        headers['Vary'] = f'{vary}, {value}'
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 512):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        encoding = negotiate_encoding(Headers(scope=scope).get('Accept-Encoding'))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        await CompressionResponder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start: Optional[Message] = None
+        self.compressor: Optional[Compressor] = None
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        self.if_none_match = Headers(scope=scope).get('If-None-Match', '')
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message):
+        if message['type'] == 'http.response.start':
+            headers = MutableHeaders(raw=message['headers'])
+
+            # Not modified encoded body keep ETag client has
+            if message['status'] == 304:
+                etag = headers.get('ETag')
+                if etag and encoded_etag(etag, self.encoding) in self.if_none_match:
+                    headers['ETag'] = encoded_etag(etag, self.encoding)
+                self.passthrough = True
+                return await self.send(message)
+
+            # Hold start until first body chunk tell size of response
+            self.start = message
+            self.passthrough = 'content-encoding' in headers or not compressible(headers.get('content-type'))
+            if self.passthrough:
+                await self.send(message)
+            return
+
+        if message['type'] != 'http.response.body' or self.passthrough:
+            return await self.send(message)
+
+        body, more_body = message.get('body', b''), message.get('more_body', False)
+
+        if self.compressor is None:
+            headers = MutableHeaders(raw=self.start['headers'])
+
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self.send(self.start)
+                return await self.send(message)
+
+            self.compressor = Compressor(self.encoding)
+            headers['Content-Encoding'] = self.encoding
+            add_vary(headers, 'Accept-Encoding')
+            if 'etag' in headers:
+                headers['ETag'] = encoded_etag(headers['ETag'], self.encoding)
+
+            if not more_body:
+                # Whole body known, send it with real length
+                compressed = self.compressor.compress(body) + self.compressor.finish()
+                headers['Content-Length'] = str(len(compressed))
+                self.count(len(body), len(compressed))
+                await self.send(self.start)
+                return await self.send({'type': 'http.response.body', 'body': compressed})
+
+            del headers['Content-Length']
+            await self.send(self.start)
+
+        if more_body:
+            compressed = self.compressor.compress(body) + self.compressor.flush()
+        else:
+            compressed = self.compressor.compress(body) + self.compressor.finish()
+        self.count(len(body), len(compressed))
+        await self.send({'type': 'http.response.body', 'body': compressed, 'more_body': more_body})
+
+    def count(self, size: int, compressed: int):
+        compressed_bytes.inc(size, encoding=self.encoding, stage='in')
+        compressed_bytes.inc(compressed, encoding=self.encoding, stage='out')
+
+
+def precompress(name: str, encodings: list = None, backend: storage.Storage = None):
+    """
+    Store compressed variants of object next to it, only variants smaller by
+    COMPRESSION_MIN_SAVING are kept (png is deflate already and usually get none)
+    """
+    if mimetypes.guess_type(name)[0] in PRECOMPRESS_SKIP_TYPES:
+        return
+
+    backend = backend or storage.backend
+    contents = backend.read(name)
+
+    for encoding in encodings or ENCODINGS:
+        compressed = compress(contents, encoding, PRECOMPRESS_LEVELS[encoding])
+        if len(compressed) <= len(contents) * (1 - settings.COMPRESSION_MIN_SAVING):
+            backend.put_bytes(f'{name}.{EXTENSIONS[encoding]}', compressed)
+
+def precompressed_variant(name: str, accept_encoding: Optional[str], exists: Callable[[str], bool] = os.path.exists):
+    """
+    (variant name, encoding) of best precompressed file client accept, (name, None) when none
+    """
+    available = tuple(encoding for encoding in ENCODINGS if exists(f'{name}.{EXTENSIONS[encoding]}'))
+    encoding = negotiate_encoding(accept_encoding, available) if available else None
+    if encoding is None:
+        return name, None
+    return f'{name}.{EXTENSIONS[encoding]}', encoding
@@ -1,15 +1,76 @@
-from typing import List
+from typing import Dict, List
 from pydantic import BaseSettings
 
 class Settings(BaseSettings):
     DATABASE_URL: str
+    DATABASE_ASYNC: bool = True # false run sync sessions in threadpool
+    DATABASE_POOL_SIZE: int = 5
+    DATABASE_MAX_OVERFLOW: int = 10
+    DATABASE_POOL_TIMEOUT: float = 30
+    DATABASE_POOL_RECYCLE: int = 1800 # seconds, -1 never recycle
+    DATABASE_POOL_PRE_PING: bool = True
+    DATABASE_NULL_POOL: bool = False # true when connections are pooled by PgBouncer
     JWT_PUBLIC_KEY: str
     JWT_PRIVATE_KEY: str
     REFRESH_TOKEN_EXPIRES_IN: int
     ACCESS_TOKEN_EXPIRES_IN: int
-    JWT_ALGORITHM: str
+    JWT_ALGORITHM: str # RS256, ES256 or EdDSA, matching JWT_PRIVATE_KEY / JWT_PUBLIC_KEY
+    JWT_VERIFY_CACHE_SIZE: int = 10000 # verified tokens kept per process, 0 verify every time
+    REVOCATION_BLOOM_CAPACITY: int = 100_000 # revoked tokens before bloom filter grow (on rebuild)
+    REVOCATION_BLOOM_ERROR_RATE: float = 0.01 # lookups of not revoked tokens that still query database
+    REVOCATION_SYNC_INTERVAL: float = 5 # seconds other processes take to see revocation
+    REVOCATION_REBUILD_INTERVAL: int = 60 * 60 # seconds between bloom filter rebuilds dropping expired tokens
     FILE_EXTENSIONS: List[str] = ["jpg", "jpeg", "png"]
+    FILE_MAX_SIZE: int = 10 * 1024 * 1024 # bytes per upload
+    FILE_CHUNK_SIZE: int = 64 * 1024 # bytes copied at once, upload memory is bounded by it
+    FILE_CACHE_MAX_AGE: int = 365 * 24 * 60 * 60 # immutable files (uuid and sha256 names)
+    FILE_SEND_CHUNK_SIZE: int = 256 * 1024 # bytes per body message when serving files, fewer trips through middleware
+    FILE_MAX_RANGES: int = 16 # more ranges in one request get whole file
+    IMAGE_SIZES: Dict[str, int] = {'thumb': 160, 'small': 320, 'medium': 640} # WebP variant widths, getfile?size=thumb
+    IMAGE_QUALITY: int = 80
+    IMAGE_WORKERS: int = 0 # processes, 0 use cpu count
+    IMAGE_MAX_PIXELS: int = 40_000_000 # larger images are refused (decompression bombs)
+    JOB_WORKERS: int = 2 # job queue workers per app process, 0 run no jobs in this process
+    JOB_POLL_INTERVAL: float = 1 # seconds between polls of empty queue
+    JOB_VISIBILITY_TIMEOUT: int = 300 # seconds claimed job is hidden from other workers
+    JOB_MAX_ATTEMPTS: int = 5
+    JOB_RETRY_DELAY: float = 10 # seconds before first retry, doubled on every attempt
+    JOB_RETENTION: int = 7 * 24 * 60 * 60 # seconds done and failed jobs are kept
+    JOB_CLEANUP_INTERVAL: int = 60 * 60 # seconds between cleanup jobs (blob gc, old jobs)
+    BLOB_DIRECTORY: str = 'upload/blobs' # content addressed uploads of local storage backend, sharded by sha256 prefix
+    BLOB_GC_GRACE: int = 24 * 60 * 60 # seconds unreferenced blob is kept after its last upload
+    STORAGE_BACKEND: str = 'local' # local (files in BLOB_DIRECTORY), s3 (boto3) or memory
+    STORAGE_BUCKET: str = 'bookstore'
+    STORAGE_ENDPOINT_URL: str = '' # empty for AWS, http://minio:9000 for MinIO in docker-compose
+    STORAGE_REGION: str = 'us-east-1'
+    STORAGE_ACCESS_KEY: str = '' # empty use boto3 credential chain (env, instance role)
+    STORAGE_SECRET_KEY: str = ''
+    STORAGE_POOL_SIZE: int = 20 # http connections to storage, shared by threadpool and job workers
+    STORAGE_MULTIPART_CHUNK_SIZE: int = 8 * 1024 * 1024 # bytes, larger files are uploaded in parts
+    STORAGE_PRESIGN_EXPIRES: int = 15 * 60 # seconds presigned download and upload urls are valid
+    STORAGE_REDIRECT: bool = True # getfile redirect to presigned url when backend give one
     CLIENT_ORIGIN: str
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 0 # processes, 0 use cpu count
+    PASSWORD_HASH_QUEUE: int = 64 # pending hashes before 429
+    CACHE_URL: str = '' # empty for in process cache, redis://host:6379/0 for shared cache (needs redis package)
+    PRINCIPAL_CACHE_TTL: int = 300
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    BOOK_MAX_PER_PAGE: int = 10000 # books per listing page (stream=true for large pages)
+    BOOK_COUNT_STRATEGY: str = 'exact' # exact or estimate (postgres planner statistics)
+    BOOK_COUNT_CACHE_TTL: int = 60
+    BOOK_LISTING_CACHE_SIZE: int = 1024 # rendered public listings kept
+    BOOK_LISTING_CACHE_TTL: int = 60
+    BOOK_LISTING_MAX_AGE: int = 0 # Cache-Control max-age, 0 clients revalidate with ETag
+    BOOK_BULK_MAX_ITEMS: int = 10000 # books per bulk request
+    XML_MAX_BYTES: int = 16 * 1024 * 1024 # xml request body
+    XML_MAX_DEPTH: int = 32
+    COMPRESSION_MINIMUM_SIZE: int = 512 # bytes, smaller responses are sent as is
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4 # br offered when brotli package is installed
+    COMPRESSION_ZSTD_LEVEL: int = 3 # zstd offered when zstandard package is installed
+    COMPRESSION_MIN_SAVING: float = 0.1 # precompressed file variant kept when 10% smaller
+    STREAM_BATCH_SIZE: int = 1000 # rows fetched from server side cursor per round trip
     
     class Config:
         env_file = './.env'
@@ -0,0 +1,68 @@
+import json
+from typing import Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import cache, models
+from .config import settings
+from .search import search_terms
+
+"""
+##### Book Count Strategies #####
+
+: exact (count query cached per filter and user, invalidated on book write)
+: estimate (planner row estimate on postgres, other databases fall back to exact)
+
+Listing routes skip counting entirely when client send count=false
+
+Exact counts are kept in cache backend (CACHE_URL) like catalog version, so
+book write on one worker invalidate counts of every worker (in process cache
+only its own, others count again after BOOK_COUNT_CACHE_TTL)
+
+"""
+
+# Search filter counts cover whole catalog, user counts only books of that user
+search_counts = cache.get_cache('search_count', maxsize=1024, ttl=settings.BOOK_COUNT_CACHE_TTL)
+user_counts = cache.get_cache('user_count', maxsize=4096, ttl=settings.BOOK_COUNT_CACHE_TTL)
+
+
+def invalidate(user_id):
+    # Any book write can change counts of every search but only of its own user
+    search_counts.clear()
+    user_counts.delete(str(user_id))
+
+async def exact_count(db, query) -> int:
+    return await db.scalar(query.with_only_columns(func.count(models.Book.id)).order_by(None))
+
+def planner_estimate(session: Session, query) -> int:
+    # Ask planner for estimated rows instead of running the count
+    statement = query.compile(dialect=session.get_bind().dialect)
+    params = statement.params
+    if statement.positional:
+        params = tuple(params[name] for name in statement.positiontup)
+
+    plan = session.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+async def count_books(db, query, search: str = '', user_id: Optional[str] = None,
+    strategy: Optional[str] = None) -> int:
+    """
+    Count books of (unranked) filtered select statement with configured count strategy
+    """
+    strategy = strategy or settings.BOOK_COUNT_STRATEGY
+
+    if strategy == 'estimate' and db.get_bind().dialect.name == 'postgresql':
+        return await db.run_sync(planner_estimate, query)
+
+    # Exact count cached per filter and user
+    counts, key = (user_counts, str(user_id)) if user_id is not None else (search_counts, ' '.join(search_terms(search)))
+    total = counts.get(key)
+    if total is None:
+        total = await exact_count(db, query)
+        # Shared backends store str
+        counts.set(key, str(total))
+
+    return int(total)
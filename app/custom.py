@@ -1,12 +1,13 @@
-import json
-from typing import Optional, Mapping, Callable, Any
+from functools import lru_cache
+from typing import Optional, Mapping, Callable, Any, AsyncIterable, Tuple
 
-from fastapi import Request, Response
+from fastapi import HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
 from fastapi.routing import APIRoute
 from starlette.background import BackgroundTask
 from starlette.types import Receive, Scope, Send
-from dicttoxml import dicttoxml
-import xmltodict
+from . import serializers, xmlparser
+from .config import settings
 
 class CustomResponse(Response):
     media_type = "application/xml"
@@ -21,30 +22,145 @@ class CustomResponse(Response):
         if content is None:
             return b""
         
-        if self.media_type == "application/json":
-            content = json.dumps(
-                content,
-                ensure_ascii=False,
-                allow_nan=False,
-                indent=None,
-                separators=(",", ":"),
-            )
-            return content.encode(self.charset)
-
-        if self.media_type == "application/xml":
-            return dicttoxml(obj=content, custom_root=self.custom_root)
+        # Unknown media type fallback to default (xml) serializer
+        serializer = serializers.get_serializer(self.media_type) or serializers.get_serializer(CustomResponse.media_type)
+        return serializer.render(content, self.custom_root)
+
+class CustomStreamingResponse(StreamingResponse):
+    """
+    Stream {key: [rows...], **tail()} in chunks as batches of rows arrive,
+    memory stay flat whatever number of rows
+    """
+    media_type = "application/xml"
+
+    def __init__(self, key: str, batches: AsyncIterable[list], tail: Callable[[], dict], status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None, media_type: Optional[str] = None,
+        background: Optional[BackgroundTask] = None, custom_root: Optional[str] = 'user') -> None:
+        # Unknown media type fallback to default (xml) serializer
+        serializer = serializers.get_serializer(media_type)
+        if serializer is None:
+            serializer, media_type = serializers.get_serializer(self.media_type), self.media_type
+
+        content = serializer.stream(key, batches, tail, custom_root)
+        super().__init__(content, status_code, headers, media_type, background)
+
+"""
+##### Content Negotiation #####
+
+Response format is negotiated from Accept header (q-values, type/* and */*
+ranges). Wildcards, ties and missing Accept prefer request Content-Type
+format then xml, so a json request get json response unless client ask
+otherwise. Accept allowing none of formats is answered with 406.
+
+"""
+
+# Negotiable response formats, in server preference order
+RESPONSE_MEDIA_TYPES = tuple(media_type for media_type in ("application/json", "application/xml", "application/msgpack")
+    if serializers.get_serializer(media_type))
+
+MEDIA_TYPE_ALIASES = {"text/xml": "application/xml", "application/x-msgpack": "application/msgpack"}
+
+
+def essence(media_type: Optional[str]) -> Optional[str]:
+    # "Application/JSON; charset=utf-8" -> "application/json"
+    if not media_type:
+        return None
+    media_type = media_type.split(';', 1)[0].strip().lower()
+    return MEDIA_TYPE_ALIASES.get(media_type, media_type)
+
+def parse_accept(header: str) -> Tuple[Tuple[str, float], ...]:
+    ranges = []
+    for part in header.split(','):
+        media_range, *params = part.split(';')
+        q = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'q':
+                try:
+                    q = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    q = 0.0
+        ranges.append((essence(media_range) or '', q))
+    return tuple(ranges)
+
+def quality(ranges: Tuple[Tuple[str, float], ...], media_type: str) -> float:
+    # q of most specific range matching media type
+    main_type = media_type.split('/', 1)[0]
+    best, specificity = 0.0, -1
+    for media_range, q in ranges:
+        level = 2 if media_range == media_type else 1 if media_range == f'{main_type}/*' else 0 if media_range == '*/*' else -1
+        if level > specificity:
+            best, specificity = q, level
+    return best
+
+@lru_cache(maxsize=512)
+def negotiate(accept: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    """
+    Response media type for Accept and Content-Type headers, None when nothing acceptable.
+    Cached per header strings, clients send few distinct combinations
+    """
+    preferred = essence(content_type)
+    if preferred not in RESPONSE_MEDIA_TYPES:
+        preferred = CustomResponse.media_type
+
+    if not accept:
+        return preferred
+
+    ranges = parse_accept(accept)
+    best, best_q = None, 0.0
+    for media_type in (preferred, *RESPONSE_MEDIA_TYPES):
+        q = quality(ranges, media_type)
+        if q > best_q:
+            best, best_q = media_type, q
+    return best
+
 
 class CustomRequest(Request):
     def __init__(self, scope: Scope, receive: Receive = ..., send: Send = ...):
         super().__init__(scope, receive, send)
 
+    @property
+    def media_type(self) -> str:
+        """
+        Negotiated response media type, once per request
+        """
+        media_type = getattr(self.state, 'media_type', None)
+        if media_type is None:
+            media_type = negotiate(self.headers.get('Accept'), self.headers.get('Content-Type'))
+            if media_type is None:
+                raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                    detail=f"response can be one of {', '.join(RESPONSE_MEDIA_TYPES)}")
+            self.state.media_type = media_type
+        return media_type
+
+    async def xml(self, schema: Any = None):
+        """
+        Parse xml body while it is received (limits in settings), result is cached on request
+        """
+        if not hasattr(self, '_xml'):
+            parser = xmlparser.XMLParser(max_bytes=settings.XML_MAX_BYTES, max_depth=settings.XML_MAX_DEPTH)
+            try:
+                async for chunk in self.stream():
+                    parser.feed(chunk)
+                content = parser.close()
+            except xmlparser.XMLTooLarge as e:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+            except xmlparser.XMLError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'invalid xml: {e}')
+
+            self._xml = xmlparser.coerce(content, schema)
+        return self._xml
+
     async def body(self):
-        data = await super().body()
-        content_type = self.headers.get('Content-Type')
-        
+        content_type = essence(self.headers.get('Content-Type'))
+
         if content_type == "application/xml":
-            content = xmltodict.parse(data)
-            data = content[list(content.keys())[0]]
+            return await self.xml()
+
+        data = await super().body()
+
+        if content_type == "application/msgpack" and serializers.msgpack is not None:
+            data = serializers.msgpack.unpackb(data)
 
         return data
 
@@ -52,8 +168,23 @@ class CustomRoute(APIRoute):
     def get_route_handler(self) -> Callable:
         original_route_handler = super().get_route_handler()
 
+        # Schema of request body, xml values are coerced to its field types
+        body_schema = self.body_field.type_ if self.body_field else None
+
         async def custom_route_handler(request: Request) -> Response:
             request = CustomRequest(request.scope, request.receive)
-            return await original_route_handler(request)
+
+            # Parse xml here so its errors are not turned to generic 400 by body reading
+            if body_schema is not None and essence(request.headers.get('Content-Type')) == "application/xml":
+                await request.xml(body_schema)
+
+            response = await original_route_handler(request)
+
+            # Negotiated responses differ by these request headers
+            if getattr(request.state, 'media_type', None) is not None:
+                response.headers.add_vary_header('Accept')
+                response.headers.add_vary_header('Content-Type')
+
+            return response
 
         return custom_route_handler
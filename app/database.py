@@ -1,10 +1,221 @@
-from sqlalchemy import create_engine
+import logging
+import time
+
+import anyio
+from sqlalchemy import create_engine, exc
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from starlette.concurrency import run_in_threadpool
+from . import metrics
 from .config import settings
 
-engine = create_engine(settings.DATABASE_URL)
+logger = logging.getLogger(__name__)
+
+pool_checkout_seconds = metrics.histogram('db_pool_checkout_seconds', 'Time waiting for a pool connection')
+pool_overflow_total = metrics.counter('db_pool_overflow_total', 'Connections opened beyond pool size')
+pool_timeout_total = metrics.counter('db_pool_timeout_total', 'Checkouts failed after pool timeout')
+pool_in_use = metrics.gauge('db_pool_in_use', 'Connections checked out of pool')
+pool_idle = metrics.gauge('db_pool_idle', 'Connections idle in pool')
+
+
+class PoolTelemetry:
+    """
+    Record checkout latency, overflow and timeout of QueuePool checkouts
+    """
+    pool_name = 'sync'
+
+    def _do_get(self):
+        start, overflow = time.perf_counter(), self.overflow()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_timeout_total.inc(pool=self.pool_name)
+            logger.warning('database pool (%s) exhausted: %s in use, timeout after %ss',
+                self.pool_name, self.checkedout(), self._timeout)
+            raise
+
+        pool_checkout_seconds.observe(time.perf_counter() - start, pool=self.pool_name)
+        if self.overflow() > max(overflow, 0):
+            pool_overflow_total.inc(pool=self.pool_name)
+        return connection
+
+class TelemetryQueuePool(PoolTelemetry, QueuePool):
+    pool_name = 'sync'
+
+class TelemetryAsyncQueuePool(PoolTelemetry, AsyncAdaptedQueuePool):
+    pool_name = 'async'
+
+
+def engine_options(url: str, asynchronous: bool = False):
+    """
+    Pool options of engine from settings
+    """
+    options = {}
+
+    # SQLite connection is used from different threadpool threads
+    if url.startswith('sqlite'):
+        options['connect_args'] = {'check_same_thread': False} if not asynchronous else {}
+
+    # No client side pool, connections are pooled by PgBouncer
+    if settings.DATABASE_NULL_POOL:
+        options['poolclass'] = NullPool
+        # PgBouncer transaction pooling can not keep asyncpg prepared statements
+        if asynchronous and 'asyncpg' in url:
+            options['connect_args'] = {'statement_cache_size': 0}
+        return options
+
+    # SQLite keep its default pool
+    if url.startswith('sqlite'):
+        return options
+
+    options.update(
+        poolclass=TelemetryAsyncQueuePool if asynchronous else TelemetryQueuePool,
+        pool_size=settings.DATABASE_POOL_SIZE,
+        max_overflow=settings.DATABASE_MAX_OVERFLOW,
+        pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+        pool_recycle=settings.DATABASE_POOL_RECYCLE,
+        pool_pre_ping=settings.DATABASE_POOL_PRE_PING,
+    )
+    return options
+
+def watch_pool(engine, name: str):
+    # In use and idle connection gauges read on scrape (pool may be recreated on dispose)
+    if isinstance(engine.pool, QueuePool):
+        pool_in_use.set_function(lambda: engine.pool.checkedout(), pool=name)
+        pool_idle.set_function(lambda: engine.pool.checkedin(), pool=name)
+
+
+engine = create_engine(settings.DATABASE_URL, **engine_options(settings.DATABASE_URL))
+watch_pool(engine, 'sync')
 Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Sync sessions used behind async interface (DATABASE_ASYNC=false), objects stay loaded after commit
+ThreadpoolSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
 def get_db():
     with Session() as db:
         yield db
+
+
+def async_database_url(url: str):
+    """
+    Map sync driver url to its async driver (asyncpg for postgres, aiosqlite for sqlite)
+    """
+    scheme, rest = url.split('://', 1)
+    dialect = scheme.split('+', 1)[0]
+
+    if dialect in ('postgres', 'postgresql'):
+        return f"postgresql+asyncpg://{rest}"
+    if dialect == 'sqlite':
+        return f"sqlite+aiosqlite://{rest}"
+    return url
+
+async_engine = None
+AsyncSessionLocal = None
+if settings.DATABASE_ASYNC:
+    async_url = async_database_url(settings.DATABASE_URL)
+    async_engine = create_async_engine(async_url, **engine_options(async_url, asynchronous=True))
+    watch_pool(async_engine.sync_engine, 'async')
+    AsyncSessionLocal = sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+class ThreadpoolSession:
+    """
+    Async interface of AsyncSession over a sync Session, every database call
+    run in threadpool so routes keep one code path for both modes
+    """
+    def __init__(self, session):
+        self.sync_session = session
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    def get_bind(self, *args, **kwargs):
+        return self.sync_session.get_bind(*args, **kwargs)
+
+    async def execute(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.execute, *args, **kwargs)
+
+    async def scalar(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, *args, **kwargs)
+
+    async def get(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.get, *args, **kwargs)
+
+    async def refresh(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.refresh, *args, **kwargs)
+
+    async def delete(self, instance):
+        return await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def flush(self, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.flush, *args, **kwargs)
+
+    async def commit(self):
+        return await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        return await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self):
+        return await run_in_threadpool(self.sync_session.close)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await run_in_threadpool(fn, self.sync_session, *args, **kwargs)
+
+    async def stream(self, statement, **kwargs):
+        kwargs['execution_options'] = {**kwargs.get('execution_options', {}), 'stream_results': True}
+        result = await run_in_threadpool(self.sync_session.execute, statement, **kwargs)
+        return ThreadpoolResult(result)
+
+
+class ThreadpoolResult:
+    """
+    Async interface of AsyncResult over a streamed sync Result, every fetch run in threadpool
+    """
+    def __init__(self, result):
+        self.result = result
+
+    def scalars(self):
+        return ThreadpoolResult(self.result.scalars())
+
+    async def partitions(self, size=None):
+        partitions = self.result.partitions(size)
+        while True:
+            partition = await run_in_threadpool(next, partitions, None)
+            if partition is None:
+                return
+            yield partition
+
+    async def close(self):
+        return await run_in_threadpool(self.result.close)
+
+
+def pool_capacity(pool):
+    # Connections QueuePool can hand out, other pools are bounded by threadpool (40 threads)
+    if isinstance(pool, QueuePool) and settings.DATABASE_MAX_OVERFLOW >= 0:
+        return settings.DATABASE_POOL_SIZE + settings.DATABASE_MAX_OVERFLOW
+    return 40
+
+# Sync sessions wait for a free connection here (event loop) instead of blocking threadpool
+# threads on pool checkout, which would starve sessions already holding a connection
+threadpool_sessions = anyio.Semaphore(pool_capacity(engine.pool))
+
+async def get_async_db():
+    # Native async session (asyncpg/aiosqlite)
+    if settings.DATABASE_ASYNC:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+
+    # Sync session selected by config
+    async with threadpool_sessions:
+        db = ThreadpoolSession(ThreadpoolSessionLocal())
+        try:
+            yield db
+        finally:
+            await db.close()
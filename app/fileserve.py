@@ -0,0 +1,239 @@
+import os
+import re
+import secrets
+from email.utils import formatdate, parsedate_to_datetime
+from typing import BinaryIO, Callable, List, Optional, Tuple
+
+import anyio
+from fastapi import HTTPException, Request, Response, status
+from starlette.types import Receive, Scope, Send
+
+from . import storage
+from .catalog import etag_matches
+from .config import settings
+
+"""
+##### File Serving #####
+
+serve send file with:
+
+: strong ETag (given or size-mtime) and Last-Modified, 304 for If-None-Match / If-Modified-Since
+: Accept-Ranges, single range (206 + Content-Range) and multiple ranges (206 multipart/byteranges)
+: If-Range, range is honoured only while file is same
+: 416 with Content-Range "bytes */size" when no range is satisfiable
+: immutable Cache-Control for names that never change content (uuid, sha256)
+: zero copy with http.response.zerocopysend when server offer it, otherwise
+  FILE_SEND_CHUNK_SIZE reads off event loop
+: objects of not local storage backend (backend=) are read through Storage.open
+
+resolve join file name to root and refuse anything outside it (.., slashes,
+symlinks pointing out, NUL)
+
+"""
+
+UUID_NAME = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.[0-9a-z]+$')
+
+ZEROCOPY = 'http.response.zerocopysend'
+
+
+class UnsafePath(ValueError):
+    pass
+
+
+def resolve(root: str, name: str) -> str:
+    """
+    Absolute path of name inside root, UnsafePath when name leave root
+    """
+    if not name or name in ('.', '..') or any(char in name for char in ('/', '\\', '\0')):
+        raise UnsafePath(name)
+
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.dirname(path) != root:
+        raise UnsafePath(name)
+    return path
+
+def immutable_name(name: str) -> bool:
+    # uuid names are never reused, so content of url never change
+    return bool(UUID_NAME.match(name))
+
+def parse_range(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Inclusive (start, end) byte ranges sorted and merged, None when header is
+    invalid or has too many ranges (ignored, whole file is sent), empty list
+    when nothing is satisfiable
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+
+    parts = spec.split(',')
+    if len(parts) > settings.FILE_MAX_RANGES:
+        return None
+
+    ranges = []
+    for part in parts:
+        first, dash, last = part.strip().partition('-')
+        if not dash:
+            return None
+        try:
+            if not first:
+                # Suffix range, last N bytes
+                length = int(last)
+                if length > 0 and size > 0:
+                    ranges.append((max(size - length, 0), size - 1))
+                continue
+
+            start, end = int(first), int(last) if last else None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and start > end):
+            return None
+        if start < size:
+            ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+
+    # Overlapping and adjacent ranges are sent once
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def modified_since(header: Optional[str], mtime: float) -> bool:
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return True
+    # Last-Modified has second precision
+    return int(mtime) > since
+
+
+class FileRangeResponse(Response):
+    """
+    Send ranges of file, whole file is one range
+    """
+    def __init__(self, path: str, size: int, ranges: List[Tuple[int, int]], media_type: Optional[str],
+        status_code: int = 200, headers: dict = None, boundary: Optional[str] = None,
+        opener: Optional[Callable[[], BinaryIO]] = None):
+        super().__init__(status_code=status_code, headers=headers)
+        self.path = path
+        self.opener = opener
+        self.size = size
+        self.ranges = ranges
+        self.file_media_type = media_type or 'application/octet-stream'
+        self.boundary = boundary
+
+        if boundary is None:
+            self.parts = [(b'', start, end) for start, end in ranges]
+            self.epilogue = b''
+            self.headers['Content-Type'] = self.file_media_type
+        else:
+            # Parts after first start with CRLF ending previous part data
+            self.parts = [(
+                (b'\r\n' if index else b'') + f'--{boundary}\r\nContent-Type: {self.file_media_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'.encode(), start, end
+            ) for index, (start, end) in enumerate(ranges)]
+            self.epilogue = f'\r\n--{boundary}--\r\n'.encode()
+            self.headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+
+        length = sum(len(head) + end - start + 1 for head, start, end in self.parts) + len(self.epilogue)
+        self.headers['Content-Length'] = str(length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        if scope['method'] == 'HEAD':
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        zerocopy = ZEROCOPY in scope.get('extensions', {}) and self.opener is None
+        if zerocopy:
+            with open(self.path, 'rb') as f:
+                for head, start, end in self.parts:
+                    if head:
+                        await send({'type': 'http.response.body', 'body': head, 'more_body': True})
+                    await send({'type': ZEROCOPY, 'file': f, 'offset': start, 'count': end - start + 1, 'more_body': True})
+                await send({'type': 'http.response.body', 'body': self.epilogue})
+            return
+
+        if self.opener is None:
+            f = await anyio.open_file(self.path, 'rb')
+        else:
+            f = anyio.wrap_file(await anyio.to_thread.run_sync(self.opener))
+        async with f:
+            for head, start, end in self.parts:
+                if head:
+                    await send({'type': 'http.response.body', 'body': head, 'more_body': True})
+                await f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = await f.read(min(settings.FILE_SEND_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': self.epilogue})
+
+
+def serve(request: Request, path: str, media_type: Optional[str] = None, etag: Optional[str] = None,
+    immutable: bool = False, headers: dict = None, backend: Optional[storage.Storage] = None) -> Response:
+    """
+    Response for GET/HEAD of file (object name when backend is given), honouring conditional and range headers
+    """
+    opener = None
+    if backend is not None and not backend.local:
+        stat = backend.stat(path)
+        opener = lambda: backend.open(path)
+    else:
+        if backend is not None:
+            path = backend.local_path(path)
+        try:
+            result = os.stat(path)
+            stat = result.st_size, result.st_mtime
+        except (FileNotFoundError, NotADirectoryError):
+            stat = None
+
+    if stat is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='file not found')
+
+    size, mtime = stat
+    etag = etag or f'"{size:x}-{int(mtime * 1e9):x}"'
+    cache_control = f'public, max-age={settings.FILE_CACHE_MAX_AGE}, immutable' if immutable else 'public, no-cache'
+    headers = {
+        **(headers or {}), 'ETag': etag, 'Last-Modified': formatdate(mtime, usegmt=True),
+        'Cache-Control': cache_control, 'Accept-Ranges': 'bytes',
+    }
+
+    # If-None-Match win over If-Modified-Since
+    if_none_match = request.headers.get('If-None-Match')
+    if etag_matches(if_none_match, etag) or (
+        if_none_match is None and 'If-Modified-Since' in request.headers
+        and not modified_since(request.headers['If-Modified-Since'], mtime)
+    ):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    ranges = None
+    range_header = request.headers.get('Range')
+    if range_header and request.method == 'GET':
+        if_range = request.headers.get('If-Range')
+        # If-Range with strong ETag or date, old validator get whole file
+        if if_range is None or if_range.strip() == etag or (
+            not if_range.strip().startswith(('"', 'W/')) and not modified_since(if_range, mtime)
+        ):
+            ranges = parse_range(range_header, size)
+
+    if ranges == []:
+        return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={**headers, 'Content-Range': f'bytes */{size}'})
+
+    if not ranges:
+        return FileRangeResponse(path, size, [(0, size - 1)] if size else [], media_type, headers=headers, opener=opener)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        return FileRangeResponse(path, size, ranges, media_type, status_code=status.HTTP_206_PARTIAL_CONTENT,
+            headers={**headers, 'Content-Range': f'bytes {start}-{end}/{size}'}, opener=opener)
+
+    return FileRangeResponse(path, size, ranges, media_type, status_code=status.HTTP_206_PARTIAL_CONTENT,
+        headers=headers, boundary=secrets.token_hex(12), opener=opener)
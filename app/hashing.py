@@ -0,0 +1,44 @@
+from fastapi import HTTPException, status
+
+from . import pools, utils
+from .config import settings
+
+"""
+##### Password Hashing Service #####
+
+bcrypt run in dedicated process pool (pools.py) so it never block the
+event loop or threadpool workers. Pending (queued + running) hashes are
+bounded, when the pool is saturated request fail fast with 429 instead of
+piling up
+
+"""
+
+class PasswordHasher(pools.ProcessPool):
+    def __init__(self, workers: int, max_pending: int):
+        super().__init__(workers)
+        self.max_pending = max_pending
+        self.pending = 0
+
+    async def run(self, fn, *args):
+        # Backpressure when too many hashes are waiting
+        if self.pending >= self.max_pending:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail='too many requests, try again later', headers={'Retry-After': '1'})
+
+        self.pending += 1
+        try:
+            return await self.submit(fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run(utils.hash_password, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str):
+        """
+        Return (valid, new_hash), new_hash is set when hash use outdated cost factor
+        """
+        return await self.run(utils.verify_and_update_password, password, hashed_password)
+
+
+hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE)
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import tempfile
+from typing import Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from . import metrics, pools, storage
+from .config import settings
+
+try:
+    from PIL import Image
+except ImportError: # optional, uploads are served only as original without it
+    Image = None
+
+"""
+##### Image Variants #####
+
+After upload every new image blob get resized WebP variants, one per
+IMAGE_SIZES name (width in pixels, height keep aspect ratio, never upscaled):
+
+    <blob object name>.<size>.webp
+
+getfile?size=thumb serve variant, original is served until variant exist.
+Variants are made by image_variants job (tasks.py), resizing run in
+dedicated process pool (pools.py, Pillow decode/encode is CPU bound and
+would hold GIL of threadpool workers). Images larger than IMAGE_MAX_PIXELS
+are refused before decoding (Pillow itself only warn up to twice its limit).
+Worker get path of file, objects of not local storage are downloaded to
+temp directory first and variants are stored back from it.
+
+"""
+
+variant_seconds = metrics.histogram('image_variant_seconds', 'Time to create all variants of one image')
+variant_failures = metrics.counter('image_variant_failures_total', 'Images variants could not be created for')
+
+
+def variant_name(name: str, size: str) -> str:
+    return f'{name}.{size}.webp'
+
+def missing_variants(name: str) -> bool:
+    return any(not storage.backend.exists(variant_name(name, size)) for size in settings.IMAGE_SIZES)
+
+def make_variants(path: str, directory: str, sizes: Dict[str, int], quality: int, max_pixels: int) -> Dict[str, int]:
+    """
+    Write WebP variants of image at path to directory/<size>.webp, return bytes of every variant (run in worker process)
+    """
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    written = {}
+    with Image.open(path) as image:
+        # Open read only header, size is known before decoding
+        if image.width * image.height > max_pixels:
+            raise Image.DecompressionBombError(f'image of {image.width}x{image.height} pixels is over {max_pixels}')
+
+        # JPEG decoded at smallest scale still larger than biggest variant (much faster)
+        largest = max(sizes.values())
+        image.draft('RGB', (largest, largest * image.height // image.width))
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+        for size, width in sizes.items():
+            variant = image.copy()
+            # Height bound only by width, thumbnail never upscale
+            variant.thumbnail((width, width * 10), Image.Resampling.LANCZOS)
+
+            target = os.path.join(directory, f'{size}.webp')
+            variant.save(target, format='WEBP', quality=quality, method=4)
+            written[size] = os.path.getsize(target)
+    return written
+
+
+class ImageProcessor(pools.ProcessPool):
+    async def variants(self, name: str) -> Optional[Dict[str, int]]:
+        """
+        Create and store variants of image object, None when Pillow is missing
+        """
+        if Image is None:
+            return None
+
+        backend = storage.backend
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            # Same filesystem as local storage, so storing variant is rename
+            with tempfile.TemporaryDirectory(dir=backend.temp_directory()) as directory:
+                path = backend.local_path(name)
+                if path is None:
+                    path = os.path.join(directory, 'original' + os.path.splitext(name)[1])
+                    await run_in_threadpool(backend.download, name, path)
+
+                written = await self.submit(make_variants, path, directory,
+                    settings.IMAGE_SIZES, settings.IMAGE_QUALITY, settings.IMAGE_MAX_PIXELS)
+
+                for size in written:
+                    await run_in_threadpool(backend.put_file, variant_name(name, size), os.path.join(directory, f'{size}.webp'))
+        except Exception:
+            # Job queue log and retry it
+            variant_failures.inc()
+            raise
+        variant_seconds.observe(loop.time() - start)
+        return written
+
+
+processor = ImageProcessor(settings.IMAGE_WORKERS)
@@ -0,0 +1,213 @@
+import asyncio
+import inspect
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import metrics, models
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+"""
+##### Durable Job Queue #####
+
+Jobs are rows of job table, so they survive worker restarts and are
+committed together with data they belong to:
+
+    jobs.enqueue(db, 'image_variants', key=key)   # then db.commit()
+
+JobQueue run JOB_WORKERS async workers in app process (started on app
+startup, JOB_WORKERS=0 disable them). A worker claim job by conditional
+update (status and visibility checked in same statement, so two workers
+never get same job), job stay invisible for JOB_VISIBILITY_TIMEOUT, a
+worker that die mid job leave it to be claimed again after that.
+
+Failed job is retried after JOB_RETRY_DELAY * 2^(attempt - 1) seconds up to
+max_attempts, then it stay failed with last_error. Done and failed jobs are
+deleted by cleanup job after JOB_RETENTION seconds.
+
+Periodic jobs are scheduled with unique_key, at most one of them is queued
+(partial unique index), so workers starting together or job enqueueing its
+own successor never start parallel chains:
+
+    jobs.schedule(db, 'cleanup', delay=settings.JOB_CLEANUP_INTERVAL)
+
+Handlers are registered by name, sync handlers run in threadpool:
+
+    @jobs.handler('blob_gc')
+    def blob_gc(): ...
+
+"""
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+HANDLERS: Dict[str, Callable] = {}
+
+queue_depth = metrics.gauge('job_queue_depth', 'Jobs waiting (queued) and claimed (running)')
+job_latency = metrics.histogram('job_latency_seconds', 'Time from job run_at to worker claiming it',
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600))
+job_duration = metrics.histogram('job_duration_seconds', 'Time handler ran')
+job_results = metrics.counter('jobs_total', 'Finished job attempts by name and result (done, retry, failed)')
+
+
+def handler(name: str):
+    def decorator(fn):
+        HANDLERS[name] = fn
+        return fn
+    return decorator
+
+def enqueue(db: Session, name: str, delay: float = 0, max_attempts: Optional[int] = None, **payload) -> models.Job:
+    """
+    Add job to session, it is visible to workers when session commit
+    """
+    now = datetime.now()
+    job = models.Job(name=name, payload=json.dumps(payload), status=QUEUED, attempts=0,
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS, run_at=now + timedelta(seconds=delay), created_at=now)
+    db.add(job)
+    return job
+
+def visible(now: datetime):
+    # Queued and due, or claimed by worker which did not finish in time
+    return or_(
+        and_(models.Job.status == QUEUED, models.Job.run_at <= now),
+        and_(models.Job.status == RUNNING, models.Job.locked_until < now),
+    )
+
+
+class JobQueue:
+    def __init__(self, session_factory: Callable[[], Session], workers: int = 1):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.tasks = []
+
+    def claim(self) -> Optional[models.Job]:
+        now = datetime.now()
+        with self.session_factory() as db:
+            candidates = db.execute(
+                select(models.Job.id).where(visible(now)).order_by(models.Job.run_at).limit(self.workers + 1)
+            ).scalars().all()
+
+            for id in candidates:
+                claimed = db.execute(
+                    update(models.Job).where(models.Job.id == id, visible(now))
+                    .values(status=RUNNING, attempts=models.Job.attempts + 1,
+                        locked_until=now + timedelta(seconds=settings.JOB_VISIBILITY_TIMEOUT))
+                    .execution_options(synchronize_session=False)
+                )
+                db.commit()
+                if claimed.rowcount == 1:
+                    job = db.get(models.Job, id)
+                    db.expunge(job)
+                    return job
+        return None
+
+    def finish(self, job: models.Job, error: Optional[str] = None):
+        now = datetime.now()
+        if error is None:
+            values, result = dict(status=DONE, locked_until=None, finished_at=now), DONE
+        elif job.attempts < job.max_attempts:
+            delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            values, result = dict(status=QUEUED, locked_until=None, run_at=now + timedelta(seconds=delay), last_error=error), 'retry'
+        else:
+            values, result = dict(status=FAILED, locked_until=None, finished_at=now, last_error=error), FAILED
+
+        with self.session_factory() as db:
+            # Only while job is still ours (not reclaimed after visibility timeout)
+            mine = and_(models.Job.id == job.id, models.Job.attempts == job.attempts)
+            try:
+                db.execute(update(models.Job).where(mine).values(**values).execution_options(synchronize_session=False))
+                db.commit()
+            except IntegrityError:
+                # Retry of scheduled job while same job is queued already, that one run instead
+                db.rollback()
+                values, result = dict(status=FAILED, locked_until=None, finished_at=now, last_error=error), FAILED
+                db.execute(update(models.Job).where(mine).values(**values).execution_options(synchronize_session=False))
+                db.commit()
+        job_results.inc(name=job.name, result=result)
+
+    async def run_next(self) -> bool:
+        """
+        Claim and run one job, False when nothing is due
+        """
+        job = await run_in_threadpool(self.claim)
+        if job is None:
+            return False
+
+        # Postgres return aware timestamps, SQLite naive ones
+        job_latency.observe(max((datetime.now(job.run_at.tzinfo) - job.run_at).total_seconds(), 0))
+        error = None
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            fn = HANDLERS[job.name]
+            payload = json.loads(job.payload)
+            if inspect.iscoroutinefunction(fn):
+                await fn(**payload)
+            else:
+                await run_in_threadpool(fn, **payload)
+        except Exception as e:
+            logger.exception('job %s (%s) failed, attempt %s of %s', job.id, job.name, job.attempts, job.max_attempts)
+            error = f'{type(e).__name__}: {e}'
+        job_duration.observe(loop.time() - start, name=job.name)
+
+        await run_in_threadpool(self.finish, job, error)
+        return True
+
+    def count(self):
+        with self.session_factory() as db:
+            counts = dict(db.execute(select(models.Job.status, func.count())
+                .where(models.Job.status.in_([QUEUED, RUNNING])).group_by(models.Job.status)).all())
+        for status in (QUEUED, RUNNING):
+            queue_depth.set(counts.get(status, 0), status=status)
+
+    async def work(self):
+        while True:
+            try:
+                if not await self.run_next():
+                    await run_in_threadpool(self.count)
+                    await asyncio.sleep(settings.JOB_POLL_INTERVAL)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Database down, keep worker alive and try again later
+                logger.exception('job worker failed to poll queue')
+                await asyncio.sleep(settings.JOB_POLL_INTERVAL)
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+
+def schedule(db: Session, name: str, delay: float = 0):
+    """
+    Enqueue periodic job unless one is already queued, insert do nothing on conflict of unique_key
+    """
+    now = datetime.now()
+    values = dict(name=name, payload='{}', status=QUEUED, attempts=0, max_attempts=settings.JOB_MAX_ATTEMPTS,
+        run_at=now + timedelta(seconds=delay), created_at=now, unique_key=name)
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        dialect_insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        db.execute(dialect_insert(models.Job).values(**values).on_conflict_do_nothing())
+        db.commit()
+        return
+
+    try:
+        db.execute(insert(models.Job).values(**values))
+        db.commit()
+    except IntegrityError:
+        db.rollback()
@@ -1,5 +1,7 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from app import hashing, images, metrics, tasks
 from app.config import settings
 from app.routes import auth, file, user, book
 
@@ -41,6 +43,21 @@ app.include_router(auth.router, tags=['Auth'], prefix='/api/auth')
 app.include_router(user.router, tags=['User'], prefix='/api/user')
 app.include_router(book.router, tags=['Store'], prefix='/api/store')
 
+@app.on_event('startup')
+def startup():
+    tasks.start()
+
+@app.on_event('shutdown')
+async def shutdown():
+    await tasks.stop()
+    hashing.hasher.shutdown()
+    images.processor.shutdown()
+
 @app.get('/')
 def root():
     return {'message': 'server is running'}
+
+@app.get('/metrics', response_class=PlainTextResponse)
+def get_metrics():
+    # Prometheus text format
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
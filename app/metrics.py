@@ -0,0 +1,131 @@
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Tuple
+
+"""
+##### Metrics #####
+
+Small in process registry rendered in prometheus text format on /metrics
+
+: Counter (monotonic total)
+: Gauge (value set by code or read from callback on scrape)
+: Histogram (cumulative buckets, sum and count)
+
+"""
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+registry = {}
+lock = threading.Lock()
+
+
+def label_key(labels: dict) -> Tuple:
+    return tuple(sorted(labels.items()))
+
+def format_labels(key: Tuple, extra: str = ''):
+    labels = [f'{name}="{value}"' for name, value in key]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name: str, help: str):
+        self.name, self.help = name, help
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = label_key(labels)
+        with lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(label_key(labels), 0)
+
+    def samples(self):
+        return [f'{self.name}{format_labels(key)} {value}' for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.callbacks: Dict[Tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        with lock:
+            self.values[label_key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, callback: Callable[[], float], **labels):
+        self.callbacks[label_key(labels)] = callback
+
+    def value(self, **labels):
+        key = label_key(labels)
+        if key in self.callbacks:
+            return self.callbacks[key]()
+        return self.values.get(key, 0)
+
+    def samples(self):
+        values = {**self.values, **{key: callback() for key, callback in self.callbacks.items()}}
+        return [f'{self.name}{format_labels(key)} {value}' for key, value in values.items()]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        self.name, self.help = name, help
+        self.buckets = tuple(buckets)
+        self.values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = label_key(labels)
+        with lock:
+            counts = self.values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def count(self, **labels):
+        counts = self.values.get(label_key(labels))
+        return sum(counts[:-1]) if counts else 0
+
+    def samples(self):
+        lines = []
+        for key, counts in self.values.items():
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts[:-1]):
+                total += count
+                le = 'le="%s"' % bound
+                lines.append(f'{self.name}_bucket{format_labels(key, le)} {total}')
+            lines.append(f'{self.name}_sum{format_labels(key)} {counts[-1]}')
+            lines.append(f'{self.name}_count{format_labels(key)} {total}')
+        return lines
+
+
+def register(metric):
+    # Same name return already registered metric (module reload, tests)
+    with lock:
+        return registry.setdefault(metric.name, metric)
+
+def counter(name: str, help: str) -> Counter:
+    return register(Counter(name, help))
+
+def gauge(name: str, help: str) -> Gauge:
+    return register(Gauge(name, help))
+
+def histogram(name: str, help: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+    return register(Histogram(name, help, buckets))
+
+def render() -> str:
+    lines = []
+    for metric in list(registry.values()):
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
@@ -1,8 +1,12 @@
 import time
 
 from fastapi import Request
+from .compression import CompressionMiddleware
+from .config import settings
 from .main import app
 
+app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MINIMUM_SIZE)
+
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
     start_time = time.time()
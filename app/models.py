@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import TIMESTAMP, Column, String, Boolean, Float, ForeignKey, Integer
+from sqlalchemy import TIMESTAMP, Column, String, Boolean, Float, ForeignKey, Integer, Index, DDL, event, text
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -26,5 +26,66 @@ class Book(Base):
     price = Column(Float, nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), nullable=False, default=datetime.now)
     updated_at = Column(TIMESTAMP(timezone=True), nullable=False, default=datetime.now)
+    version = Column(Integer, nullable=False, default=1, server_default='1') # bumped on every update (ETag)
     user_id = Column(Integer, ForeignKey("user.id"))
     user = relationship(User, back_populates="books")
+
+    __table_args__ = (
+        # Keyset pagination order of all books and books by user
+        Index("ix_book_created_at_id", "created_at", "id"),
+        Index("ix_book_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
+class Blob(Base):
+    __tablename__ = "blob"
+    key = Column(String, primary_key=True) # sha256 hex of content and extension, file name in urls
+    size = Column(Integer, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0, server_default='0') # photo and cover_image urls pointing at blob, counted by gc
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, default=datetime.now)
+    uploaded_at = Column(TIMESTAMP(timezone=True), nullable=False, default=datetime.now) # last upload of same content, gc grace start
+    completed_at = Column(TIMESTAMP(timezone=True), nullable=True) # object stored and its variants jobs enqueued, null while direct upload pending
+
+class Job(Base):
+    __tablename__ = "job"
+    id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
+    name = Column(String, nullable=False) # handler name
+    payload = Column(String, nullable=False, default='{}') # json keyword arguments of handler
+    status = Column(String, nullable=False, default='queued') # queued, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False)
+    run_at = Column(TIMESTAMP(timezone=True), nullable=False, default=datetime.now) # not claimed before (delay, retry backoff)
+    locked_until = Column(TIMESTAMP(timezone=True), nullable=True) # visibility timeout of running job
+    last_error = Column(String, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, default=datetime.now)
+    finished_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    unique_key = Column(String, nullable=True) # at most one queued job per key (scheduled jobs), null for others
+
+    __table_args__ = (
+        # Workers poll due jobs by status and run_at
+        Index("ix_job_status_run_at", "status", "run_at"),
+        Index("ux_job_queued_unique_key", "unique_key", unique=True,
+            postgresql_where=text("status = 'queued'"), sqlite_where=text("status = 'queued'")),
+    )
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_token"
+    jti = Column(String, primary_key=True) # jti claim of revoked access or refresh token
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False, index=True) # exp of token, row deleted after it
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, default=datetime.now, index=True) # denylist sync read newer rows
+
+# SQLite full text search table for books (postgres use GIN index from migrations)
+for statement in [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS book_fts USING fts5(title, description, content='book', "
+    "content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS book_fts_ai AFTER INSERT ON book BEGIN "
+    "INSERT INTO book_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS book_fts_ad AFTER DELETE ON book BEGIN "
+    "INSERT INTO book_fts(book_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS book_fts_au AFTER UPDATE ON book BEGIN "
+    "INSERT INTO book_fts(book_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO book_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    "INSERT INTO book_fts(book_fts) VALUES ('rebuild')",
+]:
+    event.listen(Book.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+event.listen(Book.__table__, 'before_drop', DDL("DROP TABLE IF EXISTS book_fts").execute_if(dialect='sqlite'))
@@ -1,12 +1,74 @@
 import base64
-from typing import List
+import hashlib
+import time
+from typing import List, Optional
 
-from fastapi import Depends, HTTPException, status
-from fastapi_jwt_auth import AuthJWT
+import fastapi_jwt_auth
+import jwt
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from cryptography.hazmat.primitives.serialization import load_pem_private_key, load_pem_public_key
+from fastapi import Depends, HTTPException, Request, status
+from jwt.algorithms import Algorithm
+from jwt.utils import force_bytes
 from pydantic import BaseModel
 
-from sqlalchemy.orm import Session
-from . import config, database, models
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+from . import cache, config, database, metrics, models, revocation, schema
+
+"""
+##### Token Verification #####
+
+Keys are decoded and parsed to key objects once when app start (PEM was
+parsed again for every token before), AuthJWT sign and verify with them.
+
+Verified tokens are kept in per process LRU (JWT_VERIFY_CACHE_SIZE), keyed
+by sha256 of token and expiring at token exp, so requests repeating same
+access token skip signature check. AuthJWT verify token 2-3 times per
+request (jwt_required, get_raw_jwt, get_jwt_subject), all of them hit.
+
+JWT_ALGORITHM RS256 (RSA keys), ES256 (P-256 keys) or EdDSA (Ed25519 keys,
+much cheaper signing on login and refresh than RSA):
+
+    openssl genpkey -algorithm ed25519 -out private.pem
+    openssl pkey -in private.pem -pubout -out public.pem
+    # JWT_PRIVATE_KEY, JWT_PUBLIC_KEY are base64 of these files
+
+"""
+
+
+class EdDSAAlgorithm(Algorithm):
+    """
+    Ed25519 signatures (RFC 8037), PyJWT 1.7 has no EdDSA
+    """
+    def prepare_key(self, key):
+        if isinstance(key, (Ed25519PrivateKey, Ed25519PublicKey)):
+            return key
+
+        key = force_bytes(key)
+        try:
+            return load_pem_private_key(key, password=None)
+        except ValueError:
+            return load_pem_public_key(key)
+
+    def sign(self, msg, key):
+        return key.sign(msg)
+
+    def verify(self, msg, key, sig):
+        if isinstance(key, Ed25519PrivateKey):
+            key = key.public_key()
+        try:
+            key.verify(sig, msg)
+            return True
+        except InvalidSignature:
+            return False
+
+try:
+    jwt.register_algorithm('EdDSA', EdDSAAlgorithm())
+except ValueError: # registered already
+    pass
 
 class Settings(BaseModel):
     authjwt_algorithm: str = config.settings.JWT_ALGORITHM
@@ -20,29 +82,63 @@ class Settings(BaseModel):
         config.settings.JWT_PRIVATE_KEY).decode('utf-8')
 
 
-@AuthJWT.load_config
+@fastapi_jwt_auth.AuthJWT.load_config
 def get_config():
     return Settings()
 
+
+# Claims of verified tokens by sha256 of token
+verified_tokens = cache.MemoryCache(maxsize=config.settings.JWT_VERIFY_CACHE_SIZE)
+verify_requests = metrics.counter('jwt_verify_cache_requests_total', 'Token verifications by result (hit, miss)')
+
+class Keys:
+    private_key = None
+    public_key = None
+
+def load_keys(private_key: str = config.settings.JWT_PRIVATE_KEY, public_key: str = config.settings.JWT_PUBLIC_KEY):
+    """
+    Parse base64 PEM keys to key objects, forget tokens verified with old keys
+    """
+    Keys.private_key = load_pem_private_key(base64.b64decode(private_key), password=None)
+    Keys.public_key = load_pem_public_key(base64.b64decode(public_key))
+    verified_tokens.clear()
+
+load_keys()
+
+
+class AuthJWT(fastapi_jwt_auth.AuthJWT):
+    def _get_secret_key(self, algorithm: str, process: str):
+        # Parsed key objects, PyJWT use them as they are
+        return Keys.private_key if process == 'encode' else Keys.public_key
+
+    def _verified_token(self, encoded_token: str, issuer: Optional[str] = None) -> dict:
+        key = (hashlib.sha256(encoded_token.encode()).digest(), issuer)
+        claims = verified_tokens.get(key)
+        if claims is not None:
+            verify_requests.inc(result='hit')
+            return claims
+
+        verify_requests.inc(result='miss')
+        claims = super()._verified_token(encoded_token, issuer)
+        # Token without exp is never cached
+        ttl = claims.get('exp', 0) - time.time()
+        if ttl > 0:
+            verified_tokens.set(key, claims, ttl=ttl)
+        return claims
+
 class NotVerified(Exception):
     pass
 
 class UserNotFound(Exception):
     pass
 
-def require_user(db: Session = Depends(database.get_db), Authorize: AuthJWT = Depends()):
+def get_token_subject(request: Request, Authorize: AuthJWT = Depends()):
     try:
         Authorize.jwt_required()
-        user_id = Authorize.get_jwt_subject()
-        
-        # Check user exist
-        user = db.query(models.User).filter(models.User.id == user_id).first()
-        if not user:
-            raise UserNotFound('user no longer exist')
-        
-        # Check email verified
-        if not user.verified:
-            raise NotVerified('email not verified')
+        user_id = int(Authorize.get_jwt_subject())
+
+        # Claims for revocation check of require_user (verified token is cached)
+        request.state.token = Authorize.get_raw_jwt()
 
     except Exception as e:
         error = e.__class__.__name__
@@ -51,15 +147,75 @@ def require_user(db: Session = Depends(database.get_db), Authorize: AuthJWT = De
         if error == 'MissingTokenError':
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='you are not logged in')
         
-        # Check user not found
-        if error == 'UserNotFound':
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='user no longer exist')
-        
-        # Check email not verified
-        if error == 'NotVerified':
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='please verify your account')
-        
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Token is invalid or has expired')
-    
+
     # Return user id
     return user_id
+
+
+# Authenticated users by id (json of UserPrincipal), invalidated when user row change
+principal_cache = cache.get_cache('principal', maxsize=config.settings.PRINCIPAL_CACHE_SIZE,
+    ttl=config.settings.PRINCIPAL_CACHE_TTL)
+
+async def load_principal(db: AsyncSession, user_id: int) -> Optional[schema.UserPrincipal]:
+    """
+    Get user principal from cache, on miss load it from database and cache it
+    """
+    cached = principal_cache.get(str(user_id))
+    if cached is not None:
+        return schema.UserPrincipal.parse_raw(cached)
+
+    user = (await db.execute(select(models.User).filter(models.User.id == user_id))).scalars().first()
+    if not user:
+        return None
+
+    principal = schema.UserPrincipal.from_orm(user)
+    principal_cache.set(str(user_id), principal.json())
+    return principal
+
+def invalidate_principal(user_id):
+    principal_cache.delete(str(user_id))
+
+@event.listens_for(models.User, 'after_update')
+@event.listens_for(models.User, 'after_delete')
+def user_changed(mapper, connection, target):
+    # Flush is not commit, request loading user meanwhile would cache old row again
+    object_session(target).info.setdefault('changed_users', set()).add(target.id)
+
+@event.listens_for(Session, 'after_commit')
+def users_committed(session):
+    for user_id in session.info.pop('changed_users', ()):
+        invalidate_principal(user_id)
+
+@event.listens_for(Session, 'after_rollback')
+def users_rolled_back(session):
+    session.info.pop('changed_users', None)
+
+
+async def require_user(request: Request, user_id: int = Depends(get_token_subject),
+    db: AsyncSession = Depends(database.get_async_db)):
+    # Check token not revoked by logout
+    token = getattr(request.state, 'token', None)
+    if token and await revocation.denylist.is_revoked(db, token['jti']):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Token has been revoked')
+
+    try:
+        # Check user exist
+        user = await load_principal(db, user_id)
+        if not user:
+            raise UserNotFound('user no longer exist')
+        
+        # Check email verified
+        if not user.verified:
+            raise NotVerified('email not verified')
+
+    # Check user not found
+    except UserNotFound:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='user no longer exist')
+    
+    # Check email not verified
+    except NotVerified:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='please verify your account')
+    
+    # Return user principal
+    return user
@@ -0,0 +1,73 @@
+import base64
+import binascii
+import json
+import math
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import tuple_
+
+from . import models
+
+"""
+##### Keyset (cursor) Pagination #####
+
+Books are ordered by (created_at, id) and the opaque cursor carry the
+position of the last book of previous page, so every page is an index
+range scan instead of scanning and discarding all previous rows (offset).
+
+"""
+
+def encode_cursor(book: models.Book):
+    position = json.dumps([book.created_at.isoformat(), book.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str):
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        return datetime.fromisoformat(created_at), int(id)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='invalid cursor')
+
+def keyset_query(query, per_page: int, cursor: str = None):
+    """
+    Apply keyset pagination on book select statement, one extra book is
+    fetched to know if next page exist
+    """
+    if cursor:
+        query = query.filter(tuple_(models.Book.created_at, models.Book.id) > tuple_(*decode_cursor(cursor)))
+
+    return query.order_by(models.Book.created_at, models.Book.id).limit(per_page + 1)
+
+async def keyset(db, query, per_page: int, cursor: str = None):
+    """
+    Apply keyset pagination on book select statement and return (books, next_cursor)
+    """
+    result = await db.execute(keyset_query(query, per_page, cursor))
+    books = result.scalars().all()
+
+    next_cursor = None
+    if len(books) > per_page:
+        books = books[:per_page]
+        next_cursor = encode_cursor(books[-1])
+
+    return books, next_cursor
+
+def page_summary(page: int, per_page: int, total: Optional[int] = None):
+    summary = dict(page=page, per_page=per_page)
+
+    # Total is skipped when client opt out from counting
+    if total is not None:
+        summary.update(total=total, total_pages=math.ceil(total / per_page))
+
+    return summary
+
+def cursor_summary(per_page: int, cursor: Optional[str], next_cursor: Optional[str], total: Optional[int] = None):
+    summary = dict(per_page=per_page, cursor=cursor, next_cursor=next_cursor)
+
+    if total is not None:
+        summary.update(total=total)
+
+    return summary
@@ -0,0 +1,45 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+"""
+##### Process Pools #####
+
+CPU bound work (bcrypt in hashing.py, Pillow in images.py) run in dedicated
+process pool so it never block the event loop or hold GIL of threadpool
+workers. Pool is created on first use so importing app does not fork workers.
+
+Pool with dead worker (OOM kill, crash) refuse every task, it is rebuilt
+and task is tried once more
+
+"""
+
+class ProcessPool:
+    def __init__(self, workers: int):
+        self.workers = workers or os.cpu_count()
+        self.executor = None
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def reset(self, executor: ProcessPoolExecutor):
+        # Concurrent tasks of same broken pool rebuild it once
+        if self.executor is executor:
+            self.executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def submit(self, fn, *args):
+        executor = self.get_executor()
+        try:
+            return await asyncio.wrap_future(executor.submit(fn, *args))
+        except BrokenProcessPool:
+            self.reset(executor)
+            return await asyncio.wrap_future(self.get_executor().submit(fn, *args))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,144 @@
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+
+import anyio
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import metrics, models
+from .config import settings
+
+"""
+##### Token Revocation #####
+
+Logout revoke jti of access and refresh token until their exp, require_user
+and refresh refuse revoked tokens.
+
+Revoked jti are rows of revoked_token table (shared by all processes) and
+every process keep bloom filter of them in front:
+
+: not in bloom filter (almost every request), not revoked, no database query
+: in bloom filter, row is looked up (revoked token or false positive, about
+  REVOCATION_BLOOM_ERROR_RATE of not revoked tokens)
+
+Revocation is in bloom filter of its process at once, other processes read
+newer rows every REVOCATION_SYNC_INTERVAL seconds (first request after
+interval run query). Until first load of process is done every request
+wait for it, empty bloom filter would let revoked tokens through. Bloom
+filter can not remove items, it is rebuilt from not expired rows every
+REVOCATION_REBUILD_INTERVAL, cleanup job delete expired rows.
+
+"""
+
+# Rows committed late (created_at taken before commit) or by process with clock behind are still read by next sync
+SYNC_OVERLAP = timedelta(seconds=60)
+
+lookups = metrics.counter('token_revocation_lookups_total',
+    'Revocation checks by result (bloom_negative, revoked, false_positive)')
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def positions(self, item: str):
+        # Double hashing, k positions from two 64 bit halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def add(self, item: str):
+        positions = self.positions(item)
+        # Setting bit is read and write of byte, concurrent adds must not lose bits
+        with self._lock:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+class Denylist:
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.synced_at = None
+        self.next_sync = 0.0
+        self.next_rebuild = 0.0
+        # anyio lock is not bound to event loop running when module is imported
+        self._load_lock = anyio.Lock()
+
+    async def load(self, db: AsyncSession):
+        # One request read all rows, others wait for it instead of checking empty filter
+        async with self._load_lock:
+            if self.synced_at is None:
+                await self.sync(db)
+
+    async def sync(self, db: AsyncSession):
+        # Next requests do not wait for query already running (except first load)
+        now = time.monotonic()
+        self.next_sync = now + settings.REVOCATION_SYNC_INTERVAL
+        synced_at, query = datetime.now(), select(models.RevokedToken.jti)
+
+        if now >= self.next_rebuild or self.synced_at is None:
+            self.next_rebuild = now + settings.REVOCATION_REBUILD_INTERVAL
+            rows = (await db.execute(query.where(models.RevokedToken.expires_at > synced_at))).scalars().all()
+            bloom = BloomFilter(max(self.capacity, len(rows) * 2), self.error_rate)
+        else:
+            rows = (await db.execute(query.where(models.RevokedToken.created_at >= self.synced_at - SYNC_OVERLAP))).scalars().all()
+            bloom = self.bloom
+
+        for jti in rows:
+            bloom.add(jti)
+        self.bloom, self.synced_at = bloom, synced_at
+
+    async def is_revoked(self, db: AsyncSession, jti: str) -> bool:
+        if self.synced_at is None:
+            await self.load(db)
+        elif time.monotonic() >= self.next_sync:
+            await self.sync(db)
+
+        if jti not in self.bloom:
+            lookups.inc(result='bloom_negative')
+            return False
+
+        revoked = await db.scalar(select(models.RevokedToken.jti)
+            .where(models.RevokedToken.jti == jti, models.RevokedToken.expires_at > datetime.now()))
+        lookups.inc(result='revoked' if revoked else 'false_positive')
+        return revoked is not None
+
+    async def revoke(self, db: AsyncSession, jti: str, exp: int):
+        """
+        Revoke token until its exp (seconds since epoch)
+        """
+        db.add(models.RevokedToken(jti=jti, expires_at=datetime.fromtimestamp(exp), created_at=datetime.now()))
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Revoked already
+            await db.rollback()
+        self.bloom.add(jti)
+
+
+def delete_expired(db: Session) -> int:
+    result = db.execute(delete(models.RevokedToken).where(models.RevokedToken.expires_at <= datetime.now())
+        .execution_options(synchronize_session=False))
+    db.commit()
+    return result.rowcount
+
+
+denylist = Denylist(settings.REVOCATION_BLOOM_CAPACITY, settings.REVOCATION_BLOOM_ERROR_RATE)
@@ -1,10 +1,11 @@
 from datetime import timedelta
 from fastapi import APIRouter, Response, status, Depends, HTTPException
+from fastapi_jwt_auth.exceptions import RevokedTokenError
 from pydantic import EmailStr
-from sqlalchemy import or_
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .. import schema, models, utils, database, config, oauth2
+from .. import schema, models, utils, database, config, oauth2, hashing, revocation
 from ..oauth2 import AuthJWT
 from ..custom import CustomRequest, CustomResponse, CustomRoute
 
@@ -20,26 +21,29 @@ REFRESH_TOKEN_EXPIRES_IN = config.settings.REFRESH_TOKEN_EXPIRES_IN
 : Register new user
 : Login user (set cookies with refresh, access and login and response access token)
 : Refresh access token (create new access token also update in cookies)
-: Logout user (unset cookies)
+: Logout user (revoke access and refresh token, unset cookies)
+
+Revoked tokens (revocation.py) are refused by require_user and refresh
+until they expire
 
 Media type: 
-You also set Accept headers for different response
-like request in json and response in xml and vice versa
+Response format is negotiated from Accept header (json, xml, msgpack),
+without Accept response use same format as request Content-Type
 
-media_type = request.headers.get('Accept')
+media_type = request.media_type
 
 """
 
 @router.post('/register')
 async def create_user(request: CustomRequest, response: CustomResponse, payload: schema.CreateUserSchema,
-    db: Session = Depends(database.get_db)):
+    db: AsyncSession = Depends(database.get_async_db)):
     
-    # Get content type header
-    media_type = request.headers.get('Content-Type')
+    # Get negotiated response media type
+    media_type = request.media_type
 
     # Check if user already exist
-    user = db.query(models.User).filter(or_(models.User.email == EmailStr(payload.email.lower()), 
-        models.User.username == payload.username)).first()
+    user = (await db.execute(select(models.User).filter(or_(models.User.email == EmailStr(payload.email.lower()), 
+        models.User.username == payload.username)))).scalars().first()
     if user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='Account already exist')
      
@@ -49,7 +53,7 @@ async def create_user(request: CustomRequest, response: CustomResponse, payload:
             status_code=status.HTTP_400_BAD_REQUEST, detail='Passwords do not match')
     
     # Hash the password
-    payload.password = utils.hash_password(payload.password)
+    payload.password = await hashing.hasher.hash(payload.password)
 
     # Set payload  
     del payload.password_confirm
@@ -60,8 +64,8 @@ async def create_user(request: CustomRequest, response: CustomResponse, payload:
     # Create new user
     new_user = models.User(**payload.dict())
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     
     # Model to dict and Exclude extra field
     data = utils.model_to_dict(model=new_user,
@@ -75,16 +79,16 @@ async def create_user(request: CustomRequest, response: CustomResponse, payload:
     return response
 
 @router.post('/login')
-def login(
+async def login(
     request: CustomRequest, response: CustomResponse, payload: schema.LoginUserSchema,  
-        db: Session = Depends(database.get_db), Authorize: AuthJWT = Depends()):
+        db: AsyncSession = Depends(database.get_async_db), Authorize: AuthJWT = Depends()):
 
-    # Get content type header
-    media_type = request.headers.get('Content-Type')
+    # Get negotiated response media type
+    media_type = request.media_type
 
     # Check user is exist
-    user = db.query(models.User).filter(
-        models.User.email == EmailStr(payload.email.lower())).first()
+    user = (await db.execute(select(models.User).filter(
+        models.User.email == EmailStr(payload.email.lower())))).scalars().first()
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='incorrect email and password')
     
@@ -94,8 +98,14 @@ def login(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="please verify your email address")
 
     # Check password is valid
-    if not utils.verify_password(payload.password, user.password):
+    valid, new_hash = await hashing.hasher.verify_and_update(payload.password, user.password)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='incorrect email and password')
+
+    # Rehash password with current cost factor
+    if new_hash:
+        user.password = new_hash
+        await db.commit()
     
     # Create access and refresh tokens
     access_token = Authorize.create_access_token(subject=str(user.id), 
@@ -126,23 +136,27 @@ def login(
     return response
 
 @router.get('/refresh')
-def refresh_token(request: CustomRequest, response: CustomResponse, Authorize: AuthJWT = Depends(), 
-    db: Session = Depends(database.get_db)):
+async def refresh_token(request: CustomRequest, response: CustomResponse, Authorize: AuthJWT = Depends(), 
+    db: AsyncSession = Depends(database.get_async_db)):
     
-    # Get content type header
-    media_type = request.headers.get('Content-Type')
+    # Get negotiated response media type
+    media_type = request.media_type
 
     try:
         # Check required refresh token 
         Authorize.jwt_refresh_token_required()
 
+        # Check refresh token not revoked by logout
+        if await revocation.denylist.is_revoked(db, Authorize.get_raw_jwt()['jti']):
+            raise RevokedTokenError(status_code=status.HTTP_401_UNAUTHORIZED, message='Token has been revoked')
+
         # Get user id from token
         user_id = Authorize.get_jwt_subject()
         if not user_id:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='could not refresh access token')
 
         # Check user is exist
-        user = db.query(models.User).filter(models.User.id == user_id).first()
+        user = await oauth2.load_principal(db, int(user_id))
         if not user:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='user belongs to this token not exist')
         
@@ -176,14 +190,24 @@ def refresh_token(request: CustomRequest, response: CustomResponse, Authorize: A
     return response
 
 @router.get('/logout')
-def logout(request: CustomRequest, response: Response, Authorize: AuthJWT = Depends(), 
-    user_id: str = Depends(oauth2.require_user), db: Session = Depends(database.get_db)):
+async def logout(request: CustomRequest, response: Response, Authorize: AuthJWT = Depends(), 
+    user: schema.UserPrincipal = Depends(oauth2.require_user), db: AsyncSession = Depends(database.get_async_db)):
     
-    # Get content type header
-    media_type = request.headers.get('Content-Type')
-
-    # Get user
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    # Get negotiated response media type
+    media_type = request.media_type
+
+    # Get claims of access token (verified by require_user) and refresh token cookie
+    tokens = [getattr(request.state, 'token', None)]
+    if request.cookies.get('refresh_token'):
+        try:
+            tokens.append(Authorize.get_raw_jwt(request.cookies['refresh_token']))
+        except Exception:
+            # Invalid or expired refresh token, nothing to revoke
+            pass
+
+    # Revoke tokens until they expire
+    for claims in filter(None, tokens):
+        await revocation.denylist.revoke(db, claims['jti'], claims['exp'])
 
     # Set success and logout user email and status code
     response = CustomResponse({ "status": "success", "email": user.email }, 
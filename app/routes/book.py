@@ -1,11 +1,13 @@
+from datetime import datetime
 from typing import Optional
-import math
 
-from fastapi import APIRouter, Depends, status, HTTPException
-from sqlalchemy import or_, func, and_
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query, Response, status, HTTPException
+from sqlalchemy import and_, select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .. import models, database, schema, oauth2, utils
+from .. import models, database, schema, oauth2, utils, pagination, counting, streaming, bulk, catalog
+from ..config import settings
+from ..search import filter_books
 from ..custom import CustomRequest, CustomResponse, CustomRoute
 
 router = APIRouter()
@@ -16,67 +18,113 @@ router.route_class = CustomRoute
 
 : Get all books and search book
 : Create a book
+: Create, update or delete many books (bulk)
 : Get all books by user
+: Export all books (ndjson, csv, xml)
 : Get single book
 : Update existing book
 : Delete any book
 
+Pagination:
+Send page and per_page for numbered pages, or omit page and send per_page
+(and cursor from next_cursor of previous summary) for cursor pages which stay
+fast on deep pages. Send count=false to skip total and total_pages
+
+Streaming:
+Send stream=true on listings to stream rows as they are fetched from the
+database (large per_page), summary come after rows
+
+Bulk:
+POST, PUT and DELETE /books/bulk take an array of books (ids for delete),
+or in xml <books><book>..</book></books>. Every item is validated on its
+own, valid items are written in one transaction and result of each item
+is returned with 207 when some items failed
+
+Caching:
+Single book has ETag of its version, send If-None-Match on GET to get 304
+and If-Match on PUT/DELETE to fail with 412 when book changed meanwhile.
+Public listing has ETag from catalog version (changed on any book write),
+send If-None-Match to get 304, rendered listings are also cached server side
+
+Export:
+/books/export?format=ndjson|csv|xml (login required) with optional search and
+mine=true (only books of user) filters stream every book, gzip when
+Accept-Encoding allow it
+
 Media type: 
-You also set Accept headers for different response
-like request in json and response in xml and vice versa
+Response format is negotiated from Accept header (json, xml, msgpack),
+without Accept response use same format as request Content-Type
 
-media_type = request.headers.get('Accept')
+media_type = request.media_type
 
 """
 
 @router.get('/books')
-def books(request: CustomRequest, response: CustomResponse, page: int, 
-    per_page: int, search: Optional[str] = '', db: Session = Depends(database.get_db)):
-    # Get content type header
-    media_type = request.headers.get('Content-Type')
+async def books(request: CustomRequest, response: CustomResponse,
+    per_page: int = Query(..., ge=1, le=settings.BOOK_MAX_PER_PAGE), page: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None, search: Optional[str] = '', count: bool = True, stream: bool = False,
+    db: AsyncSession = Depends(database.get_async_db)):
+    # Get negotiated response media type
+    media_type = request.media_type
+    dialect = db.get_bind().dialect.name
 
+    # Not modified or cached listing while catalog did not change
+    key = catalog.listing_key(request, media_type)
+    cached = catalog.cached_listing(request, key, media_type, stream=stream)
+    if cached:
+        return cached
 
-    # Get search or/and pagination query
-    p = page - 1
-    books = db.query(models.Book, func.count(models.Book.id).over().label("total")).group_by(
-        models.Book.id).filter(or_(models.Book.title.contains(search), 
-        models.Book.description.contains(search))).limit(per_page).offset(p * per_page)
-    
+    # Count books of search (skipped when client opt out)
+    total = None
+    if count:
+        total = await counting.count_books(db, filter_books(select(models.Book), search, dialect, ranked=False),
+            search=search)
 
-    # Model to dict and exclude extra field
-    rows, total = utils.multiple_model_to_dict(models=books, exclude=['user_id'])
+    # Stream rows as they are fetched
+    if stream:
+        books = filter_books(select(models.Book), search, dialect, ranked=page is not None)
+        return catalog.store_listing(key, streaming.stream_books(db, books, per_page, page, cursor, total, media_type))
 
-    # Add pagination summary
-    
-    summary = dict(
-        page=page, 
-        per_page=per_page, 
-        total=total, 
-        total_pages= math.ceil(total / per_page)
-    )
+    # Keyset pagination (without page) ordered by creation
+    if page is None:
+        books = filter_books(select(models.Book), search, dialect, ranked=False)
+        books, next_cursor = await pagination.keyset(db, books, per_page, cursor)
+        summary = pagination.cursor_summary(per_page, cursor, next_cursor, total)
+
+    else:
+        # Get search or/and pagination query, creation order (after rank) keep pages stable
+        p = page - 1
+        books = filter_books(select(models.Book), search, dialect).order_by(models.Book.created_at, models.Book.id)
+        books = books.limit(per_page).offset(p * per_page)
+        books = (await db.execute(books)).scalars().all()
+        summary = pagination.page_summary(page, per_page, total)
+
+    # Model to dict and exclude extra field
+    rows = utils.multiple_model_to_dict(models=books, exclude=['user_id'])
     data = dict(rows=rows, summary=summary)
 
     # Set response and status code 
     response = CustomResponse(content=data, media_type=media_type, custom_root='books')
     response.status_code = status.HTTP_200_OK
 
-    # Return response
-    return response
+    # Return response, cached until catalog change
+    return catalog.store_listing(key, response)
 
 @router.post('/books')
-def create_book(request: CustomRequest, response: CustomResponse, payload: schema.CreateBookSchema, 
-    user_id: str = Depends(oauth2.require_user), db: Session = Depends(database.get_db)):
-    # Get content type header
-    media_type = request.headers.get('Content-Type')
+async def create_book(request: CustomRequest, response: CustomResponse, payload: schema.CreateBookSchema, 
+    user: schema.UserPrincipal = Depends(oauth2.require_user), db: AsyncSession = Depends(database.get_async_db)):
+    # Get negotiated response media type
+    media_type = request.media_type
     
     # Add user id in book payload
-    payload.user_id = user_id
+    payload.user_id = user.id
     
     # Create new book
     new_book = models.Book(**payload.dict())
     db.add(new_book)
-    db.commit()
-    db.refresh(new_book)
+    await db.commit()
+    await db.refresh(new_book)
+    catalog.changed(user.id)
 
     # Model to dict and Exclude extra field
     data = utils.model_to_dict(model=new_book, exclude=['user_id'])
@@ -88,27 +136,123 @@ def create_book(request: CustomRequest, response: CustomResponse, payload: schem
     # Return response 
     return response
 
+@router.post('/books/bulk')
+async def create_books(request: CustomRequest, response: CustomResponse, payload: schema.BulkBookSchema,
+    user: schema.UserPrincipal = Depends(oauth2.require_user), db: AsyncSession = Depends(database.get_async_db)):
+    # Get negotiated response media type
+    media_type = request.media_type
+
+    # Validate every book
+    bulk.check_size(payload.__root__)
+    valid, results = bulk.validate_items(payload.__root__, schema.CreateBookSchema)
+
+    # Create valid books in one transaction
+    now = datetime.now()
+    rows = [dict(book.dict(), user_id=user.id, created_at=now, updated_at=now) for _, book in valid]
+    if rows:
+        ids = await bulk.insert_books(db, rows)
+        await db.commit()
+        catalog.changed(user.id)
+
+        for (index, _), id in zip(valid, ids):
+            results[index] = dict(index=index, status='created', id=id)
+
+    # Set response with result of every book
+    results = [results[index] for index in range(len(payload.__root__))]
+    data = dict(rows=results, summary=bulk.summary(results, 'created'))
+    response = CustomResponse(content=data, media_type=media_type, custom_root='books')
+    response.status_code = status.HTTP_201_CREATED if len(valid) == len(results) else status.HTTP_207_MULTI_STATUS
+
+    # Return response
+    return response
+
+@router.put('/books/bulk')
+async def update_books(request: CustomRequest, response: CustomResponse, payload: schema.BulkBookSchema,
+    user: schema.UserPrincipal = Depends(oauth2.require_user), db: AsyncSession = Depends(database.get_async_db)):
+    # Get negotiated response media type
+    media_type = request.media_type
+
+    # Validate every book, only sent fields are updated
+    bulk.check_size(payload.__root__)
+    valid, results = bulk.validate_items(payload.__root__, schema.UpdateBookItemSchema)
+    items = [(book.id, book.dict(exclude_unset=True, exclude={'id'})) for _, book in valid]
+
+    # Update books of user in one transaction
+    if items:
+        updated = await bulk.update_books(db, user.id, items)
+        await db.commit()
+        if updated:
+            catalog.changed(user.id)
+
+        for (index, book) in valid:
+            results[index] = dict(index=index, status='updated' if book.id in updated else 'not_found', id=book.id)
+
+    # Set response with result of every book
+    results = [results[index] for index in range(len(payload.__root__))]
+    data = dict(rows=results, summary=bulk.summary(results, 'updated'))
+    response = CustomResponse(content=data, media_type=media_type, custom_root='books')
+    response.status_code = status.HTTP_200_OK if data['summary']['failed'] == 0 else status.HTTP_207_MULTI_STATUS
+
+    # Return response
+    return response
+
+@router.delete('/books/bulk')
+async def delete_books(request: CustomRequest, response: CustomResponse, payload: schema.BulkDeleteBookSchema,
+    user: schema.UserPrincipal = Depends(oauth2.require_user), db: AsyncSession = Depends(database.get_async_db)):
+    # Get negotiated response media type
+    media_type = request.media_type
+
+    # Delete books of user in one transaction
+    ids = payload.__root__
+    bulk.check_size(ids)
+    deleted = await bulk.delete_books(db, user.id, ids) if ids else set()
+    await db.commit()
+
+    # Listings and ETags stay valid when nothing was deleted
+    if deleted:
+        catalog.changed(user.id)
+
+    # Set response with result of every book
+    results = [dict(index=index, status='deleted' if id in deleted else 'not_found', id=id) for index, id in enumerate(ids)]
+    data = dict(rows=results, summary=bulk.summary(results, 'deleted'))
+    response = CustomResponse(content=data, media_type=media_type, custom_root='books')
+    response.status_code = status.HTTP_200_OK if data['summary']['failed'] == 0 else status.HTTP_207_MULTI_STATUS
+
+    # Return response
+    return response
+
 @router.get('/books/user')
-def books_by_user(request: CustomRequest, response: CustomResponse, page: int, per_page: int, 
-    user_id: str = Depends(oauth2.require_user), db: Session = Depends(database.get_db)):
-    # Get content type header
-    media_type = request.headers.get('Content-Type')
+async def books_by_user(request: CustomRequest, response: CustomResponse,
+    per_page: int = Query(..., ge=1, le=settings.BOOK_MAX_PER_PAGE), page: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None, count: bool = True, stream: bool = False,
+    user: schema.UserPrincipal = Depends(oauth2.require_user),
+    db: AsyncSession = Depends(database.get_async_db)):
+    # Get negotiated response media type
+    media_type = request.media_type
 
     # Get book query
-    p = page - 1
-    books = db.query(models.Book, func.count(models.Book.id).over().label("total")).group_by(
-        models.Book.id).filter(models.Book.user_id == user_id).limit(per_page).offset(p * per_page)
+    books = select(models.Book).filter(models.Book.user_id == user.id)
+
+    # Count books of user (skipped when client opt out)
+    total = await counting.count_books(db, books, user_id=user.id) if count else None
+
+    # Stream rows as they are fetched
+    if stream:
+        return streaming.stream_books(db, books, per_page, page, cursor, total, media_type)
+
+    # Keyset pagination (without page) ordered by creation
+    if page is None:
+        books, next_cursor = await pagination.keyset(db, books, per_page, cursor)
+        summary = pagination.cursor_summary(per_page, cursor, next_cursor, total)
+
+    else:
+        p = page - 1
+        books = books.order_by(models.Book.created_at, models.Book.id).limit(per_page).offset(p * per_page)
+        books = (await db.execute(books)).scalars().all()
+        summary = pagination.page_summary(page, per_page, total)
 
     # Model to dict and exclude extra field
-    rows, total = utils.multiple_model_to_dict(models=books, exclude=['user_id'])
-
-    # Add pagination summary
-    summary = dict(
-        page=page, 
-        per_page=per_page, 
-        total=total, 
-        total_pages= math.ceil(total / per_page)
-    )
+    rows = utils.multiple_model_to_dict(models=books, exclude=['user_id'])
     data = dict(rows=rows, summary=summary)
 
     # Set response and status code 
@@ -118,73 +262,126 @@ def books_by_user(request: CustomRequest, response: CustomResponse, page: int, p
     # Return response
     return response
 
+@router.get('/books/export')
+async def export_books(request: CustomRequest, format: str = 'ndjson', search: Optional[str] = '',
+    mine: bool = False, user: schema.UserPrincipal = Depends(oauth2.require_user),
+    db: AsyncSession = Depends(database.get_async_db)):
+    dialect = db.get_bind().dialect.name
+
+    # Get search or/and own books query
+    books = filter_books(select(models.Book), search, dialect, ranked=False)
+    if mine:
+        books = books.filter(models.Book.user_id == user.id)
+
+    # Stream every book, compressed when client accept gzip
+    return streaming.export_books(db, books, format, request.headers.get('Accept-Encoding'))
+
 @router.get('/books/{id}')
-def book(request: CustomRequest, response: CustomResponse, id: str,
-    user_id: str = Depends(oauth2.require_user), db: Session = Depends(database.get_db)):
-    # Get content type header
-    media_type = request.headers.get('Content-Type')
+async def book(request: CustomRequest, response: CustomResponse, id: int,
+    user: schema.UserPrincipal = Depends(oauth2.require_user), db: AsyncSession = Depends(database.get_async_db)):
+    # Get negotiated response media type
+    media_type = request.media_type
 
     # Get book query
-    book = db.query(models.Book).filter(and_(models.Book.id == id,
-        models.Book.user_id == user_id)).first()
+    book = (await db.execute(select(models.Book).filter(and_(models.Book.id == id,
+        models.Book.user_id == user.id)))).scalars().first()
     
     # Check book not found
     if not book:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="book not found")
+
+    # Not modified since client copy
+    headers = {'ETag': catalog.book_etag(book.id, book.version), 'Cache-Control': 'private, no-cache'}
+    if catalog.etag_matches(request.headers.get('If-None-Match'), headers['ETag']):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
     
     # Model to dict and exclude extra fields
     data = utils.model_to_dict(model=book, exclude=["user_id"])
 
     # Set response and status code
-    response = CustomResponse(content=data, media_type=media_type, custom_root='book')
+    response = CustomResponse(content=data, media_type=media_type, custom_root='book', headers=headers)
     response.status_code = status.HTTP_200_OK
     
     # Send response
     return response
 
 @router.put('/books/{id}')
-def create_book(request: CustomRequest, response: CustomResponse, payload: schema.UpdateBookSchema, 
-    id: str, user_id: str = Depends(oauth2.require_user), db: Session = Depends(database.get_db)):
-    # Get content type header
-    media_type = request.headers.get('Content-Type')
+async def update_book(request: CustomRequest, response: CustomResponse, payload: schema.UpdateBookSchema, 
+    id: int, user: schema.UserPrincipal = Depends(oauth2.require_user), db: AsyncSession = Depends(database.get_async_db)):
+    # Get negotiated response media type
+    media_type = request.media_type
     
-    # Get book query
-    book = db.query(models.Book).filter(and_(models.Book.id == id,
-        models.Book.user_id == user_id))
-     
-    # Check if book not found 
-    if not book.first():
+    # Update only sent fields, bump updated_at and version in one statement
+    owner = and_(models.Book.id == id, models.Book.user_id == user.id)
+    condition = owner
+
+    # Only update version client read (If-Match)
+    versions = catalog.match_versions(request.headers.get('If-Match'), id)
+    if versions is not None:
+        condition = and_(owner, models.Book.version.in_(versions))
+
+    book = update(models.Book).where(condition).values(**payload.dict(exclude_unset=True),
+        updated_at=datetime.now(), version=models.Book.version + 1).execution_options(synchronize_session=False)
+
+    # Updated book is returned by statement, without RETURNING (sqlite) check rowcount and select it
+    if db.get_bind().dialect.full_returning:
+        book = (await db.execute(book.returning(*models.Book.__table__.columns))).first()
+    elif (await db.execute(book)).rowcount:
+        book = (await db.execute(select(*models.Book.__table__.columns).filter(owner))).first()
+    else:
+        book = None
+
+    # Check if book changed since client read it or not found
+    if not book:
+        if versions is not None and (await db.execute(select(models.Book.id).filter(owner))).first():
+            raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="book was modified, get it again")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="book not found")
+
+    await db.commit()
+    catalog.changed(user.id)
+
+    # Row to dict and exclude extra field
+    data = utils.row_to_dict(row=book, exclude=['user_id'])
     
-    # Update book
-    book.update(payload.dict())
-    db.commit()
-    
-    # Set response and status code  
-    response = CustomResponse(content={ "detail" : "book updated successfully" }, 
-        media_type=media_type, custom_root='book')
-    response.status_code = status.HTTP_205_RESET_CONTENT
+    # Set response updated book and status code  
+    response = CustomResponse(content=data, media_type=media_type, custom_root='book',
+        headers={'ETag': catalog.book_etag(book.id, book.version)})
+    response.status_code = status.HTTP_200_OK
     
     # Send response
     return response
 
 @router.delete('/books/{id}')
-def delete_book(request: CustomRequest, response: CustomResponse, 
-    id: str, user_id: str = Depends(oauth2.require_user), db: Session = Depends(database.get_db)):
-    # Get content type header
-    media_type = request.headers.get('Content-Type')
+async def delete_book(request: CustomRequest, response: CustomResponse, 
+    id: int, user: schema.UserPrincipal = Depends(oauth2.require_user), db: AsyncSession = Depends(database.get_async_db)):
+    # Get negotiated response media type
+    media_type = request.media_type
 
-    # Get book query
-    book = db.query(models.Book).filter(and_(models.Book.id == id,
-        models.Book.user_id == user_id))
+    # Delete book in one statement
+    owner = and_(models.Book.id == id, models.Book.user_id == user.id)
+    condition = owner
+
+    # Only delete version client read (If-Match)
+    versions = catalog.match_versions(request.headers.get('If-Match'), id)
+    if versions is not None:
+        condition = and_(owner, models.Book.version.in_(versions))
 
-    # Check if book not found 
-    if not book.first():
+    book = delete(models.Book).where(condition).execution_options(synchronize_session=False)
+
+    # Deleted id is returned by statement, without RETURNING (sqlite) check rowcount
+    if db.get_bind().dialect.full_returning:
+        deleted = (await db.execute(book.returning(models.Book.id))).first() is not None
+    else:
+        deleted = (await db.execute(book)).rowcount > 0
+
+    # Check if book changed since client read it or not found
+    if not deleted:
+        if versions is not None and (await db.execute(select(models.Book.id).filter(owner))).first():
+            raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="book was modified, get it again")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="book not found")
-    
-    # Delete book
-    book.delete()
-    db.commit()
+
+    await db.commit()
+    catalog.changed(user.id)
     
     # Set response and status code
     response = CustomResponse(content={ "detail" : "book deleted successfully" }, 
@@ -1,10 +1,14 @@
+import mimetypes
 import os
+from typing import Optional
 
-from fastapi import APIRouter, status, HTTPException, File, UploadFile, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, status, HTTPException, File, UploadFile
+from fastapi.responses import RedirectResponse
+from sqlalchemy.orm import Session
 
-from .. import schema, utils
+from .. import blobs, compression, fileserve, images, jobs, models, oauth2, schema, storage, utils
 from ..config import settings
+from ..database import get_db
 from ..custom import CustomRequest, CustomResponse, CustomRoute
 
 router = APIRouter()
@@ -17,55 +21,195 @@ router.route_class = CustomRoute
 : Upload new file
 : Get file
 
+Upload is copied in FILE_CHUNK_SIZE chunks to temp file and renamed in
+place, so memory per upload stay bounded and url is never given for
+missing or half written file. Larger than FILE_MAX_SIZE is 413, sha256 of
+file is in response
+
+Files are stored content addressed (blobs.py), same file uploaded twice
+get same url and is stored once. Older uuid named files in upload/images
+are still served
+
+getfile (fileserve.py) support Range (206, multipart/byteranges, 416),
+ETag / Last-Modified with 304 and immutable Cache-Control for sha256 and
+uuid names, file name is never resolved outside upload directory
+
+New images get WebP variants (image_variants job, images.py) made in
+process pool after upload, getfile?size=thumb (IMAGE_SIZES) serve them, original is sent
+until variant exist
+
+Compressible uploads get precompressed variants (precompress job), getfile
+send variant matching Accept-Encoding with Content-Encoding header
+
+Blobs live in storage backend (storage.py, local files, S3 or memory).
+When backend give presigned urls (S3) and STORAGE_REDIRECT is on, getfile
+redirect to storage (307) instead of sending bytes through app, and
+clients can upload straight to storage:
+
+: upload-url, client send sha256, size and extension, get presigned PUT
+  (storage refuse body with other sha256 or size), no upload when blob exist
+: upload-complete, check object is in storage and start its variants jobs
+  (first completion of blob only, repeating it enqueue nothing)
+
+Both need login.
+
 """
 
+def enqueue_variants(db: Session, key: str, new: bool):
+    # Variants only once per content (image variants again when some failed before)
+    if new:
+        jobs.enqueue(db, 'precompress', key=key)
+    if new or images.missing_variants(blobs.object_name(key)):
+        jobs.enqueue(db, 'image_variants', key=key)
+    db.commit()
+
+def check_extension(extension: str):
+    if extension not in settings.FILE_EXTENSIONS:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail="extension no acceptable")
+
 @router.post("/upload")
-def upload(request: CustomRequest, response: CustomResponse, background_tasks: BackgroundTasks, file: UploadFile = File()):
-    # Get content type header
-    # use Accept headers to return xml or json data of file
-    media_type = request.headers.get('Accept')
+def upload(request: CustomRequest, response: CustomResponse, file: UploadFile = File(), db: Session = Depends(get_db)):
+    # Get negotiated response media type
+    media_type = request.media_type
 
     # Check file exist
     if not file:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='image no found')
 
-    # Get new uuid filename and extension 
-    filename, extension = utils.generate_filename(file.filename)
-     
-    # Check extension of file 
-    if extension not in settings.FILE_EXTENSIONS:
-        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail="extension no acceptable")
+    # Get extension of file
+    _, extension = utils.generate_filename(file.filename)
+    extension = extension.lower()
 
-    # File Content
-    contents = file.file.read()
+    # Check extension of file 
+    check_extension(extension)
 
-    # Path and Url
-    path = os.path.abspath(os.path.join("upload", "images", f"{filename}"))
-    url = f"{request.base_url}api/file/getfile/{filename}"
-    
-    # Write file
+    # Store blob in chunks (handler run in threadpool, off event loop)
     try:
-        background_tasks.add_task(utils.write_file, path, contents)
-    except Exception:
+        key, new = blobs.store(db, file.file, extension)
+    except utils.FileTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except OSError:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='file upload failed')
     finally:
         file.file.close()
 
+    # Enqueue variants jobs of blob
+    enqueue_variants(db, key, new)
+
+    # Url of blob
+    url = f"{request.base_url}api/file/getfile/{key}"
+    sha256, _ = key.split('.', 1)
+
     # Set response file url and status code
-    response = CustomResponse(content={ 'status': 'success', 'url': url }, media_type=media_type, custom_root='file')
+    response = CustomResponse(content={ 'status': 'success', 'url': url, 'sha256': sha256 }, media_type=media_type, custom_root='file')
     response.status_code = status.HTTP_201_CREATED
 
     # Send response
     return response
 
 @router.get("/getfile/{filename}", status_code=status.HTTP_200_OK)
-def getfile(filename: str):
-    # Create path of file
-    image_path = os.path.abspath(os.path.join("upload", "images", f"{filename}"))
-    
-    # Check file exist
-    if not os.path.exists(image_path):
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='file not found')
+def getfile(request: CustomRequest, filename: str, size: Optional[str] = None):
+    # Check requested variant size
+    if size is not None and size not in settings.IMAGE_SIZES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'size must be one of {", ".join(settings.IMAGE_SIZES)}')
+
+    # Create name of file, content addressed blob or old uuid named file
+    if blobs.is_blob_key(filename):
+        backend = storage.backend
+        name = blobs.object_name(filename)
+        etag = f'"{filename.split(".", 1)[0]}"'
+
+        # Resized variant once created, original until then
+        if size and backend.exists(images.variant_name(name, size)):
+            name, etag, media_type = images.variant_name(name, size), f'"{filename.split(".", 1)[0]}-{size}"', 'image/webp'
+        else:
+            media_type = mimetypes.guess_type(filename)[0]
+
+        # Storage send bytes itself (ranges and conditional requests too)
+        if not backend.local and settings.STORAGE_REDIRECT:
+            url = backend.presigned_url(name)
+            if url:
+                # Redirect to original for missing variant is not cached
+                max_age = settings.STORAGE_PRESIGN_EXPIRES // 2 if size is None or media_type == 'image/webp' else 0
+                return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT,
+                    headers={'Cache-Control': f'private, max-age={max_age}'})
+
+        if media_type == 'image/webp':
+            return fileserve.serve(request, name, media_type=media_type, etag=etag, immutable=True, backend=backend)
+        exists = backend.exists
+    else:
+        try:
+            name = fileserve.resolve(os.path.join("upload", "images"), filename)
+        except fileserve.UnsafePath:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='file not found')
+        backend, etag, media_type, exists = None, None, mimetypes.guess_type(filename)[0], os.path.exists
+
+    # Get precompressed variant client accept, its own ETag
+    variant, encoding = compression.precompressed_variant(name, request.headers.get('Accept-Encoding'), exists)
+    headers = {'Vary': 'Accept-Encoding'}
+    if encoding:
+        headers['Content-Encoding'] = encoding
+        etag = etag and compression.encoded_etag(etag, encoding)
+
+    # Send file, ranges and conditional requests handled
+    # Original sent for missing variant must not be cached as that variant
+    immutable = (blobs.is_blob_key(filename) or fileserve.immutable_name(filename)) and size is None
+    return fileserve.serve(request, variant, media_type=media_type, etag=etag,
+        immutable=immutable, headers=headers, backend=backend)
+
+@router.post("/upload-url")
+def upload_url(request: CustomRequest, payload: schema.UploadUrlSchema,
+    user: schema.UserPrincipal = Depends(oauth2.require_user), db: Session = Depends(get_db)):
+    # Get negotiated response media type
+    media_type = request.media_type
+
+    # Check extension and size of file
+    check_extension(payload.extension)
+    if not 0 < payload.size <= settings.FILE_MAX_SIZE:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f'file must be 1 to {settings.FILE_MAX_SIZE} bytes')
+
+    key = f'{payload.sha256}.{payload.extension}'
+    name = blobs.object_name(key)
+    url = f"{request.base_url}api/file/getfile/{key}"
+
+    # Get presigned upload of backend, none when same content is stored already
+    exists = storage.backend.exists(name)
+    if not exists:
+        upload = storage.backend.presigned_upload(name, payload.size, payload.sha256, mimetypes.guess_type(key)[0] or 'application/octet-stream')
+        if upload is None:
+            raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail='storage has no direct upload, use /upload')
+
+    # Create blob row, gc keep it for BLOB_GC_GRACE while client upload
+    blobs.touch(db, key, payload.size)
+
+    # Same content stored already, nothing to upload
+    if exists:
+        return CustomResponse(content={ 'status': 'success', 'url': url, 'key': key }, media_type=media_type, custom_root='file')
 
-    # Send file in response 
-    return FileResponse(image_path)
+    # Send response
+    response = CustomResponse(content={ 'status': 'pending', 'url': url, 'key': key, 'upload': upload }, media_type=media_type, custom_root='file')
+    response.status_code = status.HTTP_201_CREATED
+    return response
+
+@router.post("/upload-complete")
+def upload_complete(request: CustomRequest, payload: schema.UploadCompleteSchema,
+    user: schema.UserPrincipal = Depends(oauth2.require_user), db: Session = Depends(get_db)):
+    # Get negotiated response media type
+    media_type = request.media_type
+
+    # Check blob and its object in storage
+    blob = db.get(models.Blob, payload.key)
+    stat = storage.backend.stat(blobs.object_name(payload.key))
+    if blob is None or stat is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='upload not found')
+    if stat[0] != blob.size:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='uploaded size do not match')
+
+    # Enqueue variants jobs of blob on first completion only
+    if blobs.complete(db, payload.key):
+        enqueue_variants(db, payload.key, True)
+
+    # Send response
+    url = f"{request.base_url}api/file/getfile/{payload.key}"
+    return CustomResponse(content={ 'status': 'success', 'url': url, 'key': payload.key }, media_type=media_type, custom_root='file')
@@ -1,7 +1,6 @@
 from fastapi import APIRouter, Depends, status
-from sqlalchemy.orm import Session
 
-from .. import models, oauth2, database, utils
+from .. import oauth2, schema, utils
 from ..custom import CustomRequest, CustomResponse, CustomRoute
 
 router = APIRouter()
@@ -11,24 +10,21 @@ router.route_class = CustomRoute
 Route return current login user
 
 Media type: 
-You also set Accept headers for different response
-like request in json and response in xml and vice versa
+Response format is negotiated from Accept header (json, xml, msgpack),
+without Accept response use same format as request Content-Type
 
-media_type = request.headers.get('Accept')
+media_type = request.media_type
 
 """
 
 @router.get('/me',)
-def get_current_user(request: CustomRequest, response: CustomResponse, 
-    db: Session = Depends(database.get_db), user_id: str = Depends(oauth2.require_user)):
-    # Get content type header
-    media_type = request.headers.get('Content-Type')
+async def get_current_user(request: CustomRequest, response: CustomResponse, 
+    user: schema.UserPrincipal = Depends(oauth2.require_user)):
+    # Get negotiated response media type
+    media_type = request.media_type
     
-    # Get current user
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-
-    # Model to dict and Exclude extra field
-    data = utils.model_to_dict(model=user, exclude=['password', 'role', 'verified'])
+    # Current user principal to dict and Exclude extra field
+    data = utils.schema_to_dict(schema=user, exclude=['role', 'verified'])
 
     # Set user with response and status code  
     response = CustomResponse(content=data, media_type=media_type, custom_root='user')
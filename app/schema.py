@@ -1,8 +1,8 @@
 from datetime import datetime
 import uuid
-from typing import Optional
+from typing import Any, List, Optional
 
-from pydantic import BaseModel, EmailStr, constr
+from pydantic import BaseModel, EmailStr, constr, validator
 
 
 class UserBaseSchema(BaseModel):
@@ -29,19 +29,67 @@ class CreateUserSchema(UserBaseSchema):
     verified: bool = False
 
 class CreateBookSchema(BookBaseSchema):
-    user_id: Optional[str]
+    user_id: Optional[int]
 
 class UpdateBookSchema(BaseModel):
     title: Optional[str]
     description: Optional[str]
     cover_image: Optional[str]
-    price: Optional[str]
+    price: Optional[float]
+
+    @validator('title', 'description', 'price', pre=True)
+    def not_null(cls, value):
+        # Fields may be omitted, but columns are NOT NULL
+        if value is None:
+            raise ValueError('field may not be null')
+        return value
+
+class UpdateBookItemSchema(UpdateBookSchema):
+    id: int
+
+class BulkBookSchema(BaseModel):
+    """
+    Array of books, items are validated one by one in route. XML envelope
+    <books><book>..</book><book>..</book></books> is parsed to {'book': [..]}
+    ({'book': {..}} for one book) and unwrapped to the array
+    """
+    __root__: List[Any]
+
+    @validator('__root__', pre=True)
+    def unwrap_envelope(cls, value):
+        if isinstance(value, dict) and len(value) == 1:
+            value = next(iter(value.values()))
+            if not isinstance(value, list):
+                value = [value]
+        return value
+
+class BulkDeleteBookSchema(BulkBookSchema):
+    __root__: List[int]
 
 class LoginUserSchema(BaseModel):
     email: EmailStr
     password: constr(min_length=8)
 
+class UserPrincipal(UserBaseSchema):
+    id: int
+    verified: bool
+    role: str
+    created_at: datetime
+    updated_at: datetime
+
 class BookResponse(BookBaseSchema):
     id: uuid.UUID
     created_at: datetime
     updated_at: datetime
+
+class UploadUrlSchema(BaseModel):
+    sha256: constr(regex=r'^[0-9a-f]{64}$')
+    size: int
+    extension: str
+
+    @validator('extension')
+    def lower_extension(cls, value):
+        return value.lower().lstrip('.')
+
+class UploadCompleteSchema(BaseModel):
+    key: constr(regex=r'^[0-9a-f]{64}\.[0-9a-z]+$')
@@ -0,0 +1,70 @@
+import re
+
+from sqlalchemy import func, literal_column, select, table
+
+from . import models
+
+"""
+##### Book Full Text Search #####
+
+: PostgreSQL (tsvector expression backed by GIN index, ranked with ts_rank)
+: SQLite (FTS5 virtual table kept in sync by triggers, ranked with bm25)
+: Any other database (fallback to LIKE)
+
+Every search term is matched as a prefix and all terms must match.
+
+"""
+
+SEARCH_CONFIG = "'english'::regconfig"
+FTS_TABLE = 'book_fts'
+
+TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def search_terms(search: str):
+    return TERM_PATTERN.findall((search or '').lower())
+
+def book_document():
+    # Must stay identical to the ix_book_search index expression of the migration
+    # otherwise postgres can not use the GIN index
+    return func.to_tsvector(
+        literal_column(SEARCH_CONFIG),
+        func.coalesce(models.Book.title, literal_column("''")).op('||')(literal_column("' '")).op('||')(
+            func.coalesce(models.Book.description, literal_column("''")))
+    )
+
+def postgres_query(terms):
+    return func.to_tsquery(literal_column(SEARCH_CONFIG), ' & '.join(f"{term}:*" for term in terms))
+
+def sqlite_query(terms):
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def filter_books(query, search: str, dialect: str, ranked: bool = True):
+    """
+    Add search filter (and ranking order when ranked) on book query or select statement
+    """
+    terms = search_terms(search)
+
+    # Empty search match all books
+    if not terms:
+        return query
+
+    if dialect == 'postgresql':
+        document, ts_query = book_document(), postgres_query(terms)
+        query = query.filter(document.op('@@')(ts_query))
+        if ranked:
+            query = query.order_by(func.ts_rank(document, ts_query).desc(), models.Book.id)
+        return query
+
+    if dialect == 'sqlite':
+        match = literal_column(FTS_TABLE).op('MATCH')(sqlite_query(terms))
+        if ranked:
+            # FTS5 hidden rank column is bm25 score (lower is better)
+            return query.join(table(FTS_TABLE), literal_column(f'{FTS_TABLE}.rowid') == models.Book.id).filter(
+                match).order_by(literal_column(f'{FTS_TABLE}.rank'), models.Book.id)
+        return query.filter(models.Book.id.in_(select(literal_column('rowid')).select_from(table(FTS_TABLE)).where(match)))
+
+    # Fallback for databases without full text search
+    for term in terms:
+        query = query.filter(models.Book.title.contains(term) | models.Book.description.contains(term))
+    return query
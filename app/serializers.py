@@ -0,0 +1,253 @@
+import csv
+import io
+import re
+from functools import lru_cache
+from numbers import Number
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterator
+
+import orjson
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+"""
+##### Response Serializers #####
+
+Registry of serializers by media type used by CustomResponse
+
+: application/json (orjson)
+: application/x-ndjson (orjson, one row per line)
+: text/csv (rows of flat dicts, header from first row)
+: application/xml (streaming writer, same document shape as dicttoxml)
+: application/msgpack (when msgpack package is installed)
+
+Register new format with
+
+@register('application/x-format')
+class FormatSerializer(Serializer):
+    def render(self, content, root): ...
+    async def stream(self, key, batches, tail, root): ...
+
+stream write document {key: [items of batches...], **tail()} chunk by chunk,
+tail is called after last batch so it can depend on streamed rows
+
+"""
+
+SERIALIZERS: Dict[str, 'Serializer'] = {}
+
+
+def register(media_type: str) -> Callable:
+    def decorator(cls):
+        SERIALIZERS[media_type] = cls()
+        return cls
+    return decorator
+
+def get_serializer(media_type: str):
+    return SERIALIZERS.get(media_type)
+
+
+class Serializer:
+    media_type: str
+
+    def render(self, content: Any, root: str) -> bytes:
+        raise NotImplementedError
+
+    async def stream(self, key: str, batches: AsyncIterable[list], tail: Callable[[], dict], root: str) -> AsyncIterator[bytes]:
+        # Formats which can not be written incrementally render whole document at the end
+        items = []
+        async for batch in batches:
+            items.extend(batch)
+        yield self.render({key: items, **tail()}, root)
+
+
+@register('application/json')
+class JSONSerializer(Serializer):
+    media_type = 'application/json'
+
+    def render(self, content: Any, root: str = None) -> bytes:
+        return orjson.dumps(content)
+
+    async def stream(self, key: str, batches: AsyncIterable[list], tail: Callable[[], dict], root: str = None):
+        yield b'{' + orjson.dumps(key) + b':['
+
+        separator = b''
+        async for batch in batches:
+            if batch:
+                yield separator + b','.join(map(orjson.dumps, batch))
+                separator = b','
+
+        # Tail keys continue the same object
+        rest = orjson.dumps(tail())
+        yield b']' + (b',' + rest[1:] if rest != b'{}' else b'}')
+
+
+@register('application/x-ndjson')
+class NDJSONSerializer(Serializer):
+    """
+    Newline delimited rows, tail (summary) is not part of the document
+    """
+    media_type = 'application/x-ndjson'
+
+    def render(self, content: Any, root: str = None) -> bytes:
+        rows = [content] if isinstance(content, dict) else content
+        return b''.join(orjson.dumps(row) + b'\n' for row in rows)
+
+    async def stream(self, key: str, batches: AsyncIterable[list], tail: Callable[[], dict], root: str = None):
+        async for batch in batches:
+            if batch:
+                yield self.render(batch)
+
+
+@register('text/csv')
+class CSVSerializer(Serializer):
+    """
+    Rows of flat dicts with header line from keys of first row, tail (summary) is not part of the document
+    """
+    media_type = 'text/csv'
+
+    def render(self, content: Any, root: str = None, header: bool = True) -> bytes:
+        rows = [content] if isinstance(content, dict) else content
+        if not rows:
+            return b''
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=list(rows[0]))
+        if header:
+            writer.writeheader()
+        writer.writerows(rows)
+        return buffer.getvalue().encode('utf-8')
+
+    async def stream(self, key: str, batches: AsyncIterable[list], tail: Callable[[], dict], root: str = None):
+        header = True
+        async for batch in batches:
+            if batch:
+                yield self.render(batch, header=header)
+                header = False
+
+
+class MessagePackSerializer(Serializer):
+    """
+    Compact binary format, arrays carry their length up front so streamed
+    documents are rendered once all rows are fetched
+    """
+    media_type = 'application/msgpack'
+
+    def render(self, content: Any, root: str = None) -> bytes:
+        return msgpack.packb(content, use_bin_type=True)
+
+if msgpack is not None:
+    register('application/msgpack')(MessagePackSerializer)
+
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" ?>'
+XML_NAME = re.compile(r'^[^\W\d][\w.\-]*$')
+
+
+def escape(value: str) -> str:
+    # Chained replace is much faster than str.translate, & go first
+    return value.replace('&', '&amp;').replace('"', '&quot;').replace("'", '&apos;').replace('<', '&lt;').replace('>', '&gt;')
+
+@lru_cache(maxsize=1024)
+def element_name(key: str):
+    """
+    Return (tag, name attribute) of key like dicttoxml, invalid names go in name attribute
+    """
+    key = escape(str(key))
+
+    if XML_NAME.match(key):
+        return key, ''
+    if key.isdigit():
+        return f'n{key}', ''
+    if XML_NAME.match(key.replace(' ', '_')):
+        return key.replace(' ', '_'), ''
+    return 'key', f' name="{key}"'
+
+def xml_type(value: Any) -> str:
+    if isinstance(value, str):
+        return 'str'
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, Number):
+        return 'number'
+    if value is None:
+        return 'null'
+    if isinstance(value, dict):
+        return 'dict'
+    if isinstance(value, (list, tuple, set)):
+        return 'list'
+    return type(value).__name__
+
+
+@register('application/xml')
+class XMLSerializer(Serializer):
+    media_type = 'application/xml'
+    item = 'item'
+
+    def element(self, out: list, key: str, value: Any):
+        tag, name = element_name(key)
+
+        # Fast path, most values are str
+        if value.__class__ is str:
+            out.append(f'<{tag}{name} type="str">{escape(value)}</{tag}>')
+            return
+
+        kind = xml_type(value)
+        if kind == 'dict':
+            out.append(f'<{tag}{name} type="dict">')
+            self.children(out, value)
+            out.append(f'</{tag}>')
+        elif kind == 'list':
+            out.append(f'<{tag}{name} type="list">')
+            for item in value:
+                self.element(out, self.item, item)
+            out.append(f'</{tag}>')
+        elif kind == 'null':
+            out.append(f'<{tag}{name} type="null"></{tag}>')
+        else:
+            out.append(f'<{tag}{name} type="{kind}">{escape(str(value))}</{tag}>')
+
+    def children(self, out: list, content: Any):
+        if isinstance(content, dict):
+            for key, value in content.items():
+                self.element(out, key, value)
+        else:
+            for item in content:
+                self.element(out, self.item, item)
+
+    def iter_render(self, content: Any, root: str) -> Iterator[str]:
+        """
+        Yield document in chunks, one per top level element
+        """
+        yield f'{XML_DECLARATION}<{root}>'
+        for key, value in (content.items() if isinstance(content, dict) else ((self.item, item) for item in content)):
+            out = []
+            self.element(out, key, value)
+            yield ''.join(out)
+        yield f'</{root}>'
+
+    def render(self, content: Any, root: str = 'root') -> bytes:
+        out = [XML_DECLARATION, f'<{root}>']
+        self.children(out, content)
+        out.append(f'</{root}>')
+        return ''.join(out).encode('utf-8')
+
+    async def stream(self, key: str, batches: AsyncIterable[list], tail: Callable[[], dict], root: str = 'root'):
+        tag, name = element_name(key)
+        yield f'{XML_DECLARATION}<{root}><{tag}{name} type="list">'.encode('utf-8')
+
+        async for batch in batches:
+            out = []
+            for item in batch:
+                self.element(out, self.item, item)
+            yield ''.join(out).encode('utf-8')
+
+        out = [f'</{tag}>']
+        self.children(out, tail())
+        out.append(f'</{root}>')
+        yield ''.join(out).encode('utf-8')
@@ -0,0 +1,315 @@
+import base64
+import glob
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Optional, Tuple
+
+from .config import settings
+
+"""
+##### Object Storage #####
+
+Uploads (blobs and their variants) are kept in storage backend picked by
+STORAGE_BACKEND, objects are named "ab/cd/<sha256>.<ext>[.<variant>]":
+
+: local, files under BLOB_DIRECTORY (getfile send them with zero copy and ranges)
+: s3, any S3 compatible service (AWS, MinIO in docker-compose), needs boto3
+: memory, dict in process for tests and development
+
+S3 client is created once per process and shared by threads, its http
+connection pool hold STORAGE_POOL_SIZE connections. Files are uploaded
+with multipart upload above STORAGE_MULTIPART_CHUNK_SIZE.
+
+Backends that support it give presigned urls, getfile redirect downloads
+to them (STORAGE_REDIRECT) and clients can upload straight to storage:
+
+    POST /api/file/upload-url  {sha256, size, extension} -> {url, upload: {url, method, headers}}
+    PUT  <upload.url> with upload.headers and file as body (storage check sha256)
+    POST /api/file/upload-complete  {key}
+
+"""
+
+class Storage:
+    # Objects have file path, getfile can send them with fileserve
+    local = False
+
+    def temp_directory(self) -> str:
+        # Where uploads are spooled before put_file
+        return tempfile.gettempdir()
+
+    def put_file(self, name: str, path: str):
+        """
+        Store file at path as object, file is consumed (moved or removed)
+        """
+        raise NotImplementedError
+
+    def put_bytes(self, name: str, data: bytes):
+        raise NotImplementedError
+
+    def stat(self, name: str) -> Optional[Tuple[int, float]]:
+        """
+        (size, modified timestamp) of object, None when missing
+        """
+        raise NotImplementedError
+
+    def exists(self, name: str) -> bool:
+        return self.stat(name) is not None
+
+    def open(self, name: str) -> BinaryIO:
+        """
+        Seekable readable file of object
+        """
+        raise NotImplementedError
+
+    def read(self, name: str) -> bytes:
+        with self.open(name) as f:
+            return f.read()
+
+    def delete_prefix(self, prefix: str) -> int:
+        """
+        Delete object and its variants (names starting with prefix)
+        """
+        raise NotImplementedError
+
+    def local_path(self, name: str) -> Optional[str]:
+        return None
+
+    def download(self, name: str, path: str):
+        # Copy of object for code needing real file (Pillow in worker process)
+        with open(path, 'wb') as f, self.open(name) as source:
+            shutil.copyfileobj(source, f, settings.FILE_CHUNK_SIZE)
+
+    def presigned_url(self, name: str) -> Optional[str]:
+        return None
+
+    def presigned_upload(self, name: str, size: int, sha256: str, content_type: str) -> Optional[dict]:
+        return None
+
+
+class LocalStorage(Storage):
+    local = True
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def temp_directory(self) -> str:
+        # Same filesystem, so put_file is atomic rename
+        os.makedirs(self.root, exist_ok=True)
+        return self.root
+
+    def local_path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def put_file(self, name: str, path: str):
+        target = self.local_path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+
+    def put_bytes(self, name: str, data: bytes):
+        fd, path = tempfile.mkstemp(dir=self.temp_directory(), suffix='.part')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        self.put_file(name, path)
+
+    def stat(self, name: str):
+        try:
+            result = os.stat(self.local_path(name))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return result.st_size, result.st_mtime
+
+    def open(self, name: str) -> BinaryIO:
+        return open(self.local_path(name), 'rb')
+
+    def delete_prefix(self, prefix: str) -> int:
+        paths = glob.glob(glob.escape(self.local_path(prefix)) + '*')
+        for path in paths:
+            os.unlink(path)
+        return len(paths)
+
+
+class MemoryStorage(Storage):
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def put_file(self, name: str, path: str):
+        with open(path, 'rb') as f:
+            self.put_bytes(name, f.read())
+        os.unlink(path)
+
+    def put_bytes(self, name: str, data: bytes):
+        with self.lock:
+            self.objects[name] = (bytes(data), time.time())
+
+    def stat(self, name: str):
+        item = self.objects.get(name)
+        return None if item is None else (len(item[0]), item[1])
+
+    def open(self, name: str) -> BinaryIO:
+        item = self.objects.get(name)
+        if item is None:
+            raise FileNotFoundError(name)
+        return io.BytesIO(item[0])
+
+    def delete_prefix(self, prefix: str) -> int:
+        with self.lock:
+            names = [name for name in self.objects if name.startswith(prefix)]
+            for name in names:
+                del self.objects[name]
+        return len(names)
+
+
+class S3ObjectReader(io.RawIOBase):
+    """
+    Seekable file of S3 object, reads stream body of ranged GetObject from
+    current position (Range request read its range, not whole object)
+    """
+    def __init__(self, storage, name: str):
+        self.storage = storage
+        self.name = name
+        self.position = 0
+        self.body = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.storage.stat(self.name)[0]
+
+        # Body stream from old position is dropped, next read start new one
+        if offset != self.position:
+            self.close_body()
+            self.position = offset
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        if self.body is None:
+            from botocore.exceptions import ClientError
+            try:
+                self.body = self.storage.client.get_object(Bucket=self.storage.bucket, Key=self.name,
+                    Range=f'bytes={self.position}-')['Body']
+            except ClientError as e:
+                # Position at end of object
+                if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                    return 0
+                raise
+
+        data = self.body.read(len(buffer))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close_body(self):
+        if self.body is not None:
+            self.body.close()
+            self.body = None
+
+    def close(self):
+        self.close_body()
+        super().close()
+
+
+class S3Storage(Storage):
+    def __init__(self, bucket: str, endpoint_url: str = '', region: str = '', access_key: str = '', secret_key: str = ''):
+        self.bucket = bucket
+        self.options = dict(
+            endpoint_url=endpoint_url or None, region_name=region or None,
+            aws_access_key_id=access_key or None, aws_secret_access_key=secret_key or None,
+        )
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Created on first use, boto3 is imported only with s3 backend
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import boto3
+                    from botocore.config import Config
+                    self._client = boto3.session.Session().client('s3', config=Config(
+                        max_pool_connections=settings.STORAGE_POOL_SIZE, retries={'max_attempts': 3, 'mode': 'standard'},
+                        signature_version='s3v4',
+                    ), **self.options)
+        return self._client
+
+    def transfer_config(self):
+        from boto3.s3.transfer import TransferConfig
+        chunk_size = settings.STORAGE_MULTIPART_CHUNK_SIZE
+        return TransferConfig(multipart_threshold=chunk_size, multipart_chunksize=chunk_size, max_concurrency=4)
+
+    def put_file(self, name: str, path: str):
+        try:
+            self.client.upload_file(path, self.bucket, name, Config=self.transfer_config())
+        finally:
+            os.unlink(path)
+
+    def put_bytes(self, name: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=name, Body=data)
+
+    def stat(self, name: str):
+        from botocore.exceptions import ClientError
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=name)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return head['ContentLength'], head['LastModified'].timestamp()
+
+    def download(self, name: str, path: str):
+        self.client.download_file(self.bucket, name, path, Config=self.transfer_config())
+
+    def open(self, name: str) -> BinaryIO:
+        return S3ObjectReader(self, name)
+
+    def delete_prefix(self, prefix: str) -> int:
+        deleted = 0
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            keys = [{'Key': item['Key']} for item in page.get('Contents', [])]
+            if keys:
+                self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': keys, 'Quiet': True})
+                deleted += len(keys)
+        return deleted
+
+    def presigned_url(self, name: str) -> str:
+        return self.client.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': name},
+            ExpiresIn=settings.STORAGE_PRESIGN_EXPIRES)
+
+    def presigned_upload(self, name: str, size: int, sha256: str, content_type: str) -> dict:
+        """
+        Presigned PUT, storage refuse body with other size or sha256
+        """
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        url = self.client.generate_presigned_url('put_object', Params={
+            'Bucket': self.bucket, 'Key': name, 'ContentLength': size, 'ContentType': content_type,
+            'ChecksumSHA256': checksum,
+        }, ExpiresIn=settings.STORAGE_PRESIGN_EXPIRES)
+        return {'url': url, 'method': 'PUT', 'headers': {
+            'Content-Length': str(size), 'Content-Type': content_type, 'x-amz-checksum-sha256': checksum,
+        }}
+
+
+def create_storage(backend: str) -> Storage:
+    if backend == 'memory':
+        return MemoryStorage()
+    if backend == 's3':
+        return S3Storage(settings.STORAGE_BUCKET, settings.STORAGE_ENDPOINT_URL, settings.STORAGE_REGION,
+            settings.STORAGE_ACCESS_KEY, settings.STORAGE_SECRET_KEY)
+    return LocalStorage(settings.BLOB_DIRECTORY)
+
+backend = create_storage(settings.STORAGE_BACKEND)
@@ -0,0 +1,114 @@
+import zlib
+from typing import AsyncIterable, Optional
+
+from fastapi import HTTPException, status
+
+from . import compression, models, pagination, utils
+from .config import settings
+from .custom import CustomStreamingResponse
+
+"""
+##### Streaming Book Listings #####
+
+Books are pulled from a server side cursor in batches of STREAM_BATCH_SIZE
+and serialized batch by batch, so memory stay flat and first byte go out
+before the whole listing is fetched. Summary is written after rows since
+next cursor is known only once last row is streamed.
+
+Exports stream whole result (NDJSON, CSV or XML) ordered by id, gzip
+compressed on the fly when client accept it.
+
+"""
+
+class BookStream:
+    """
+    Async iterable of row dict batches of book query, remember last streamed
+    book and if query had more than limit books
+    """
+    def __init__(self, db, query, limit: Optional[int] = None, exclude=[]):
+        self.db = db
+        self.query = query
+        self.limit = limit
+        self.exclude = exclude
+        self.last = None
+        self.has_more = False
+
+    async def __aiter__(self):
+        batch_size = settings.STREAM_BATCH_SIZE
+        result = await self.db.stream(self.query.execution_options(yield_per=batch_size))
+        streamed = 0
+
+        try:
+            async for books in result.scalars().partitions(batch_size):
+                # Rows past limit only tell next page exist
+                if self.limit is not None and streamed + len(books) > self.limit:
+                    books = books[:self.limit - streamed]
+                    self.has_more = True
+
+                if books:
+                    streamed += len(books)
+                    self.last = books[-1]
+                    yield utils.multiple_model_to_dict(models=books, exclude=self.exclude)
+
+                if self.has_more:
+                    break
+        finally:
+            await result.close()
+
+
+def stream_books(db, query, per_page: int, page: Optional[int], cursor: Optional[str], total: Optional[int],
+    media_type: Optional[str]):
+    """
+    Streaming response of a book listing page with same document as non streamed listing
+    """
+    # Keyset pagination (without page) ordered by creation
+    if page is None:
+        books = BookStream(db, pagination.keyset_query(query, per_page, cursor), limit=per_page, exclude=['user_id'])
+
+        def tail():
+            next_cursor = pagination.encode_cursor(books.last) if books.has_more else None
+            return dict(summary=pagination.cursor_summary(per_page, cursor, next_cursor, total))
+
+    else:
+        query = query.order_by(models.Book.created_at, models.Book.id).limit(per_page).offset((page - 1) * per_page)
+        books = BookStream(db, query, exclude=['user_id'])
+
+        def tail():
+            return dict(summary=pagination.page_summary(page, per_page, total))
+
+    return CustomStreamingResponse('rows', books, tail, media_type=media_type, custom_root='books')
+
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'xml': 'application/xml',
+}
+
+async def gzip_stream(chunks: AsyncIterable[bytes], level: int = 6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31) # 31 gzip container
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def export_books(db, query, format: str, accept_encoding: Optional[str], filename: str = 'books'):
+    """
+    Streaming download of every book of query
+    """
+    media_type = EXPORT_FORMATS.get(format)
+    if media_type is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+
+    books = BookStream(db, query.order_by(models.Book.id), exclude=['user_id'])
+    response = CustomStreamingResponse('rows', books, dict, media_type=media_type, custom_root='books',
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{format}"', 'Vary': 'Accept-Encoding'})
+
+    # Compress on the fly
+    if compression.negotiate_encoding(accept_encoding, ('gzip',)) == 'gzip':
+        response.body_iterator = gzip_stream(response.body_iterator)
+        response.headers['Content-Encoding'] = 'gzip'
+
+    return response
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete
+
+from . import blobs, compression, images, jobs, models, revocation
+from .config import settings
+from .database import Session
+
+"""
+##### Jobs #####
+
+Handlers of job queue and queue of app process
+
+: precompress (key) compressed variants of uploaded blob
+: image_variants (key) resized WebP variants of uploaded image blob
+: cleanup, blob gc, removal of old finished jobs and expired revoked tokens, schedule itself every JOB_CLEANUP_INTERVAL
+
+"""
+
+queue = jobs.JobQueue(Session, settings.JOB_WORKERS)
+
+
+@jobs.handler('precompress')
+def precompress(key: str):
+    compression.precompress(blobs.object_name(key))
+
+@jobs.handler('image_variants')
+async def image_variants(key: str):
+    await images.processor.variants(blobs.object_name(key))
+
+@jobs.handler('cleanup')
+def cleanup():
+    with Session() as db:
+        blobs.collect(db)
+        revocation.delete_expired(db)
+
+        cutoff = datetime.now() - timedelta(seconds=settings.JOB_RETENTION)
+        db.execute(delete(models.Job).where(models.Job.status.in_([jobs.DONE, jobs.FAILED]), models.Job.finished_at < cutoff)
+            .execution_options(synchronize_session=False))
+        # Next run, nothing when another cleanup is queued already (second worker, retry)
+        jobs.schedule(db, 'cleanup', delay=settings.JOB_CLEANUP_INTERVAL)
+
+
+def start():
+    if settings.JOB_WORKERS:
+        with Session() as db:
+            jobs.schedule(db, 'cleanup')
+        queue.start()
+
+async def stop():
+    await queue.stop()
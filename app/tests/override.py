@@ -1,14 +1,26 @@
+import os
+import tempfile
+
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
-from ..database import get_db
-from ..oauth2 import require_user
+from .. import storage
+from ..config import settings
+from ..database import get_db, get_async_db, ThreadpoolSession
+from ..oauth2 import get_token_subject
 from ..models import Base
 from ..main import app
 
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./data.db"
+# Database and uploads of tests live in temp directory, not in working tree
+TEST_DIRECTORY = tempfile.mkdtemp(prefix='bookstore-tests-')
+settings.BLOB_DIRECTORY = os.path.join(TEST_DIRECTORY, 'blobs')
+storage.backend = storage.LocalStorage(settings.BLOB_DIRECTORY)
+
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{TEST_DIRECTORY}/data.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
@@ -16,6 +28,10 @@ engine = create_engine(
 
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(f"sqlite+aiosqlite:///{TEST_DIRECTORY}/data.db", poolclass=NullPool)
+
+TestingAsyncSessionLocal = sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base.metadata.drop_all(bind=engine)
 Base.metadata.create_all(bind=engine)
 
@@ -24,10 +40,22 @@ def override_get_db():
     with TestingSessionLocal() as db:
         yield db
 
-def override_require_user():
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+async def override_get_threadpool_db():
+    db = ThreadpoolSession(TestingSessionLocal(expire_on_commit=False))
+    try:
+        yield db
+    finally:
+        await db.close()
+
+def override_get_token_subject():
     return 1
 
 app.dependency_overrides[get_db] = override_get_db
-app.dependency_overrides[require_user] = override_require_user
+app.dependency_overrides[get_async_db] = override_get_async_db
+app.dependency_overrides[get_token_subject] = override_get_token_subject
 
 client = TestClient(app)
\ No newline at end of file
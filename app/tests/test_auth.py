@@ -1,4 +1,22 @@
-from .override import client
+import asyncio
+import base64
+import hashlib
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from fastapi import HTTPException
+import jwt
+from passlib.hash import bcrypt
+import pytest
+from starlette.requests import Request
+from .override import client, TestingAsyncSessionLocal, TestingSessionLocal
+from .. import oauth2, revocation
+from ..main import app
+from ..hashing import hasher
+from ..models import RevokedToken, User
+from ..utils import pwd_context
 import xmltodict
 
 register_user_url = "/api/auth/register"
@@ -84,6 +102,173 @@ def test_login_xml_user():
     assert "refresh_token" in cookies
     assert cookies['logged_in'] == 'True'
 
+def test_login_rehash_outdated_password():
+    with TestingSessionLocal() as db:
+        user = db.query(User).filter(User.email == login_json_data['email']).first()
+        user.password = bcrypt.using(rounds=4).hash(login_json_data['password'])
+        db.commit()
+
+    response = client.post(login_user_url, json=login_json_data)
+    assert response.status_code == 200
+
+    with TestingSessionLocal() as db:
+        user = db.query(User).filter(User.email == login_json_data['email']).first()
+        assert not pwd_context.needs_update(user.password)
+        assert pwd_context.verify(login_json_data['password'], user.password)
+
+def test_login_hasher_saturated():
+    max_pending = hasher.max_pending
+    hasher.max_pending = 0
+    try:
+        response = client.post(login_user_url, json=login_json_data)
+    finally:
+        hasher.max_pending = max_pending
+
+    assert response.status_code == 429
+
+def test_login_after_hasher_worker_died():
+    # Worker exit break whole pool
+    with pytest.raises(BrokenProcessPool):
+        hasher.get_executor().submit(os._exit, 1).result()
+
+    response = client.post(login_user_url, json=login_json_data)
+    assert response.status_code == 200
+
+def token_subject(token):
+    # Token subject is overridden for routes in tests, verify token directly
+    request = Request({'type': 'http', 'headers': [(b'authorization', f'Bearer {token}'.encode())]})
+    return oauth2.get_token_subject(request, oauth2.AuthJWT(req=request))
+
+def test_verified_token_cached():
+    token = client.post(login_user_url, json=login_json_data).json()['access_token']
+    oauth2.verified_tokens.clear()
+    hits = oauth2.verify_requests.value(result='hit')
+    misses = oauth2.verify_requests.value(result='miss')
+
+    assert token_subject(token) == 1
+    assert token_subject(token) == 1
+
+    # Signature checked once, every other verification of same token hit
+    assert oauth2.verify_requests.value(result='miss') == misses + 1
+    assert oauth2.verify_requests.value(result='hit') > hits
+    assert len(oauth2.verified_tokens) == 1
+
+def test_tampered_token_refused():
+    token = client.post(login_user_url, json=login_json_data).json()['access_token']
+    token_subject(token)
+    header, payload, signature = token.split('.')
+
+    with pytest.raises(HTTPException) as e:
+        token_subject(f"{header}.{payload}.{signature[:-4]}AAAA")
+    assert e.value.status_code == 401
+
+def test_expired_token_not_cached(monkeypatch):
+    token = client.post(login_user_url, json=login_json_data).json()['access_token']
+    assert token_subject(token) == 1
+
+    # Cache entry expire with token
+    exp = jwt.decode(token, verify=False)['exp']
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + exp - time.time() + 1)
+    assert oauth2.verified_tokens.get((hashlib.sha256(token.encode()).digest(), None)) is None
+
+def test_eddsa_tokens(monkeypatch):
+    private_key = Ed25519PrivateKey.generate()
+    private_pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+
+    monkeypatch.setattr(oauth2.AuthJWT, '_algorithm', 'EdDSA')
+    monkeypatch.setattr(oauth2.AuthJWT, '_decode_algorithms', ['EdDSA'])
+    oauth2.load_keys(base64.b64encode(private_pem), base64.b64encode(public_pem))
+    try:
+        token = client.post(login_user_url, json=login_json_data).json()['access_token']
+        assert jwt.get_unverified_header(token)['alg'] == 'EdDSA'
+        assert token_subject(token) == 1
+    finally:
+        oauth2.load_keys()
+        monkeypatch.undo()
+
+    # Token signed with other keys is refused
+    with pytest.raises(HTTPException):
+        token_subject(token)
+    assert client.post(login_user_url, json=login_json_data).status_code == 200
+
+def test_bloom_filter():
+    bloom = revocation.BloomFilter(1000, 0.01)
+    for index in range(1000):
+        bloom.add(f'revoked-{index}')
+
+    assert all(f'revoked-{index}' in bloom for index in range(1000))
+    false_positives = sum(f'valid-{index}' in bloom for index in range(10000))
+    assert false_positives < 300
+
+def test_logout_revokes_tokens(monkeypatch):
+    # Real token check instead of test user
+    monkeypatch.delitem(app.dependency_overrides, oauth2.get_token_subject)
+    client.post(login_user_url, json=login_json_data)
+    access_token, refresh_token = client.cookies['access_token'], client.cookies['refresh_token']
+    assert client.get("/api/user/me").status_code == 200
+
+    assert client.get(logout_user_url).status_code == 200
+
+    response = client.get("/api/user/me", headers={'Authorization': f'Bearer {access_token}'})
+    assert response.status_code == 401
+    assert response.json()['detail'] == 'Token has been revoked'
+
+    response = client.get("/api/auth/refresh", cookies={'refresh_token': refresh_token})
+    assert response.status_code == 403
+    assert response.json()['detail'] == 'RevokedTokenError'
+
+    # New login is not affected
+    client.post(login_user_url, json=login_json_data)
+    assert client.get("/api/user/me").status_code == 200
+
+def test_revocation_seen_by_other_process():
+    other = revocation.Denylist(1000, 0.01)
+    token = client.post(login_user_url, json=login_json_data).json()['access_token']
+    claims = jwt.decode(token, verify=False)
+
+    async def check():
+        async with TestingAsyncSessionLocal() as db:
+            assert not await other.is_revoked(db, claims['jti'])
+            await revocation.denylist.revoke(db, claims['jti'], claims['exp'])
+
+            # Seen after sync interval
+            assert not await other.is_revoked(db, claims['jti'])
+            other.next_sync = 0
+            assert await other.is_revoked(db, claims['jti'])
+
+    asyncio.run(check())
+
+def test_revocation_checks_wait_for_first_load():
+    fresh = revocation.Denylist(1000, 0.01)
+    token = client.post(login_user_url, json=login_json_data).json()['access_token']
+    claims = jwt.decode(token, verify=False)
+
+    async def is_revoked():
+        async with TestingAsyncSessionLocal() as db:
+            return await fresh.is_revoked(db, claims['jti'])
+
+    async def check():
+        async with TestingAsyncSessionLocal() as db:
+            await revocation.denylist.revoke(db, claims['jti'], claims['exp'])
+
+        # Checks running along first load of process see revocations made before
+        assert await asyncio.gather(*[is_revoked() for _ in range(5)]) == [True] * 5
+
+    asyncio.run(check())
+
+def test_expired_revocations_deleted():
+    async def revoke():
+        async with TestingAsyncSessionLocal() as db:
+            await revocation.denylist.revoke(db, 'expired-jti', int(time.time()) - 60)
+            assert not await revocation.denylist.is_revoked(db, 'expired-jti')
+
+    asyncio.run(revoke())
+    with TestingSessionLocal() as db:
+        assert revocation.delete_expired(db) >= 1
+        assert db.get(RevokedToken, 'expired-jti') is None
+
 def test_logout_user():
     response = client.get(logout_user_url, headers=json_content_type)
 
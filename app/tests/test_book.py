@@ -1,4 +1,13 @@
-from .override import client
+import csv
+import io
+import json
+import time
+
+from .override import client, app, override_get_async_db, override_get_threadpool_db
+from .. import catalog
+from ..config import settings
+from ..database import get_async_db
+from ..oauth2 import get_token_subject
 import xmltodict
 
 books_url = "/api/store/books"
@@ -62,6 +71,35 @@ def test_get_all_books():
     assert data["summary"]["total"] == 2
     assert data["summary"]["total_pages"] == 2
 
+def test_listing_not_modified_expire_in_other_worker(monkeypatch):
+    # Worker with own in process version, never see writes of other workers
+    monkeypatch.setattr(settings, 'BOOK_LISTING_CACHE_TTL', 0.2)
+    monkeypatch.setattr(catalog, 'versions', catalog.version_cache())
+    headers = {'Content-Type': 'application/json'}
+    etag = client.get(books_url, params=pagination_params, headers=headers).headers['etag']
+
+    response = client.get(books_url, params=pagination_params, headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 304
+
+    time.sleep(0.3)
+    response = client.get(books_url, params=pagination_params, headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+
+def test_get_all_books_with_sync_session():
+    app.dependency_overrides[get_async_db] = override_get_threadpool_db
+    try:
+        response = client.get(books_url, params=pagination_params,
+            headers={'Content-Type': 'application/json'}
+        )
+    finally:
+        app.dependency_overrides[get_async_db] = override_get_async_db
+
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["rows"]) == 1
+    assert data["summary"]["total"] == 2
+
 def test_get_all_xml_books():
     response = client.get(books_url, params=pagination_params,
         headers={'Content-Type': 'application/xml'}
@@ -74,6 +112,17 @@ def test_get_all_xml_books():
     assert int(data["summary"]["total"]['#text']) == 2
     assert int(data["summary"]["total_pages"]['#text']) == 2
 
+def test_get_all_books_without_count():
+    response = client.get(books_url, params={**pagination_params, 'count': False},
+        headers={'Content-Type': 'application/json'}
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["rows"]) == 1
+    assert "total" not in data["summary"]
+    assert "total_pages" not in data["summary"]
+
 def test_search_all_books():
     search_param = {"search": "description"}
     response = client.get(books_url, params={**search_param, **pagination_params},
@@ -88,6 +137,60 @@ def test_search_all_books():
     assert data["summary"]["total"] == 2
     assert data["summary"]["total_pages"] == 2
 
+def test_search_prefix_books():
+    response = client.get(books_url, params={"search": "descr xml", **pagination_params},
+        headers={'Content-Type': 'application/json'}
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["rows"]) == 1
+    assert data["rows"][0]["title"] == "This is xml book"
+    assert data["summary"]["total"] == 1
+
+def test_search_no_match_books():
+    response = client.get(books_url, params={"search": "nothing", **pagination_params},
+        headers={'Content-Type': 'application/json'}
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["rows"]) == 0
+    assert data["summary"]["total"] == 0
+
+def test_get_all_books_with_cursor():
+    response = client.get(books_url, params={'per_page': 1},
+        headers={'Content-Type': 'application/json'}
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["rows"]) == 1
+    assert data["rows"][0]["title"] == "This is my book"
+    assert data["summary"]["next_cursor"]
+
+    response = client.get(books_url, params={'per_page': 1, 'cursor': data["summary"]["next_cursor"]},
+        headers={'Content-Type': 'application/json'}
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["rows"]) == 1
+    assert data["rows"][0]["title"] == "This is xml book"
+    assert data["summary"]["next_cursor"] is None
+
+def test_get_all_books_invalid_page():
+    for params in [{'per_page': 0}, {'per_page': -1}, {'per_page': 1, 'page': 0}]:
+        assert client.get(books_url, params=params).status_code == 422
+    assert client.get(f"{books_url}/user", params={'per_page': -1}).status_code == 422
+
+def test_get_all_books_invalid_cursor():
+    response = client.get(books_url, params={'per_page': 1, 'cursor': 'invalid'},
+        headers={'Content-Type': 'application/json'}
+    )
+
+    assert response.status_code == 400
+
 def test_get_all_books_of_user():
     response = client.get(f"{books_url}/user", params=pagination_params,
         headers={'Content-Type': 'application/json'}
@@ -99,6 +202,95 @@ def test_get_all_books_of_user():
     assert data["summary"]["total"] == 2
     assert data["summary"]["total_pages"] == 2
 
+def test_get_all_books_of_user_with_cursor():
+    response = client.get(f"{books_url}/user", params={'per_page': 2},
+        headers={'Content-Type': 'application/json'}
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["rows"]) == 2
+    assert data["summary"]["next_cursor"] is None
+
+def test_stream_all_books():
+    for params in [pagination_params, {'per_page': 1}, {'per_page': 5}]:
+        response = client.get(books_url, params=params, headers={'Content-Type': 'application/json'})
+        streamed = client.get(books_url, params={**params, 'stream': True},
+            headers={'Content-Type': 'application/json'}
+        )
+
+        assert streamed.status_code == 200
+        assert streamed.json() == response.json()
+
+def test_stream_all_xml_books():
+    for params in [pagination_params, {'per_page': 1}]:
+        response = client.get(books_url, params=params, headers={'Content-Type': 'application/xml'})
+        streamed = client.get(books_url, params={**params, 'stream': True},
+            headers={'Content-Type': 'application/xml'}
+        )
+
+        assert streamed.status_code == 200
+        assert streamed.content == response.content
+
+def test_stream_all_books_of_user_with_sync_session():
+    response = client.get(f"{books_url}/user", params={'per_page': 1}, headers={'Content-Type': 'application/json'})
+
+    app.dependency_overrides[get_async_db] = override_get_threadpool_db
+    try:
+        streamed = client.get(f"{books_url}/user", params={'per_page': 1, 'stream': True},
+            headers={'Content-Type': 'application/json'}
+        )
+    finally:
+        app.dependency_overrides[get_async_db] = override_get_async_db
+
+    assert streamed.status_code == 200
+    assert streamed.json() == response.json()
+    assert streamed.json()["summary"]["next_cursor"]
+
+def test_export_ndjson_books():
+    response = client.get(f"{books_url}/export", headers={'Accept-Encoding': 'gzip'})
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    assert response.headers['content-encoding'] == 'gzip'
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["title"] for row in rows] == ["This is my book", "This is xml book"]
+
+def test_export_csv_books_of_user():
+    response = client.get(f"{books_url}/export", params={'format': 'csv', 'mine': True},
+        headers={'Accept-Encoding': 'identity'}
+    )
+
+    assert response.status_code == 200
+    assert 'content-encoding' not in response.headers
+    assert response.headers['content-disposition'] == 'attachment; filename="books.csv"'
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 2
+    assert rows[0]["price"] == "1001.2"
+
+def test_export_xml_books_search():
+    response = client.get(f"{books_url}/export", params={'format': 'xml', 'search': 'xml'})
+
+    assert response.status_code == 200
+    data = xmltodict.parse(response.content)
+    assert data['books']['rows']['item']['title']['#text'] == "This is xml book"
+
+def test_export_gzip_refused():
+    response = client.get(f"{books_url}/export", headers={'Accept-Encoding': 'gzip;q=0, identity'})
+
+    assert response.status_code == 200
+    assert 'content-encoding' not in response.headers
+
+def test_export_requires_login(monkeypatch):
+    # Real token check instead of test user
+    monkeypatch.delitem(app.dependency_overrides, get_token_subject)
+    response = client.get(f"{books_url}/export", params={'format': 'csv'})
+    assert response.status_code == 401
+
+def test_export_invalid_format():
+    response = client.get(f"{books_url}/export", params={'format': 'pdf'})
+    assert response.status_code == 400
+
 def test_get_single_book():
     response = client.get(f"{books_url}/{1}", headers={'Content-Type': 'application/json'})
 
@@ -120,9 +312,12 @@ def test_update_book():
     response = client.put(f"{books_url}/{1}", json=update_json_data,
     )
 
-    assert response.status_code == 205
+    assert response.status_code == 200
     data = response.json()
-    assert data['detail'] == 'book updated successfully'
+    assert data['title'] == 'This is updated book'
+    assert data['description'] == 'This is my book description'
+    assert data['updated_at'] != data['created_at']
+    assert 'user_id' not in data
 
     response = client.get(
         f"/api/store/books/{1}",
@@ -141,10 +336,11 @@ def test_update_xml_book():
         headers={'Content-Type': 'application/xml'}
     )
 
-    assert response.status_code == 205
+    assert response.status_code == 200
     data = xmltodict.parse(response.content)
     data = data['book']
-    assert data['detail']['#text'] == 'book updated successfully'
+    assert data['title']['#text'] == 'This is xml updated book'
+    assert data['description']['#text'] == 'This is xml book description'
 
     response = client.get(f"{books_url}/{2}", headers={'Content-Type': 'application/xml'})
 
@@ -154,6 +350,48 @@ def test_update_xml_book():
     assert data['title']['#text'] == 'This is xml updated book'
     assert float(data['price']['#text']) == 1012.20
 
+def test_get_single_book_not_modified():
+    response = client.get(f"{books_url}/{1}", headers={'Content-Type': 'application/json'})
+    etag = response.headers['etag']
+    assert etag == f'"1-{response.json()["version"]}"'
+
+    response = client.get(f"{books_url}/{1}", headers={'Content-Type': 'application/json', 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['etag'] == etag
+
+def test_update_book_if_match():
+    etag = client.get(f"{books_url}/{1}", headers={'Content-Type': 'application/json'}).headers['etag']
+    stale = '"1-1"'
+    assert etag != stale
+
+    response = client.put(f"{books_url}/{1}", json={'price': 10}, headers={'If-Match': stale})
+    assert response.status_code == 412
+
+    response = client.put(f"{books_url}/{1}", json={'price': 10}, headers={'If-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+    assert response.json()['price'] == '10.0'
+
+    # Weak tags never match If-Match
+    response = client.put(f"{books_url}/{1}", json={'price': 11}, headers={'If-Match': f"W/{response.headers['etag']}"})
+    assert response.status_code == 412
+
+def test_delete_book_if_match():
+    response = client.delete(f"{books_url}/{1}", headers={'Content-Type': 'application/json', 'If-Match': '"1-1"'})
+    assert response.status_code == 412
+
+def test_update_missing_book():
+    response = client.put(f"{books_url}/{99999}", json=update_json_data)
+    assert response.status_code == 404
+
+def test_update_book_null_field():
+    response = client.put(f"{books_url}/{1}", json={'price': None})
+    assert response.status_code == 422
+
+def test_delete_missing_book():
+    response = client.delete(f"{books_url}/{99999}", headers={"Content-Type": "application/json"})
+    assert response.status_code == 404
+
 def test_delete_book():
     response = client.delete(f"{books_url}/{1}", headers={"Content-Type": "application/json"})
 
@@ -167,3 +405,111 @@ def test_delete_xml_book():
     assert response.status_code == 204
     data = xmltodict.parse(response.content)
     assert data['book']['detail']['#text'] == "book deleted successfully"   
+
+def test_count_invalidated_after_delete():
+    response = client.get(books_url, params=pagination_params,
+        headers={'Content-Type': 'application/json'}
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["rows"]) == 0
+    assert data["summary"]["total"] == 0
+
+bulk_ids = []
+
+def test_bulk_create_books():
+    books = [create_json_data, {"title": "Missing price", "description": "No price"}, {**create_json_data, "title": "Bulk book"}]
+    response = client.post(f"{books_url}/bulk", json=books)
+
+    assert response.status_code == 207
+    data = response.json()
+    assert [row["status"] for row in data["rows"]] == ["created", "invalid", "created"]
+    assert data["rows"][1]["errors"] == [{"field": "price", "message": "field required"}]
+    assert data["summary"] == {"total": 3, "created": 2, "failed": 1}
+    bulk_ids.extend(row["id"] for row in data["rows"] if row["status"] == "created")
+
+    response = client.get(books_url, params=pagination_params, headers={'Content-Type': 'application/json'})
+    assert response.json()["summary"]["total"] == 2
+
+def test_bulk_create_xml_books():
+    response = client.post(f"{books_url}/bulk", data=f"<books>{create_xml_data}{create_xml_data}</books>",
+        headers={'Content-Type': 'application/xml'}
+    )
+
+    assert response.status_code == 201
+    data = xmltodict.parse(response.content)
+    rows = data['books']['rows']['item']
+    assert [row['status']['#text'] for row in rows] == ["created", "created"]
+    bulk_ids.extend(int(row['id']['#text']) for row in rows)
+
+def test_bulk_update_books():
+    books = [{"id": bulk_ids[0], "title": "Bulk updated"}, {"id": bulk_ids[1], "price": 5}, {"id": 99999, "price": 5}]
+    response = client.put(f"{books_url}/bulk", json=books)
+
+    assert response.status_code == 207
+    data = response.json()
+    assert [row["status"] for row in data["rows"]] == ["updated", "updated", "not_found"]
+
+    response = client.get(f"{books_url}/{bulk_ids[0]}", headers={'Content-Type': 'application/json'})
+    data = response.json()
+    assert data["title"] == "Bulk updated"
+    assert data["price"] == "1001.2"
+    assert data["updated_at"] != data["created_at"]
+
+def test_bulk_update_null_field():
+    books = [{"id": bulk_ids[0], "title": None}, {"id": bulk_ids[1], "price": 6}]
+    response = client.put(f"{books_url}/bulk", json=books)
+
+    assert response.status_code == 207
+    data = response.json()
+    assert [row["status"] for row in data["rows"]] == ["invalid", "updated"]
+    assert data["rows"][0]["errors"][0]["field"] == "title"
+
+def test_bulk_delete_books():
+    response = client.delete(f"{books_url}/bulk", json=bulk_ids + [99999])
+
+    assert response.status_code == 207
+    data = response.json()
+    assert [row["status"] for row in data["rows"]] == ["deleted"] * len(bulk_ids) + ["not_found"]
+    assert data["summary"] == {"total": 5, "deleted": 4, "failed": 1}
+
+    response = client.get(books_url, params=pagination_params, headers={'Content-Type': 'application/json'})
+    assert response.json()["summary"]["total"] == 0
+
+def test_bulk_delete_missing_books_keep_catalog():
+    version = catalog.version()
+    response = client.delete(f"{books_url}/bulk", json=[99998, 99999])
+
+    assert response.status_code == 207
+    assert catalog.version() == version
+
+def test_bulk_too_many_books():
+    response = client.delete(f"{books_url}/bulk", json=list(range(settings.BOOK_BULK_MAX_ITEMS + 1)))
+    assert response.status_code == 413
+
+def test_listing_not_modified_and_cached():
+    headers = {'Content-Type': 'application/json'}
+    response = client.get(books_url, params=pagination_params, headers=headers)
+
+    assert response.status_code == 200
+    etag = response.headers['etag']
+    assert response.headers['cache-control'] == 'public, max-age=0'
+
+    # Same listing is served from server cache
+    hits = catalog.listing_requests.value(result='hit')
+    cached = client.get(books_url, params=pagination_params, headers=headers)
+    assert cached.content == response.content
+    assert cached.headers['etag'] == etag
+    assert catalog.listing_requests.value(result='hit') == hits + 1
+
+    response = client.get(books_url, params=pagination_params, headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.content == b''
+
+    # Book write change catalog version
+    client.post(books_url, json=create_json_data)
+    response = client.get(books_url, params=pagination_params, headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+    assert response.json()["summary"]["total"] == 1
@@ -0,0 +1,78 @@
+import gzip
+
+from .override import client
+from .. import compression, storage
+
+books_url = "/api/store/books"
+params = { 'page': 1, 'per_page': 20 }
+
+
+def test_negotiate_encoding():
+    assert compression.negotiate_encoding("gzip, deflate", None) == "gzip"
+    assert compression.negotiate_encoding("deflate", None) is None
+    assert compression.negotiate_encoding("gzip;q=0, *;q=0.5", ('gzip',)) is None
+    assert compression.negotiate_encoding("*", ('gzip',)) == "gzip"
+    assert compression.negotiate_encoding("identity", None) is None
+    assert compression.negotiate_encoding(None, None) is None
+    assert compression.negotiate_encoding("gzip;q=0.5, br", ('gzip',)) == "gzip"
+
+def test_compress_listing():
+    books = [{'title': 'Compressed book', 'description': 'Same words again and again ' * 5, 'price': 10}] * 10
+    assert client.post(f"{books_url}/bulk", json=books).status_code == 201
+
+    response = client.get(books_url, params=params, headers={'Accept-Encoding': 'gzip'})
+
+    assert response.status_code == 200
+    assert response.headers['content-encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['vary']
+    assert int(response.headers['content-length']) < len(response.content)
+    assert 'summary' in response.text
+
+def test_compressed_listing_etag():
+    plain = client.get(books_url, params=params, headers={'Accept-Encoding': 'identity'})
+    compressed = client.get(books_url, params=params, headers={'Accept-Encoding': 'gzip'})
+
+    assert compressed.headers['content-encoding'] == 'gzip'
+    assert compressed.headers['etag'] != plain.headers['etag']
+    assert compressed.headers['etag'] == compression.encoded_etag(plain.headers['etag'], 'gzip')
+
+    # Both validators are current
+    response = client.get(books_url, params=params, headers={'Accept-Encoding': 'gzip', 'If-None-Match': compressed.headers['etag']})
+    assert response.status_code == 304
+    assert response.headers['etag'] == compressed.headers['etag']
+    response = client.get(books_url, params=params, headers={'Accept-Encoding': 'identity', 'If-None-Match': plain.headers['etag']})
+    assert response.status_code == 304
+
+def test_compress_streamed_listing():
+    plain = client.get(books_url, params={**params, 'stream': True}, headers={'Accept-Encoding': 'identity'})
+    compressed = client.get(books_url, params={**params, 'stream': True}, headers={'Accept-Encoding': 'gzip'})
+
+    assert 'content-encoding' not in plain.headers
+    assert compressed.headers['content-encoding'] == 'gzip'
+    assert compressed.content == plain.content
+
+def test_small_response_not_compressed():
+    response = client.get("/", headers={'Accept-Encoding': 'gzip'})
+    assert 'content-encoding' not in response.headers
+
+def test_precompressed_variant():
+    backend = storage.MemoryStorage()
+    name = "ab/cd/cover.svg"
+    contents = b'<svg xmlns="http://www.w3.org/2000/svg">' + b'<rect width="1" height="1"/>' * 500 + b'</svg>'
+    backend.put_bytes(name, contents)
+
+    compression.precompress(name, backend=backend)
+
+    variant, encoding = compression.precompressed_variant(name, 'gzip', backend.exists)
+    assert (variant, encoding) == (f'{name}.gz', 'gzip')
+    assert gzip.decompress(backend.read(variant)) == contents
+
+    assert compression.precompressed_variant(name, 'identity', backend.exists) == (name, None)
+
+def test_jpeg_not_precompressed():
+    backend = storage.MemoryStorage()
+    with open("test_file.jpeg", 'rb') as f:
+        backend.put_bytes("ab/cd/cover.jpeg", f.read())
+
+    compression.precompress("ab/cd/cover.jpeg", backend=backend)
+    assert compression.precompressed_variant("ab/cd/cover.jpeg", 'gzip, br, zstd', backend.exists) == ("ab/cd/cover.jpeg", None)
@@ -0,0 +1,82 @@
+import msgpack
+
+from .override import client
+from .. import schema, xmlparser
+from ..config import settings
+from ..custom import negotiate
+
+books_url = "/api/store/books"
+pagination_params = { 'page': 1, 'per_page': 1 }
+
+
+def test_negotiate_accept():
+    assert negotiate("application/json", None) == "application/json"
+    assert negotiate("application/xml;q=0.5, application/json;q=0.9", None) == "application/json"
+    assert negotiate("text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8", "application/json") == "application/xml"
+    assert negotiate("application/x-msgpack", None) == "application/msgpack"
+    assert negotiate("text/html", None) is None
+
+def test_negotiate_prefer_request_content_type():
+    assert negotiate(None, None) == "application/xml"
+    assert negotiate("*/*", "application/json") == "application/json"
+    assert negotiate("application/*", "application/json; charset=utf-8") == "application/json"
+    assert negotiate("application/json, application/xml", "application/xml") == "application/xml"
+    assert negotiate("*/*", "text/plain") == "application/xml"
+
+def test_accept_json_response_of_xml_request():
+    response = client.get(books_url, params=pagination_params,
+        headers={'Content-Type': 'application/xml', 'Accept': 'application/json'}
+    )
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/json'
+    assert 'summary' in response.json()
+    assert response.headers['vary'] == 'Accept, Content-Type'
+
+def test_accept_msgpack_response():
+    response = client.get(books_url, params=pagination_params, headers={'Accept': 'application/msgpack'})
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/msgpack'
+    assert msgpack.unpackb(response.content)['summary']['page'] == 1
+
+def test_not_acceptable():
+    response = client.get(books_url, params=pagination_params, headers={'Accept': 'text/html'})
+    assert response.status_code == 406
+
+def parse_xml(data: bytes, chunk: int = 7):
+    parser = xmlparser.XMLParser(max_bytes=1024, max_depth=4)
+    for start in range(0, len(data), chunk):
+        parser.feed(data[start:start + chunk])
+    return parser.close()
+
+def test_xml_parser_coerce_schema_types():
+    content = parse_xml(b"<book><title>A &amp; B</title><description/><price>10.5</price></book>")
+    assert content == {"title": "A & B", "description": None, "price": "10.5"}
+    assert xmlparser.coerce(content, schema.CreateBookSchema)["price"] == 10.5
+
+def test_xml_parser_single_item_list():
+    content = parse_xml(b"<books><book><title>a</title></book></books>")
+    assert xmlparser.coerce(content, schema.BulkBookSchema) == [{"title": "a"}]
+
+    content = parse_xml(b"<books><id>1</id><id>2</id></books>")
+    assert xmlparser.coerce(content, schema.BulkDeleteBookSchema) == [1, 2]
+
+def test_xml_entity_declaration_rejected():
+    data = """<?xml version="1.0"?><!DOCTYPE lolz [<!ENTITY lol "lol"><!ENTITY lol2 "&lol;&lol;">]>
+        <book><title>&lol2;</title><description>d</description><price>1</price></book>"""
+    response = client.post(books_url, data=data, headers={'Content-Type': 'application/xml'})
+
+    assert response.status_code == 400
+    assert 'DOCTYPE' in response.json()['detail']
+
+def test_xml_depth_limit():
+    data = "<book>" + "<a>" * settings.XML_MAX_DEPTH + "</a>" * settings.XML_MAX_DEPTH + "</book>"
+    response = client.post(books_url, data=data, headers={'Content-Type': 'application/xml'})
+    assert response.status_code == 400
+
+def test_xml_size_limit(monkeypatch):
+    monkeypatch.setattr(settings, 'XML_MAX_BYTES', 64)
+    data = "<book><title>" + "a" * 100 + "</title><description>d</description><price>1</price></book>"
+    response = client.post(books_url, data=data, headers={'Content-Type': 'application/xml'})
+    assert response.status_code == 413
@@ -0,0 +1,23 @@
+import pytest
+from sqlalchemy import create_engine, exc
+
+from ..database import TelemetryQueuePool, pool_overflow_total, pool_timeout_total, pool_checkout_seconds
+
+
+def test_pool_telemetry():
+    engine = create_engine("sqlite://", poolclass=TelemetryQueuePool, pool_size=1, max_overflow=1, pool_timeout=0.01)
+    overflow = pool_overflow_total.value(pool='sync')
+    timeout = pool_timeout_total.value(pool='sync')
+    checkouts = pool_checkout_seconds.count(pool='sync')
+
+    first = engine.connect()
+    second = engine.connect()
+    assert pool_overflow_total.value(pool='sync') == overflow + 1
+    assert pool_checkout_seconds.count(pool='sync') == checkouts + 2
+
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    assert pool_timeout_total.value(pool='sync') == timeout + 1
+
+    second.close()
+    first.close()
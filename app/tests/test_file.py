@@ -1,5 +1,11 @@
+import hashlib
+import io
 import os
-from .override import client
+from .override import client, TestingSessionLocal
+import asyncio
+import pytest
+from .. import blobs, fileserve, images, jobs, models
+from ..config import settings
 import xmltodict
 
 path = os.path.abspath(os.path.join("test_file.jpeg"))
@@ -18,6 +24,7 @@ def test_upload_image():
     data = response.json()
     assert data["status"] == "success"
     assert "url" in data
+    assert data["sha256"] == hashlib.sha256(file[1]).hexdigest()
 
     global get_file_url
     get_file_url = data['url']
@@ -33,17 +40,160 @@ def test_upload_image_xml():
     data = xmltodict.parse(response.content)
     data = data["file"]
     assert data["status"]["#text"] == "success"
-    assert "url" in data
+    # Same content, same blob
+    assert data["url"]["#text"] == get_file_url
 
 def test_get_file():
     response = client.get(
         get_file_url,
     )
 
-    response.status_code == 200
+    assert response.status_code == 200
     data = response.content
 
     with open(path, "rb") as f:
         assert f.read() == data
 
+    assert response.headers['cache-control'] == 'public, max-age=31536000, immutable'
+    assert response.headers['etag'] == f'"{hashlib.sha256(file[1]).hexdigest()}"'
+
+
+
+def test_get_file_range():
+    content = file[1]
+
+    response = client.get(get_file_url, headers={'Range': 'bytes=0-99'})
+    assert response.status_code == 206
+    assert response.headers['content-range'] == f'bytes 0-99/{len(content)}'
+    assert response.content == content[:100]
+
+    response = client.get(get_file_url, headers={'Range': 'bytes=-10'})
+    assert response.status_code == 206
+    assert response.content == content[-10:]
+
+    response = client.get(get_file_url, headers={'Range': f'bytes={len(content)}-'})
+    assert response.status_code == 416
+    assert response.headers['content-range'] == f'bytes */{len(content)}'
+
+def test_get_file_multiple_ranges():
+    content = file[1]
+    response = client.get(get_file_url, headers={'Range': 'bytes=0-9,100-109'})
+
+    assert response.status_code == 206
+    content_type = response.headers['content-type']
+    assert content_type.startswith('multipart/byteranges; boundary=')
+    boundary = content_type.split('boundary=')[1]
+    assert int(response.headers['content-length']) == len(response.content)
+
+    parts = response.content.split(f'--{boundary}'.encode())
+    assert parts[1].endswith(b'\r\n\r\n' + content[:10] + b'\r\n')
+    assert b'Content-Range: bytes 100-109/' in parts[2]
+    assert parts[2].endswith(content[100:110] + b'\r\n')
+    assert parts[3] == b'--\r\n'
+
+def test_get_file_not_modified():
+    response = client.get(get_file_url)
+    etag, last_modified = response.headers['etag'], response.headers['last-modified']
+
+    assert client.get(get_file_url, headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(get_file_url, headers={'If-Modified-Since': last_modified}).status_code == 304
+
+    # Old validator in If-Range get whole file
+    response = client.get(get_file_url, headers={'Range': 'bytes=0-9', 'If-Range': '"old"'})
+    assert response.status_code == 200
+    assert response.content == file[1]
+
+def test_parse_range():
+    assert fileserve.parse_range('bytes=0-4,3-9,20-', 100) == [(0, 9), (20, 99)]
+    assert fileserve.parse_range('bytes=-200', 100) == [(0, 99)]
+    assert fileserve.parse_range('bytes=200-300', 100) == []
+    assert fileserve.parse_range('bytes=5-1', 100) is None
+    assert fileserve.parse_range('items=0-1', 100) is None
+    assert fileserve.parse_range('bytes=' + ','.join(['0-1'] * 17), 100) is None
+
+def test_resolve_unsafe_path(tmp_path):
+    assert fileserve.resolve(str(tmp_path), 'cover.jpeg') == str(tmp_path / 'cover.jpeg')
+
+    os.symlink('/etc/passwd', tmp_path / 'link')
+    for name in ['..', '../data.db', 'a/b', '', 'link', 'a\0b']:
+        with pytest.raises(fileserve.UnsafePath):
+            fileserve.resolve(str(tmp_path), name)
+
+def test_zerocopy_send(tmp_path):
+    path = tmp_path / 'file'
+    path.write_bytes(b'0123456789')
+    response = fileserve.FileRangeResponse(str(path), 10, [(2, 4)], 'text/plain', status_code=206)
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'extensions': {fileserve.ZEROCOPY: {}}}
+    asyncio.run(response(scope, None, send))
+
+    assert messages[1]['type'] == fileserve.ZEROCOPY
+    assert (messages[1]['offset'], messages[1]['count']) == (2, 3)
+    assert messages[-1] == {'type': 'http.response.body', 'body': b''}
+
+def run_jobs():
+    queue = jobs.JobQueue(TestingSessionLocal)
+
+    async def drain():
+        while await queue.run_next():
+            pass
+    asyncio.run(drain())
+
+def test_get_file_variant():
+    Image = pytest.importorskip("PIL.Image")
+    run_jobs()
+
+    response = client.get(get_file_url, params={'size': 'thumb'})
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'image/webp'
+    assert 'immutable' in response.headers['cache-control']
+    assert len(response.content) < len(file[1]) / 10
+    with Image.open(io.BytesIO(response.content)) as image:
+        assert image.width == settings.IMAGE_SIZES['thumb']
+
+def test_variants_refuse_too_many_pixels(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    with Image.open(path) as image:
+        pixels = image.width * image.height
+
+    # Over limit but under twice of it, where Pillow only warn
+    with pytest.raises(Image.DecompressionBombError):
+        images.make_variants(path, str(tmp_path), settings.IMAGE_SIZES, settings.IMAGE_QUALITY, int(pixels / 1.5))
+    assert os.listdir(tmp_path) == []
+
+def test_get_file_unknown_variant():
+    response = client.get(get_file_url, params={'size': 'huge'})
+    assert response.status_code == 400
+
+def test_upload_too_large(monkeypatch):
+    monkeypatch.setattr(settings, 'FILE_MAX_SIZE', 1024)
+    monkeypatch.setattr(settings, 'FILE_CHUNK_SIZE', 256)
+    large = ("large.png", os.urandom(2048), "image/png")
+
+    response = client.post(upload_image_url, files={"file": large}, headers={"Accept": "application/json"})
+
+    assert response.status_code == 413
+    # Temp file is removed, nothing left behind
+    assert not any(name.endswith('.part') for name in os.listdir(settings.BLOB_DIRECTORY))
+
+def test_collect_unreferenced_blobs():
+    unused = ("unused.png", os.urandom(1024), "image/png")
+    unused_url = client.post(upload_image_url, files={"file": unused}, headers={"Accept": "application/json"}).json()['url']
+
+    # Cover image reference keep blob
+    book = {'title': 'Covered book', 'description': 'Book with cover', 'price': 10, 'cover_image': get_file_url}
+    assert client.post("/api/store/books", json=book).status_code == 201
+
+    with TestingSessionLocal() as db:
+        deleted, freed = blobs.collect(db, grace=0)
+        assert deleted >= 1 and freed >= 1024
+        assert db.get(models.Blob, blobs.key_of_url(get_file_url)).refcount >= 1
+        assert db.get(models.Blob, blobs.key_of_url(unused_url)) is None
 
+    assert client.get(get_file_url).status_code == 200
+    assert client.get(unused_url).status_code == 404
@@ -0,0 +1,112 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from .override import TestingSessionLocal
+from .. import jobs, models
+from ..config import settings
+
+queue = jobs.JobQueue(TestingSessionLocal)
+calls = []
+
+
+@jobs.handler('test_record')
+def record(value):
+    calls.append(value)
+
+@jobs.handler('test_scheduled')
+def scheduled():
+    calls.append('scheduled')
+
+@jobs.handler('test_fail')
+async def fail():
+    raise RuntimeError('always fail')
+
+
+def run_next():
+    return asyncio.run(queue.run_next())
+
+def get_job(id):
+    with TestingSessionLocal() as db:
+        return db.get(models.Job, id)
+
+def enqueue(name, **kwargs):
+    with TestingSessionLocal() as db:
+        job = jobs.enqueue(db, name, **kwargs)
+        db.commit()
+        return job.id
+
+def test_run_job():
+    # Jobs left by upload tests
+    while run_next():
+        pass
+
+    id = enqueue('test_record', value=1)
+
+    assert run_next()
+    assert calls == [1]
+    job = get_job(id)
+    assert (job.status, job.attempts) == (jobs.DONE, 1)
+    assert job.finished_at is not None
+    assert not run_next()
+
+def test_delayed_job_not_claimed():
+    id = enqueue('test_record', delay=60, value=2)
+
+    assert not run_next()
+    assert get_job(id).status == jobs.QUEUED
+
+def test_retry_then_fail():
+    id = enqueue('test_fail', max_attempts=2)
+
+    assert run_next()
+    job = get_job(id)
+    assert (job.status, job.attempts) == (jobs.QUEUED, 1)
+    assert 'always fail' in job.last_error
+    assert job.run_at >= datetime.now() + timedelta(seconds=settings.JOB_RETRY_DELAY - 1)
+
+    # Backoff over, second and last attempt
+    with TestingSessionLocal() as db:
+        db.execute(update(models.Job).where(models.Job.id == id).values(run_at=datetime.now()))
+        db.commit()
+    assert run_next()
+    job = get_job(id)
+    assert (job.status, job.attempts) == (jobs.FAILED, 2)
+
+def test_reclaim_after_visibility_timeout():
+    id = enqueue('test_record', value=3)
+    assert queue.claim().id == id
+
+    # Worker died holding job, nobody else get it until timeout
+    assert queue.claim() is None
+    with TestingSessionLocal() as db:
+        db.execute(update(models.Job).where(models.Job.id == id).values(locked_until=datetime.now() - timedelta(seconds=1)))
+        db.commit()
+
+    assert run_next()
+    job = get_job(id)
+    assert (job.status, job.attempts) == (jobs.DONE, 2)
+    assert calls[-1] == 3
+
+def queued(name):
+    with TestingSessionLocal() as db:
+        return db.query(models.Job).filter(models.Job.name == name, models.Job.status == jobs.QUEUED).count()
+
+def test_schedule_once():
+    # Workers starting together
+    with TestingSessionLocal() as db:
+        jobs.schedule(db, 'test_scheduled')
+        jobs.schedule(db, 'test_scheduled', delay=60)
+    assert queued('test_scheduled') == 1
+
+    # Scheduled job enqueueing its successor while another one is queued
+    job = queue.claim()
+    with TestingSessionLocal() as db:
+        jobs.schedule(db, 'test_scheduled')
+    assert queued('test_scheduled') == 1
+
+    # Its retry give way to queued one
+    queue.finish(job, error='RuntimeError: retry')
+    assert get_job(job.id).status == jobs.FAILED
+    assert queued('test_scheduled') == 1
@@ -3,4 +3,9 @@ from .override import client
 def test_read_main():
     response = client.get("/")
     assert response.status_code == 200
-    assert response.json() == {"message": "server is running"}
\ No newline at end of file
+    assert response.json() == {"message": "server is running"}
+
+def test_metrics():
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "# TYPE db_pool_checkout_seconds histogram" in response.text
@@ -0,0 +1,31 @@
+from app import serializers
+
+
+def test_json_serializer():
+    serializer = serializers.get_serializer('application/json')
+    assert serializer.render({"title": "é", "price": 1.5, "tags": [None, True]}) == \
+        '{"title":"é","price":1.5,"tags":[null,true]}'.encode('utf-8')
+
+def test_xml_serializer_document_shape():
+    serializer = serializers.get_serializer('application/xml')
+    content = {"title": "a<b> & 'c'", "id": 1, "price": 1.5, "verified": True, "cover_image": None,
+        "rows": [{"id": 2}], "1st": "x", "first name": "y", "@key": "z"}
+
+    assert serializer.render(content, 'books').decode() == (
+        '<?xml version="1.0" encoding="UTF-8" ?><books>'
+        '<title type="str">a&lt;b&gt; &amp; &apos;c&apos;</title>'
+        '<id type="int">1</id>'
+        '<price type="float">1.5</price>'
+        '<verified type="bool">True</verified>'
+        '<cover_image type="null"></cover_image>'
+        '<rows type="list"><item type="dict"><id type="int">2</id></item></rows>'
+        '<key name="1st" type="str">x</key>'
+        '<first_name type="str">y</first_name>'
+        '<key name="@key" type="str">z</key>'
+        '</books>'
+    )
+
+def test_xml_serializer_iter_render():
+    serializer = serializers.get_serializer('application/xml')
+    content = {"rows": [{"id": "1"}, {"id": "2"}], "summary": {"page": 1}}
+    assert ''.join(serializer.iter_render(content, 'books')).encode() == serializer.render(content, 'books')
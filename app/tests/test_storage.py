@@ -0,0 +1,155 @@
+import hashlib
+import os
+import pytest
+from .override import client, TestingSessionLocal
+from .. import blobs, models, storage
+from ..config import settings
+
+file = open("test_file.jpeg", "rb").read()
+sha256 = hashlib.sha256(file).hexdigest()
+
+
+def check_contract(backend, tmp_path):
+    name = "ab/cd/abcd.jpeg"
+    assert backend.stat(name) is None
+    assert not backend.exists(name)
+
+    # put_file consume file
+    source = tmp_path / "source"
+    source.write_bytes(b'0123456789')
+    backend.put_file(name, str(source))
+    assert not source.exists()
+
+    backend.put_bytes(f'{name}.gz', b'compressed')
+    size, mtime = backend.stat(name)
+    assert size == 10 and mtime > 0
+    assert backend.read(name) == b'0123456789'
+    with backend.open(name) as f:
+        f.seek(4)
+        assert f.read(3) == b'456'
+        assert f.read() == b'789'
+        f.seek(-2, os.SEEK_END)
+        assert f.read() == b'89'
+
+    target = tmp_path / "copy"
+    backend.download(name, str(target))
+    assert target.read_bytes() == b'0123456789'
+
+    # Object and its variants, not other objects
+    backend.put_bytes("ab/cd/other.jpeg", b'other')
+    assert backend.delete_prefix(name) == 2
+    assert not backend.exists(name) and not backend.exists(f'{name}.gz')
+    assert backend.exists("ab/cd/other.jpeg")
+
+def test_memory_storage(tmp_path):
+    check_contract(storage.MemoryStorage(), tmp_path)
+
+def test_local_storage(tmp_path):
+    backend = storage.LocalStorage(str(tmp_path / "blobs"))
+    check_contract(backend, tmp_path)
+    assert backend.local_path("ab/cd/other.jpeg") == str(tmp_path / "blobs" / "ab" / "cd" / "other.jpeg")
+
+def test_upload_url_local_storage():
+    digest = hashlib.sha256(b'new').hexdigest()
+    response = client.post("/api/file/upload-url", json={'sha256': digest, 'size': 3, 'extension': 'png'})
+    assert response.status_code == 501
+
+    # Refused upload leave no blob row
+    with TestingSessionLocal() as db:
+        assert db.get(models.Blob, f'{digest}.png') is None
+
+def test_upload_url_checks():
+    response = client.post("/api/file/upload-url", json={'sha256': sha256, 'size': len(file), 'extension': 'exe'})
+    assert response.status_code == 406
+
+    response = client.post("/api/file/upload-url", json={'sha256': sha256, 'size': settings.FILE_MAX_SIZE + 1, 'extension': 'jpeg'})
+    assert response.status_code == 413
+
+    response = client.post("/api/file/upload-url", json={'sha256': 'not hex', 'size': len(file), 'extension': 'jpeg'})
+    assert response.status_code == 422
+
+def test_getfile_memory_storage(monkeypatch):
+    monkeypatch.setattr(storage, 'backend', storage.MemoryStorage())
+    response = client.post("/api/file/upload", files={"file": ("test_file.jpeg", file, "image/jpeg")}, headers={"Accept": "application/json"})
+    url = response.json()['url']
+
+    # No presigned urls, app send bytes read from storage
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == file
+
+    response = client.get(url, headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.content == file[10:20]
+
+    response = client.get(url, headers={'If-None-Match': response.headers['etag']})
+    assert response.status_code == 304
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    moto = pytest.importorskip('moto')
+    requests = pytest.importorskip('requests')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    with moto.mock_aws():
+        backend = storage.S3Storage('test-bucket', region='us-east-1')
+        backend.client.create_bucket(Bucket='test-bucket')
+        monkeypatch.setattr(storage, 'backend', backend)
+        yield backend, requests
+
+def test_s3_storage(s3, tmp_path):
+    backend, _ = s3
+    check_contract(backend, tmp_path)
+
+def test_s3_upload_and_redirect(s3):
+    backend, _ = s3
+    response = client.post("/api/file/upload", files={"file": ("test_file.jpeg", file, "image/jpeg")}, headers={"Accept": "application/json"})
+    assert response.status_code == 201
+    key = blobs.key_of_url(response.json()['url'])
+    assert backend.read(blobs.object_name(key)) == file
+
+    # Storage send bytes, app only redirect
+    response = client.get(f"/api/file/getfile/{key}", allow_redirects=False)
+    assert response.status_code == 307
+    assert 'test-bucket' in response.headers['location']
+    assert 'max-age' in response.headers['cache-control']
+
+def test_s3_direct_upload(s3):
+    backend, requests = s3
+    contents = os.urandom(2048)
+    digest = hashlib.sha256(contents).hexdigest()
+
+    response = client.post("/api/file/upload-url", json={'sha256': digest, 'size': len(contents), 'extension': 'PNG'},
+        headers={"Accept": "application/json"})
+    assert response.status_code == 201
+    data = response.json()
+    assert data['key'] == f'{digest}.png'
+    upload = data['upload']
+    assert upload['method'] == 'PUT'
+    assert upload['headers']['Content-Length'] == str(len(contents))
+
+    # Complete before upload is refused
+    assert client.post("/api/file/upload-complete", json={'key': data['key']}).status_code == 404
+
+    assert requests.put(upload['url'], data=contents, headers=upload['headers']).status_code == 200
+    assert backend.read(blobs.object_name(data['key'])) == contents
+
+    response = client.post("/api/file/upload-complete", json={'key': data['key']}, headers={"Accept": "application/json"})
+    assert response.status_code == 200
+    assert response.json()['url'].endswith(data['key'])
+
+    # Variants jobs are enqueued on first completion only
+    with TestingSessionLocal() as db:
+        enqueued = db.query(models.Job).filter(models.Job.payload.contains(data['key'])).count()
+    assert enqueued == 2
+    assert client.post("/api/file/upload-complete", json={'key': data['key']}).status_code == 200
+    with TestingSessionLocal() as db:
+        assert db.query(models.Job).filter(models.Job.payload.contains(data['key'])).count() == enqueued
+
+    # Same content again need no upload
+    response = client.post("/api/file/upload-url", json={'sha256': digest, 'size': len(contents), 'extension': 'png'},
+        headers={"Accept": "application/json"})
+    assert response.status_code == 200
+    assert 'upload' not in response.json()
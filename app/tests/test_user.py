@@ -1,4 +1,7 @@
-from .override import client
+from sqlalchemy import event
+from .override import client, async_engine, TestingSessionLocal
+from ..models import User
+from ..oauth2 import principal_cache
 import xmltodict
 
 current_user_url = "/api/user/me"
@@ -22,3 +25,64 @@ def test_user_xml_me():
     data = data['user']
     assert data['email']['#text'] == 'tabish@gmail.com'
     assert data['username']['#text'] == 'tabish'
+
+def test_user_me_warm_cache_without_queries():
+    statements = []
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        principal_cache.clear()
+
+        # Cold cache load user once (require_user), route use principal without query
+        response = client.get(current_user_url, headers=json_content_type)
+        assert response.status_code == 200
+        assert len(statements) == 1
+
+        # Warm cache no query at all
+        statements.clear()
+        response = client.get(current_user_url, headers=json_content_type)
+        assert response.status_code == 200
+        assert response.json()['email'] == 'tabish@gmail.com'
+        assert len(statements) == 0
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count_statement)
+
+def test_user_me_cache_invalidated_on_update():
+    response = client.get(current_user_url, headers=json_content_type)
+    assert response.json()['photo'] == 'None'
+
+    with TestingSessionLocal() as db:
+        user = db.get(User, 1)
+        user.photo = 'photo.png'
+        db.commit()
+
+    response = client.get(current_user_url, headers=json_content_type)
+    assert response.status_code == 200
+    assert response.json()['photo'] == 'photo.png'
+
+def test_user_me_cache_invalidated_after_commit_only():
+    assert client.get(current_user_url, headers=json_content_type).status_code == 200
+
+    with TestingSessionLocal() as db:
+        user = db.get(User, 1)
+        user.username = 'renamed'
+        db.flush()
+        # Not committed, cached principal stay
+        assert principal_cache.get('1') is not None
+        db.rollback()
+    assert principal_cache.get('1') is not None
+
+    with TestingSessionLocal() as db:
+        user = db.get(User, 1)
+        user.username = 'renamed'
+        db.flush()
+        assert principal_cache.get('1') is not None
+        db.commit()
+    assert principal_cache.get('1') is None
+    assert client.get(current_user_url, headers=json_content_type).json()['username'] == 'renamed'
+
+    with TestingSessionLocal() as db:
+        db.get(User, 1).username = 'tabish'
+        db.commit()
@@ -1,7 +1,14 @@
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO, Tuple
 from uuid import uuid4
 from passlib.context import CryptContext
+from .config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes below configured cost factor are marked for update (rehash on login)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS, bcrypt__min_rounds=settings.BCRYPT_ROUNDS)
 
 def hash_password(password: str):
     return pwd_context.hash(password)
@@ -9,13 +16,46 @@ def hash_password(password: str):
 def verify_password(password: str, hashed_password: str):
     return pwd_context.verify(password, hashed_password)
 
+def verify_and_update_password(password: str, hashed_password: str):
+    return pwd_context.verify_and_update(password, hashed_password)
+
 def generate_filename(name: str):
     _ , ext = name.rsplit('.', 1)
     return (f"{uuid4()}.{ext}", ext)
 
-def write_file(path, contents):
-    with open(path, 'wb') as f:
-        f.write(contents)
+class FileTooLarge(ValueError):
+    pass
+
+def copy_to_temp(directory: str, source: BinaryIO, max_size: int, chunk_size: int = 65536) -> Tuple[str, int, str]:
+    """
+    Copy source in chunks to temp file in directory, return temp path, size
+    and sha256 hex digest, temp file is removed when copy fail
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    digest, size = hashlib.sha256(), 0
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while chunk := source.read(chunk_size):
+                size += len(chunk)
+                if size > max_size:
+                    raise FileTooLarge(f'file larger than {max_size} bytes')
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return temp_path, size, digest.hexdigest()
+
+def save_file(path: str, source: BinaryIO, max_size: int, chunk_size: int = 65536) -> Tuple[int, str]:
+    """
+    Copy source to path through temp file in same directory and rename it
+    in place, return size and sha256 hex digest of file
+    """
+    temp_path, size, sha256 = copy_to_temp(os.path.dirname(path), source, max_size, chunk_size)
+    os.replace(temp_path, path)
+    return size, sha256
 
 def model_to_dict(model, exclude=[]):
     new_dict = {}
@@ -24,10 +64,11 @@ def model_to_dict(model, exclude=[]):
             new_dict[column.name] = str(getattr(model, column.name))
     return new_dict
 
+def row_to_dict(row, exclude=[]):
+    return {name: str(value) for name, value in row._mapping.items() if name not in exclude}
+
+def schema_to_dict(schema, exclude=[]):
+    return {name: str(value) for name, value in schema if name not in exclude}
+
 def multiple_model_to_dict(models, exclude=[]):
-    array = []
-    total = 0
-    for model in models:
-        array.append(model_to_dict(model[0], exclude=exclude))
-        total = model[1]
-    return (array, total)
\ No newline at end of file
+    return [model_to_dict(model, exclude=exclude) for model in models]
@@ -0,0 +1,141 @@
+from typing import Any, Optional
+from xml.parsers import expat
+
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON, ModelField
+
+"""
+##### XML Request Parser #####
+
+Incremental expat parser fed with request body chunks, builds the same
+shape xmltodict did (repeated elements become list, empty element None,
+attributes ignored) without keeping raw body and parsed tree together.
+
+Hardened limits:
+: body size (XMLTooLarge)
+: element depth
+: no DOCTYPE, so no entity declarations (billion laughs) or external entities
+
+coerce map parsed strings to types of pydantic schema fields so validation
+get ready values, and wrap single elements in list for list fields
+
+"""
+
+class XMLError(ValueError):
+    pass
+
+class XMLTooLarge(XMLError):
+    pass
+
+
+class XMLParser:
+    def __init__(self, max_bytes: int, max_depth: int):
+        self.max_bytes = max_bytes
+        self.max_depth = max_depth
+        self.size = 0
+        self.stack = []
+        self.root = None
+
+        self.parser = expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_NEVER)
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.parser.CharacterDataHandler = self.text
+        self.parser.StartDoctypeDeclHandler = self.reject_doctype
+        self.parser.EntityDeclHandler = self.reject_doctype
+        self.parser.ExternalEntityRefHandler = self.reject_doctype
+
+    def reject_doctype(self, *args):
+        raise XMLError('DOCTYPE and entity declarations are not allowed')
+
+    def start(self, tag, attributes):
+        if len(self.stack) >= self.max_depth:
+            raise XMLError(f'xml deeper than {self.max_depth} elements')
+        # (tag, children, text parts)
+        self.stack.append((tag, {}, []))
+
+    def text(self, data):
+        self.stack[-1][2].append(data)
+
+    def end(self, tag):
+        tag, children, text = self.stack.pop()
+        value = children or (''.join(text).strip() or None)
+
+        if not self.stack:
+            self.root = value
+            return
+
+        # Repeated element become list
+        siblings = self.stack[-1][1]
+        if tag not in siblings:
+            siblings[tag] = value
+        elif isinstance(siblings[tag], list):
+            siblings[tag].append(value)
+        else:
+            siblings[tag] = [siblings[tag], value]
+
+    def feed(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise XMLTooLarge(f'xml larger than {self.max_bytes} bytes')
+        try:
+            self.parser.Parse(data, False)
+        except expat.ExpatError as e:
+            raise XMLError(str(e)) from e
+
+    def close(self):
+        """
+        End of document, return content of root element
+        """
+        try:
+            self.parser.Parse(b'', True)
+        except expat.ExpatError as e:
+            raise XMLError(str(e)) from e
+        return self.root
+
+
+def coerce_value(value: Any, type_: Any):
+    if isinstance(value, str):
+        if type_ is bool:
+            lowered = value.lower()
+            return True if lowered in ('true', '1', 'yes', 'on') else False if lowered in ('false', '0', 'no', 'off') else value
+        if type_ in (int, float):
+            try:
+                return type_(value)
+            except ValueError:
+                return value # left for validation error
+        return value
+
+    if isinstance(value, dict) and isinstance(type_, type) and issubclass(type_, BaseModel):
+        return coerce(value, type_)
+    return value
+
+def coerce_field(value: Any, field: Optional[ModelField]):
+    if field is None:
+        return value
+
+    if field.shape != SHAPE_SINGLETON:
+        # <books><book>..</book></books> envelope, one element is not a list yet
+        if isinstance(value, dict) and len(value) == 1:
+            value = next(iter(value.values()))
+        items = [] if value is None else value if isinstance(value, list) else [value]
+        return [coerce_value(item, field.type_) for item in items]
+
+    return coerce_value(value, field.type_)
+
+def coerce(value: Any, schema: Any = None):
+    """
+    Map parsed xml content to types of pydantic schema fields
+    """
+    if not (isinstance(schema, type) and issubclass(schema, BaseModel)):
+        return value
+
+    if schema.__custom_root_type__:
+        return coerce_field(value, schema.__fields__['__root__'])
+
+    if not isinstance(value, dict):
+        return value
+
+    fields = {field.alias: field for field in schema.__fields__.values()}
+    return {name: coerce_field(item, fields.get(name)) for name, item in value.items()}
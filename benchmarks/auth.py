@@ -0,0 +1,104 @@
+"""
+Benchmark authentication: require_user throughput with same access token
+(fastapi_jwt_auth AuthJWT parsing PEM key on every verification, preparsed
+keys, preparsed keys with verified token cache) and cost of signing and
+verifying one token per JWT algorithm
+
+Usage (from project root):
+
+    python -m benchmarks.auth [requests]
+    python -m benchmarks.auth 5000
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{tempfile.mkdtemp()}/auth.db")
+
+import fastapi_jwt_auth
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from starlette.requests import Request
+
+from app import database, models, oauth2
+from app.config import settings
+
+
+def token_subject(auth_class, token):
+    request = Request({'type': 'http', 'headers': [(b'authorization', f'Bearer {token}'.encode())]})
+    return oauth2.get_token_subject(request, auth_class(req=request))
+
+async def require_user(auth_class, token):
+    user_id = token_subject(auth_class, token)
+    async with database.AsyncSessionLocal() as db:
+        return await oauth2.require_user(user_id, db)
+
+async def measure(auth_class, token, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        token_subject(auth_class, token)
+    subject = requests / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await require_user(auth_class, token)
+    return subject, requests / (time.perf_counter() - start)
+
+def keys(algorithm):
+    if algorithm == 'EdDSA':
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    elif algorithm == 'ES256':
+        private_key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return private_key, private_key.public_key()
+
+def sign_and_verify(algorithm, rounds=500):
+    private_key, public_key = keys(algorithm)
+    claims = {'sub': '1', 'type': 'access', 'exp': int(time.time()) + 900}
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        token = jwt.encode(claims, private_key, algorithm=algorithm)
+    signed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        jwt.decode(token, public_key, algorithms=[algorithm])
+    verified = time.perf_counter() - start
+    return signed / rounds, verified / rounds
+
+async def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    models.Base.metadata.create_all(bind=database.engine, tables=[models.User.__table__])
+    with database.Session() as db:
+        db.add(models.User(username='bench', email='bench@example.com', password='-', verified=True))
+        db.commit()
+
+    token = oauth2.AuthJWT().create_access_token(subject='1', expires_time=timedelta(minutes=15))
+    await require_user(oauth2.AuthJWT, token) # principal cached, database out of measurement
+
+    print(f"require_user, {requests} requests with same {settings.JWT_ALGORITHM} access token")
+    print(f"{'case':>28} {'token/sec':>10} {'require_user/sec':>17}")
+    cases = [('AuthJWT (PEM every time)', fastapi_jwt_auth.AuthJWT, None),
+        ('preparsed keys', oauth2.AuthJWT, 0), ('preparsed keys + cache', oauth2.AuthJWT, settings.JWT_VERIFY_CACHE_SIZE)]
+    for name, auth_class, cache_size in cases:
+        if cache_size is not None:
+            oauth2.verified_tokens.maxsize = cache_size
+        subject, rate = await measure(auth_class, token, requests)
+        print(f"{name:>28} {subject:>10.0f} {rate:>17.0f}")
+
+    print()
+    print("one token (login sign 2, every uncached request verify 1)")
+    print(f"{'algorithm':>10} {'sign us':>9} {'verify us':>10}")
+    for algorithm in ('RS256', 'ES256', 'EdDSA'):
+        signed, verified = sign_and_verify(algorithm)
+        print(f"{algorithm:>10} {signed * 1e6:>9.0f} {verified * 1e6:>10.0f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+"""
+Benchmark book import: one add/commit/refresh per book (POST /books) vs
+bulk insert in a single transaction (POST /books/bulk)
+
+Usage (from project root):
+
+    python -m benchmarks.bulk [books]
+    python -m benchmarks.bulk 10000
+
+Use BENCH_DATABASE_URL to run against postgres (book table is dropped and
+recreated), default is a temporary SQLite file.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import bulk, models
+from app.database import async_database_url
+
+DATABASE_URL = os.environ.get('BENCH_DATABASE_URL') or f"sqlite:///{tempfile.mkdtemp()}/bulk.db"
+
+
+def book(index):
+    return dict(title=f'Book {index}', description=f'Description of book {index}', price=9.99)
+
+async def one_by_one(db, books):
+    for values in books:
+        new_book = models.Book(**values)
+        db.add(new_book)
+        await db.commit()
+        await db.refresh(new_book)
+
+async def in_bulk(db, books):
+    await bulk.insert_books(db, books)
+    await db.commit()
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    engine = create_engine(DATABASE_URL)
+    models.Base.metadata.drop_all(bind=engine, tables=[models.Book.__table__])
+    models.Base.metadata.create_all(bind=engine)
+
+    async_engine = create_async_engine(async_database_url(DATABASE_URL))
+    Session = sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
+
+    print(f"{'mode':>12} {'books':>8} {'seconds':>8} {'books/sec':>10}")
+    for name, insert in [('one by one', one_by_one), ('bulk', in_bulk)]:
+        async with Session() as db:
+            start = time.perf_counter()
+            await insert(db, [book(index) for index in range(total)])
+            elapsed = time.perf_counter() - start
+        print(f"{name:>12} {total:>8} {elapsed:>8.2f} {total / elapsed:>10.0f}")
+
+    await async_engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,55 @@
+"""
+Benchmark response compression: ratio and CPU cost per encoding and level
+
+Bodies are a rendered book listing page (XML, JSON, NDJSON) and the test
+cover image. br and zstd are skipped when brotli/zstandard are not installed.
+
+Usage (from project root):
+
+    python -m benchmarks.compression [books] [rounds]
+    python -m benchmarks.compression 100 20
+"""
+import sys
+import time
+
+from app import compression, serializers
+from benchmarks.serializers import page
+
+LEVELS = {'gzip': [1, 6, 9], 'br': [4, 11], 'zstd': [3, 19]}
+
+
+def bodies(books):
+    content = page(books)
+    ndjson = serializers.get_serializer('application/x-ndjson')
+    with open('test_file.jpeg', 'rb') as f:
+        cover = f.read()
+    return [
+        ('xml', serializers.get_serializer('application/xml').render(content, 'books')),
+        ('json', serializers.get_serializer('application/json').render(content)),
+        ('ndjson', ndjson.render(content['rows'], 'books')),
+        ('jpeg', cover),
+    ]
+
+def measure(body, encoding, level, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        compressed = compression.compress(body, encoding, level)
+    elapsed = (time.perf_counter() - start) / rounds
+    return len(compressed), elapsed
+
+def main():
+    books = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    print(f"{'body':>8} {'bytes':>9} {'encoding':>10} {'compressed':>10} {'ratio':>7} {'ms':>8} {'MB/sec':>8}")
+    for name, body in bodies(books):
+        for encoding in compression.ENCODINGS:
+            for level in LEVELS[encoding]:
+                size, elapsed = measure(body, encoding, level, rounds)
+                label = f'{encoding}-{level}'
+                print(f"{name:>8} {len(body):>9} {label:>10} {size:>10} {len(body) / size:>7.2f} "
+                      f"{elapsed * 1000:>8.2f} {len(body) / elapsed / 1e6:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
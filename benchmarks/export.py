@@ -0,0 +1,87 @@
+"""
+Benchmark book export: throughput and memory while streaming growing catalogs
+
+Catalog is grown to each size and exported through the ASGI app (body is
+discarded), peak RSS staying flat while rows grow 10x show export memory
+does not depend on number of rows.
+
+Usage (from project root):
+
+    python -m benchmarks.export [sizes] [format] [gzip]
+    python -m benchmarks.export 10000,100000,1000000 ndjson gzip
+
+Use BENCH_DATABASE_URL to run against postgres (book table is dropped and
+recreated), default is a temporary SQLite file.
+"""
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+
+DATABASE_URL = os.environ.get('BENCH_DATABASE_URL') or f"sqlite:///{tempfile.mkdtemp()}/export.db"
+os.environ['DATABASE_URL'] = DATABASE_URL
+
+from sqlalchemy import insert
+
+from app import models
+from app.database import engine
+from app.main import app
+
+
+def populate(start, total, batch=10000):
+    with engine.begin() as connection:
+        for offset in range(start, total, batch):
+            connection.execute(insert(models.Book), [
+                dict(title=f'Book {index}', description=f'Description of book {index}', price=9.99)
+                for index in range(offset, min(offset + batch, total))
+            ])
+
+async def export(format, compress):
+    size, disconnected = 0, asyncio.Event()
+
+    async def receive():
+        # Body is empty, then wait for disconnect which never come
+        if disconnected.is_set():
+            await asyncio.Event().wait()
+        disconnected.set()
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal size
+        if message['type'] == 'http.response.body':
+            size += len(message.get('body', b''))
+
+    headers = [(b'host', b'bench')] + ([(b'accept-encoding', b'gzip')] if compress else [])
+    scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'root_path': '',
+        'path': '/api/store/books/export', 'query_string': f'format={format}'.encode(), 'headers': headers,
+        'server': ('bench', 80), 'client': ('bench', 1)}
+    await app(scope, receive, send)
+    return size
+
+async def main():
+    # One event loop, pooled async connections are bound to it
+    sizes = [int(size) for size in (sys.argv[1] if len(sys.argv) > 1 else '10000,100000,1000000').split(',')]
+    format = sys.argv[2] if len(sys.argv) > 2 else 'ndjson'
+    compress = len(sys.argv) > 3 and sys.argv[3] == 'gzip'
+
+    models.Base.metadata.drop_all(bind=engine, tables=[models.Book.__table__])
+    models.Base.metadata.create_all(bind=engine)
+
+    print(f"{'rows':>10} {'MB sent':>10} {'rows/sec':>10} {'peak RSS MB':>12}")
+    current = 0
+    for total in sizes:
+        populate(current, total)
+        current = total
+
+        start = time.perf_counter()
+        size = await export(format, compress)
+        elapsed = time.perf_counter() - start
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{total:>10} {size / 1e6:>10.1f} {total / elapsed:>10.0f} {peak:>12.1f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""
+Benchmark serving uploaded images: 1000 concurrent requests through the ASGI
+app (no network), plain FileResponse (what getfile returned) vs getfile with
+full body, revalidation (304) and first 64KB range
+
+Usage (from project root):
+
+    python -m benchmarks.fileserve [concurrent] [rounds]
+    python -m benchmarks.fileserve 1000 5
+
+For numbers over real sockets run server and use benchmarks.load with headers:
+
+    python -m benchmarks.load http://127.0.0.1:8000/api/file/getfile/<key> 1000 30 "Range: bytes=0-65535"
+"""
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{tempfile.mkdtemp()}/fileserve.db")
+
+from fastapi.responses import FileResponse
+
+from app import blobs, models, storage
+from app.database import Session, engine
+from app.main import app
+
+
+async def request(asgi, path, headers):
+    size, status, disconnected = 0, None, asyncio.Event()
+
+    async def receive():
+        if disconnected.is_set():
+            await asyncio.Event().wait()
+        disconnected.set()
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal size, status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif message['type'] == 'http.response.body':
+            size += len(message.get('body', b''))
+
+    scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'root_path': '',
+        'path': path, 'query_string': b'', 'headers': [(b'host', b'bench'), *headers],
+        'server': ('bench', 80), 'client': ('bench', 1)}
+    await asyncio.wait_for(asgi(scope, receive, send), 60)
+    return status, size
+
+async def measure(asgi, path, headers, concurrent, rounds):
+    start = time.perf_counter()
+    sent = 0
+    for _ in range(rounds):
+        results = await asyncio.gather(*[request(asgi, path, headers) for _ in range(concurrent)])
+        sent += sum(size for _, size in results)
+    elapsed = time.perf_counter() - start
+    return results[0][0], concurrent * rounds / elapsed, sent / elapsed / 1e6
+
+async def main():
+    concurrent = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    models.Base.metadata.create_all(bind=engine, tables=[models.Blob.__table__])
+    with open('test_file.jpeg', 'rb') as f, Session() as db:
+        key, _ = blobs.store(db, io.BytesIO(f.read()), 'jpeg')
+    path = f'/api/file/getfile/{key}'
+    etag = f'"{key.split(".", 1)[0]}"'.encode()
+
+    async def plain_file_response(scope, receive, send):
+        await FileResponse(storage.backend.local_path(blobs.object_name(key)))(scope, receive, send)
+
+    cases = [
+        ('FileResponse', plain_file_response, []),
+        ('getfile', app, []),
+        ('getfile 304', app, [(b'if-none-match', etag)]),
+        ('getfile range', app, [(b'range', b'bytes=0-65535')]),
+    ]
+
+    print(f"{concurrent} concurrent requests, test_file.jpeg")
+    print(f"{'case':>14} {'status':>7} {'req/sec':>9} {'MB/sec':>9}")
+    for name, asgi, headers in cases:
+        status, rate, throughput = await measure(asgi, path, headers, concurrent, rounds)
+        print(f"{name:>14} {status:>7} {rate:>9.0f} {throughput:>9.1f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+"""
+Benchmark image variants: bytes a storefront page download for its covers
+(original upload vs WebP variant per size) and time to create variants
+
+Usage (from project root):
+
+    python -m benchmarks.images [image] [books per page]
+    python -m benchmarks.images test_file.jpeg 20
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from app import images
+from app.config import settings
+
+
+def main():
+    source = sys.argv[1] if len(sys.argv) > 1 else 'test_file.jpeg'
+    books = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, os.path.basename(source))
+        shutil.copy(source, path)
+
+        start = time.perf_counter()
+        written = images.make_variants(path, directory, settings.IMAGE_SIZES, settings.IMAGE_QUALITY, settings.IMAGE_MAX_PIXELS)
+        elapsed = time.perf_counter() - start
+
+        original = os.path.getsize(path)
+        print(f"{source}: variants created in {elapsed * 1000:.0f}ms (one process)")
+        print(f"{'size':>10} {'width':>6} {'bytes':>9} {'page KB':>9} {'saved':>7}")
+        print(f"{'original':>10} {'':>6} {original:>9} {original * books / 1024:>9.0f} {'':>7}")
+        for size, width in settings.IMAGE_SIZES.items():
+            print(f"{size:>10} {width:>6} {written[size]:>9} {written[size] * books / 1024:>9.0f} "
+                  f"{1 - written[size] / original:>7.1%}")
+
+
+if __name__ == '__main__':
+    main()
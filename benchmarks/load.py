@@ -0,0 +1,82 @@
+"""
+HTTP load test: requests/sec at fixed concurrency (keep-alive clients, stdlib only)
+
+Usage (server must be running):
+
+    python -m benchmarks.load [url] [concurrency] [seconds] [header ...]
+    python -m benchmarks.load "http://127.0.0.1:8000/api/store/books?page=1&per_page=20" 200 30
+
+Compare database modes by running server twice:
+
+    DATABASE_ASYNC=false uvicorn app.main:app --workers 1
+    DATABASE_ASYNC=true uvicorn app.main:app --workers 1
+"""
+import asyncio
+import statistics
+import sys
+import time
+from urllib.parse import urlsplit
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+
+    length = 0
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+
+    await reader.readexactly(length)
+    return status
+
+async def client(host, port, request, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                writer.write(request)
+                status = await read_response(reader)
+                latencies.append(time.perf_counter() - start)
+                if status >= 400:
+                    errors.append(status)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            # Count dropped connection and reconnect
+            errors.append(e.__class__.__name__)
+        finally:
+            writer.close()
+
+async def run(url, concurrency, seconds, headers):
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else '')
+    lines = [f"GET {path} HTTP/1.1", f"Host: {parts.netloc}", "Connection: keep-alive", *headers]
+    request = ('\r\n'.join(lines) + '\r\n\r\n').encode()
+
+    latencies, errors = [], []
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        client(parts.hostname, parts.port or 80, request, deadline, latencies, errors) for _ in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f"url          {url}")
+    print(f"concurrency  {concurrency}")
+    print(f"requests     {len(latencies)} ({len(errors)} errors)")
+    print(f"req/sec      {len(latencies) / elapsed:.1f}")
+    print(f"p50 ms       {percentiles[49] * 1000:.2f}")
+    print(f"p99 ms       {percentiles[98] * 1000:.2f}")
+
+def main():
+    url = sys.argv[1] if len(sys.argv) > 1 else 'http://127.0.0.1:8000/api/store/books?page=1&per_page=20'
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 30
+    headers = sys.argv[4:] or ['Content-Type: application/json']
+    asyncio.run(run(url, concurrency, seconds, headers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark password verification (login) throughput under concurrent load
+
+Compare bcrypt in the event loop (what an async route did), in the threadpool
+(sync route) and in the process pool hashing service, with event loop lag
+measured while verifications run.
+
+Usage (from project root):
+
+    python -m benchmarks.login [concurrency] [logins]
+    python -m benchmarks.login 50 200
+"""
+import asyncio
+import sys
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from app import utils
+from app.hashing import PasswordHasher
+
+PASSWORD = '12345678'
+
+
+async def measure_lag(stop: asyncio.Event, lags: list):
+    # Worst delay of a 10ms tick shows how long the loop was blocked
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - start - 0.01)
+
+async def run(name, verify, concurrency, logins, hashed):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with semaphore:
+            assert await verify(PASSWORD, hashed)
+
+    stop, lags = asyncio.Event(), []
+    ticker = asyncio.create_task(measure_lag(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*[login() for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+
+    print(f"{name:>12} {logins / elapsed:>12.1f} {max(lags or [0]) * 1000:>16.1f}")
+
+async def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    logins = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    hashed = utils.hash_password(PASSWORD)
+
+    hasher = PasswordHasher(workers=0, max_pending=concurrency)
+    await hasher.verify_and_update(PASSWORD, hashed) # start workers
+
+    async def event_loop(password, hashed):
+        return utils.verify_password(password, hashed)
+
+    async def threadpool(password, hashed):
+        return await run_in_threadpool(utils.verify_password, password, hashed)
+
+    async def process_pool(password, hashed):
+        valid, _ = await hasher.verify_and_update(password, hashed)
+        return valid
+
+    print(f"{'mode':>12} {'logins/sec':>12} {'max loop lag ms':>16}")
+    for name, verify in [('event loop', event_loop), ('threadpool', threadpool), ('process pool', process_pool)]:
+        await run(name, verify, concurrency, logins, hashed)
+
+    hasher.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
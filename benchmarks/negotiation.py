@@ -0,0 +1,43 @@
+"""
+Benchmark content negotiation: Accept parsing per call vs cached per header strings
+
+Usage (from project root):
+
+    python -m benchmarks.negotiation [calls]
+    python -m benchmarks.negotiation 200000
+"""
+import sys
+import time
+
+from app.custom import negotiate
+
+# (Accept, Content-Type) pairs as sent by browsers, http clients and the storefront
+HEADERS = [
+    ('text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8', None),
+    ('application/json, text/plain, */*', 'application/json'),
+    ('*/*', 'application/json'),
+    ('*/*', 'application/xml'),
+    ('application/msgpack', None),
+    (None, 'application/xml'),
+    ('application/xml;q=0.5, application/json;q=0.9', 'application/json; charset=utf-8'),
+]
+
+
+def measure(fn, calls):
+    start = time.perf_counter()
+    for index in range(calls):
+        fn(*HEADERS[index % len(HEADERS)])
+    return calls / (time.perf_counter() - start)
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    print(f"{'mode':>10} {'calls/sec':>12}")
+    for name, fn in [('parsed', negotiate.__wrapped__), ('cached', negotiate)]:
+        print(f"{name:>10} {measure(fn, calls):>12.0f}")
+
+    print(f"cache {negotiate.cache_info()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark token revocation check: time added to every authenticated request
+by denylist lookup (bloom filter hit or miss, database query for positives)
+and measured false positive rate
+
+Usage (from project root):
+
+    python -m benchmarks.revocation [revoked tokens] [lookups]
+    python -m benchmarks.revocation 100000 100000
+
+Use BENCH_DATABASE_URL for postgres, default is a temporary SQLite file.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', os.environ.get('BENCH_DATABASE_URL', f"sqlite:///{tempfile.mkdtemp()}/revocation.db"))
+
+from sqlalchemy import delete, insert
+
+from app import database, models, revocation
+from app.config import settings
+
+
+async def timed(check, jtis):
+    start = time.perf_counter()
+    for jti in jtis:
+        await check(jti)
+    return (time.perf_counter() - start) / len(jtis) * 1e6
+
+async def main():
+    revoked = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+
+    models.Base.metadata.create_all(bind=database.engine, tables=[models.RevokedToken.__table__])
+    now = datetime.now()
+    revoked_jtis = [str(uuid.uuid4()) for _ in range(revoked)]
+    with database.engine.begin() as connection:
+        connection.execute(delete(models.RevokedToken))
+        for start in range(0, revoked, 10000):
+            connection.execute(insert(models.RevokedToken), [
+                dict(jti=jti, expires_at=now + timedelta(hours=1), created_at=now) for jti in revoked_jtis[start:start + 10000]
+            ])
+
+    denylist = revocation.Denylist(settings.REVOCATION_BLOOM_CAPACITY, settings.REVOCATION_BLOOM_ERROR_RATE)
+    valid_jtis = [str(uuid.uuid4()) for _ in range(lookups)]
+
+    async with database.AsyncSessionLocal() as db:
+        start = time.perf_counter()
+        await denylist.sync(db)
+        loaded = time.perf_counter() - start
+
+        async def bloom_only(jti):
+            return jti in denylist.bloom
+
+        async def is_revoked(jti):
+            return await denylist.is_revoked(db, jti)
+
+        # Sync query stays out of measurement
+        denylist.next_sync = float('inf')
+        bloom = await timed(bloom_only, valid_jtis)
+        negative = await timed(is_revoked, valid_jtis)
+        positive = await timed(is_revoked, revoked_jtis[:min(2000, revoked)])
+
+    false_positives = sum(jti in denylist.bloom for jti in valid_jtis)
+    print(f"{revoked} revoked tokens, bloom filter {denylist.bloom.size / 8 / 1024:.0f}KB, "
+          f"{denylist.bloom.hashes} hashes, loaded in {loaded * 1000:.0f}ms")
+    print(f"{'lookup':>30} {'us':>8}")
+    print(f"{'bloom filter':>30} {bloom:>8.1f}")
+    print(f"{'is_revoked, not revoked':>30} {negative:>8.1f}")
+    print(f"{'is_revoked, revoked (query)':>30} {positive:>8.1f}")
+    print(f"false positives {false_positives / lookups:.2%} of not revoked tokens "
+          f"(REVOCATION_BLOOM_ERROR_RATE {settings.REVOCATION_BLOOM_ERROR_RATE:.2%})")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
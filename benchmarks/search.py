@@ -0,0 +1,85 @@
+"""
+Benchmark book search: LIKE '%term%' scan vs full text search index
+
+Usage (from project root):
+
+    python -m benchmarks.search [sizes] [queries]
+    python -m benchmarks.search 10000,100000,1000000 200
+
+Use BENCH_DATABASE_URL to run against postgres (database is dropped and recreated),
+default is a temporary SQLite file (FTS5).
+"""
+import os
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, func, insert, or_, select
+
+from app import models
+from app.search import filter_books
+
+VOCABULARY = [''.join(random.Random(index).choices(string.ascii_lowercase, k=7)) for index in range(20000)]
+
+
+def sentence(size):
+    return ' '.join(random.choices(VOCABULARY, k=size))
+
+def populate(engine, total, batch=10000):
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as connection:
+        for start in range(0, total, batch):
+            connection.execute(insert(models.Book), [
+                dict(title=sentence(4), description=sentence(30), price=10.0)
+                for _ in range(min(batch, total - start))
+            ])
+
+        if engine.dialect.name == 'postgresql':
+            connection.exec_driver_sql('ANALYZE book')
+
+def like_query(term):
+    return select(models.Book, func.count(models.Book.id).over().label('total')).group_by(models.Book.id).filter(
+        or_(models.Book.title.contains(term), models.Book.description.contains(term))).limit(20)
+
+def indexed_query(term, dialect):
+    query = select(models.Book, func.count(models.Book.id).over().label('total')).group_by(models.Book.id)
+    return filter_books(query, term, dialect).limit(20)
+
+def measure(engine, build, queries):
+    timings = []
+    with engine.connect() as connection:
+        for _ in range(queries):
+            term = random.choice(VOCABULARY)
+            start = time.perf_counter()
+            connection.execute(build(term)).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+
+    percentiles = statistics.quantiles(timings, n=100)
+    return percentiles[49], percentiles[98]
+
+def main():
+    sizes = [int(size) for size in (sys.argv[1] if len(sys.argv) > 1 else '10000,100000,1000000').split(',')]
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    url = os.environ.get('BENCH_DATABASE_URL')
+    if not url:
+        url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'search.db')}"
+    engine = create_engine(url)
+    dialect = engine.dialect.name
+
+    print(f"{'books':>10} {'query':>8} {'p50 ms':>10} {'p99 ms':>10}")
+    for size in sizes:
+        random.seed(size)
+        populate(engine, size)
+        for name, build in [('like', like_query), ('indexed', lambda term: indexed_query(term, dialect))]:
+            p50, p99 = measure(engine, build, queries)
+            print(f"{size:>10} {name:>8} {p50:>10.2f} {p99:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
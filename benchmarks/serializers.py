@@ -0,0 +1,72 @@
+"""
+Benchmark response serialization of a book listing page
+
+Compare stdlib json and dicttoxml (what CustomResponse.render used) with the
+orjson and streaming XML serializers, reported in MB/sec of rendered output.
+dicttoxml is skipped when not installed.
+
+Usage (from project root):
+
+    python -m benchmarks.serializers [books] [rounds]
+    python -m benchmarks.serializers 1000 50
+"""
+import collections
+import collections.abc
+import json
+import sys
+import time
+from datetime import datetime
+
+from app import pagination, serializers
+
+
+def page(books):
+    now = str(datetime.now())
+    rows = [dict(id=str(index), title=f'Book & title {index}', description='A <long> description ' * 10,
+        cover_image='None', price=str(9.99 + index), created_at=now, updated_at=now) for index in range(books)]
+    return dict(rows=rows, summary=pagination.page_summary(1, books, books * 10))
+
+def stdlib_json(content):
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(',', ':')).encode('utf-8')
+
+def dicttoxml_renderer():
+    # dicttoxml 1.7 use collections.Iterable removed in python 3.10
+    if not hasattr(collections, 'Iterable'):
+        collections.Iterable = collections.abc.Iterable
+    try:
+        from dicttoxml import dicttoxml
+    except ImportError:
+        return None
+    return lambda content: dicttoxml(obj=content, custom_root='books')
+
+def measure(render, content, rounds):
+    render(content)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        size = len(render(content))
+    elapsed = time.perf_counter() - start
+    return size, size * rounds / elapsed / 1e6, elapsed / rounds * 1000
+
+def main():
+    books = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    content = page(books)
+
+    renderers = [
+        ('json', 'json.dumps', stdlib_json),
+        ('json', 'orjson', lambda content: serializers.get_serializer('application/json').render(content)),
+        ('xml', 'dicttoxml', dicttoxml_renderer()),
+        ('xml', 'streaming', lambda content: serializers.get_serializer('application/xml').render(content, 'books')),
+    ]
+
+    print(f"{'format':>6} {'serializer':>12} {'bytes':>10} {'MB/sec':>10} {'ms/page':>10}")
+    for media, name, render in renderers:
+        if render is None:
+            print(f"{media:>6} {name:>12} {'skipped (not installed)':>32}")
+            continue
+        size, throughput, latency = measure(render, content, rounds)
+        print(f"{media:>6} {name:>12} {size:>10} {throughput:>10.1f} {latency:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
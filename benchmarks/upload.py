@@ -0,0 +1,54 @@
+"""
+Benchmark memory of writing an upload: whole file read into bytes (what
+upload did) vs chunked copy of utils.save_file
+
+Usage (from project root):
+
+    python -m benchmarks.upload [megabytes]
+    python -m benchmarks.upload 200
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from app import utils
+from app.config import settings
+
+
+def read_whole(source, path):
+    contents = source.read()
+    with open(path, 'wb') as f:
+        f.write(contents)
+
+def chunked(source, path):
+    utils.save_file(path, source, max_size=sys.maxsize, chunk_size=settings.FILE_CHUNK_SIZE)
+
+def measure(fn, source_path, path):
+    with open(source_path, 'rb') as source:
+        tracemalloc.start()
+        start = time.perf_counter()
+        fn(source, path)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return elapsed, peak
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    with tempfile.TemporaryDirectory() as directory:
+        source_path = os.path.join(directory, 'source')
+        with open(source_path, 'wb') as f:
+            for _ in range(megabytes):
+                f.write(os.urandom(1024 * 1024))
+
+        print(f"{'mode':>10} {'MB':>6} {'sec':>7} {'peak MB':>8}")
+        for name, fn in [('whole', read_whole), ('chunked', chunked)]:
+            elapsed, peak = measure(fn, source_path, os.path.join(directory, name))
+            print(f"{name:>10} {megabytes:>6} {elapsed:>7.2f} {peak / 1024 / 1024:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark parse + validate of bulk XML request bodies: xmltodict on whole
+body vs incremental XMLParser fed with request chunks and coerce
+
+Usage (from project root):
+
+    python -m benchmarks.xmlparse [megabytes]
+    python -m benchmarks.xmlparse 1
+"""
+import sys
+import time
+import tracemalloc
+
+import xmltodict
+
+from app import xmlparser
+from app.schema import BulkBookSchema, CreateBookSchema
+
+CHUNK_SIZE = 65536
+
+BOOK = (
+    "<book><title>Book {index}</title><description>Description of book {index} &amp; more</description>"
+    "<price>{index}.5</price></book>"
+)
+
+
+def payload(megabytes: float) -> bytes:
+    books, size, index = [], 0, 0
+    while size < megabytes * 1024 * 1024:
+        book = BOOK.format(index=index)
+        books.append(book)
+        size += len(book)
+        index += 1
+    return f"<books>{''.join(books)}</books>".encode()
+
+def validate(items):
+    return [CreateBookSchema(**item) for item in BulkBookSchema.parse_obj(items).__root__]
+
+def old_path(data: bytes):
+    # Whole body decoded and parsed, values left as strings for pydantic
+    return validate(xmltodict.parse(data.decode())['books']['book'])
+
+def new_path(data: bytes):
+    parser = xmlparser.XMLParser(max_bytes=len(data), max_depth=32)
+    for start in range(0, len(data), CHUNK_SIZE):
+        parser.feed(data[start:start + CHUNK_SIZE])
+    return validate(xmlparser.coerce(parser.close(), BulkBookSchema))
+
+def measure(fn, data):
+    start = time.perf_counter()
+    books = fn(data)
+    elapsed = time.perf_counter() - start
+
+    # Separate run, tracemalloc slow down parsing a lot
+    tracemalloc.start()
+    fn(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(books), elapsed, peak
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    data = payload(megabytes)
+    print(f"payload {len(data) / 1024 / 1024:.2f} MB")
+
+    print(f"{'path':>10} {'books':>8} {'ms':>8} {'MB/sec':>8} {'peak MB':>8}")
+    for name, fn in [('xmltodict', old_path), ('expat', new_path)]:
+        books, elapsed, peak = measure(fn, data)
+        print(f"{name:>10} {books:>8} {elapsed * 1000:>8.1f} {len(data) / 1024 / 1024 / elapsed:>8.1f} {peak / 1024 / 1024:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
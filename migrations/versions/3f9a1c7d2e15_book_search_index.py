@@ -0,0 +1,51 @@
+"""book search index
+
+Revision ID: 3f9a1c7d2e15
+Revises: b4e1b2533c63
+Create Date: 2026-10-18 10:12:41.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c7d2e15'
+down_revision = 'b4e1b2533c63'
+branch_labels = None
+depends_on = None
+
+# Expression must stay identical to app.search.book_document
+SEARCH_DOCUMENT = "to_tsvector('english'::regconfig, coalesce(title, '') || ' ' || coalesce(description, ''))"
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.execute(f"CREATE INDEX ix_book_search ON book USING GIN ({SEARCH_DOCUMENT})")
+
+    if dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE book_fts USING fts5(title, description, content='book', "
+            "content_rowid='id', tokenize='porter unicode61')")
+        op.execute("CREATE TRIGGER book_fts_ai AFTER INSERT ON book BEGIN "
+            "INSERT INTO book_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END")
+        op.execute("CREATE TRIGGER book_fts_ad AFTER DELETE ON book BEGIN "
+            "INSERT INTO book_fts(book_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); END")
+        op.execute("CREATE TRIGGER book_fts_au AFTER UPDATE ON book BEGIN "
+            "INSERT INTO book_fts(book_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+            "INSERT INTO book_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END")
+        op.execute("INSERT INTO book_fts(book_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX ix_book_search")
+
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER book_fts_au")
+        op.execute("DROP TRIGGER book_fts_ad")
+        op.execute("DROP TRIGGER book_fts_ai")
+        op.execute("DROP TABLE book_fts")
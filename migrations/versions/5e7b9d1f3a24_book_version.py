@@ -0,0 +1,24 @@
+"""book version
+
+Revision ID: 5e7b9d1f3a24
+Revises: 8c2d5e4b7a90
+Create Date: 2026-10-18 12:14:36.218093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e7b9d1f3a24'
+down_revision = '8c2d5e4b7a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('book', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('book', 'version')
@@ -0,0 +1,26 @@
+"""book keyset indexes
+
+Revision ID: 8c2d5e4b7a90
+Revises: 3f9a1c7d2e15
+Create Date: 2026-10-18 11:02:17.904466
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c2d5e4b7a90'
+down_revision = '3f9a1c7d2e15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_book_created_at_id', 'book', ['created_at', 'id'], unique=False)
+    op.create_index('ix_book_user_id_created_at_id', 'book', ['user_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_book_user_id_created_at_id', table_name='book')
+    op.drop_index('ix_book_created_at_id', table_name='book')
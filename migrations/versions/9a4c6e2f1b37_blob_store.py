@@ -0,0 +1,31 @@
+"""blob store
+
+Revision ID: 9a4c6e2f1b37
+Revises: 5e7b9d1f3a24
+Create Date: 2026-10-18 16:02:51.730415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c6e2f1b37'
+down_revision = '5e7b9d1f3a24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('blob',
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('refcount', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('uploaded_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('blob')
@@ -0,0 +1,31 @@
+"""job unique key
+
+Revision ID: a7d9c1e3f5b8
+Revises: f1c3a5e7b9d2
+Create Date: 2026-10-19 11:02:45.871204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d9c1e3f5b8'
+down_revision = 'f1c3a5e7b9d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('job', sa.Column('unique_key', sa.String(), nullable=True))
+    # Cleanup chains started before unique_key, one queued cleanup is kept
+    op.execute("UPDATE job SET status = 'failed', last_error = 'duplicate scheduled job', finished_at = CURRENT_TIMESTAMP WHERE name = 'cleanup' AND status = 'queued' "
+        "AND id <> (SELECT min(id) FROM job WHERE name = 'cleanup' AND status = 'queued')")
+    op.execute("UPDATE job SET unique_key = name WHERE name = 'cleanup' AND status = 'queued'")
+    op.create_index('ux_job_queued_unique_key', 'job', ['unique_key'], unique=True,
+        postgresql_where=sa.text("status = 'queued'"), sqlite_where=sa.text("status = 'queued'"))
+
+
+def downgrade() -> None:
+    op.drop_index('ux_job_queued_unique_key', table_name='job')
+    op.drop_column('job', 'unique_key')
@@ -0,0 +1,33 @@
+"""revoked token
+
+Revision ID: e6b8f0a2c4d1
+Revises: d31f7a9c5e02
+Create Date: 2026-10-18 21:12:44.318905
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b8f0a2c4d1'
+down_revision = 'd31f7a9c5e02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('revoked_token',
+    sa.Column('jti', sa.String(), nullable=False),
+    sa.Column('expires_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('jti')
+    )
+    op.create_index(op.f('ix_revoked_token_created_at'), 'revoked_token', ['created_at'], unique=False)
+    op.create_index(op.f('ix_revoked_token_expires_at'), 'revoked_token', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_revoked_token_expires_at'), table_name='revoked_token')
+    op.drop_index(op.f('ix_revoked_token_created_at'), table_name='revoked_token')
+    op.drop_table('revoked_token')
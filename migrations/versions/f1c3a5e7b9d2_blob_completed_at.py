@@ -0,0 +1,26 @@
+"""blob completed at
+
+Revision ID: f1c3a5e7b9d2
+Revises: e6b8f0a2c4d1
+Create Date: 2026-10-19 10:24:07.512390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c3a5e7b9d2'
+down_revision = 'e6b8f0a2c4d1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('blob', sa.Column('completed_at', sa.TIMESTAMP(timezone=True), nullable=True))
+    # Existing blobs were stored by upload, their variants jobs were enqueued
+    op.execute('UPDATE blob SET completed_at = uploaded_at')
+
+
+def downgrade() -> None:
+    op.drop_column('blob', 'completed_at')